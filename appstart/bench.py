@@ -0,0 +1,340 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A closed-loop HTTP load generator, for 'appstart bench'.
+
+A fixed number of workers each keep one connection open to the application
+and send requests back to back, so the load is `concurrency` requests in
+flight at all times. The latency of every request is recorded (requests
+sent during the warmup period are sent but not recorded), and the results
+are summarized as throughput and latency percentiles in a json-friendly
+dictionary, so that runs against different builds can be compared.
+
+compare_paths measures what the dev_appserver proxy costs: it sends the same
+load to the application's port and to the proxy's port at the same time
+(so both see the same application, in the same state), and reports the
+latency that the proxy adds at each percentile. Then it loads each port on
+its own, to find the throughput that each path can sustain.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import collections
+import httplib
+import math
+import socket
+import threading
+import time
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_DURATION = 10
+DEFAULT_WARMUP = 2
+DEFAULT_TIMEOUT = 10
+
+# The latency percentiles that are reported.
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Bounds (in seconds) of the delay before a worker reconnects after a
+# failed request. It doubles with each consecutive failure, so that workers
+# don't spin against an application that is down.
+MIN_BACKOFF = 0.05
+MAX_BACKOFF = 1
+
+
+def percentile(sorted_values, pct):
+    """Get a percentile of some values, by the nearest-rank method.
+
+    Args:
+        sorted_values: ([float, ...]) The values, in ascending order.
+        pct: (float) The percentile, between 0 and 100.
+
+    Returns:
+        (float or None) The smallest value such that at least pct percent
+        of the values are no greater. None if there are no values.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def percentile_name(pct):
+    """Name a percentile, e.g. 'p99' for 99 and 'p999' for 99.9."""
+    return 'p' + ('%g' % pct).replace('.', '')
+
+
+class _Worker(object):
+    """The measurements of one connection."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = collections.Counter()
+        self.errors = 0
+        self.last_done = None
+
+
+class LoadGenerator(object):
+    """Sends requests to an HTTP server from several threads."""
+
+    def __init__(self, host, port, path='/',
+                 concurrency=DEFAULT_CONCURRENCY,
+                 duration=DEFAULT_DURATION,
+                 requests=None,
+                 warmup=DEFAULT_WARMUP,
+                 timeout=DEFAULT_TIMEOUT):
+        """Initializer for LoadGenerator.
+
+        Args:
+            host: (basestring) The server's host.
+            port: (int) The server's port.
+            path: (basestring or [basestring, ...]) The path to GET, or a
+                mix of paths. Each connection requests the paths in turn,
+                starting from a different one.
+            concurrency: (int) The number of connections (and requests in
+                flight).
+            duration: (float) The number of seconds to send requests for,
+                after the warmup.
+            requests: (int or None) If given, stop after recording this
+                many requests, even if the duration isn't over.
+            warmup: (float) The number of seconds to send requests for
+                before recording them.
+            timeout: (float) The socket timeout of each connection.
+        """
+        self.host = host
+        self.port = port
+        self.paths = [path] if isinstance(path, basestring) else list(path)
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.warmup = warmup
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._remaining = None
+
+    def run(self):
+        """Generate the load, and summarize it.
+
+        Returns:
+            (dict) See summarize.
+        """
+        self._remaining = self.requests
+        start = time.time()
+        record_after = start + self.warmup
+        deadline = record_after + self.duration
+        workers = [_Worker() for _ in range(self.concurrency)]
+        threads = [threading.Thread(target=self._work,
+                                    args=(worker, i, record_after, deadline),
+                                    name='bench-{0}'.format(i))
+                   for i, worker in enumerate(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        done = [w.last_done for w in workers if w.last_done]
+        elapsed = (max(done) if done else time.time()) - record_after
+        return self.summarize(workers, max(elapsed, 0))
+
+    def _take_request(self):
+        """Count a request against the budget, if there is one."""
+        if self._remaining is None:
+            return True
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _work(self, worker, index, record_after, deadline):
+        conn = httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+        backoff = 0
+        try:
+            while True:
+                if backoff:
+                    time.sleep(max(min(backoff, deadline - time.time()), 0))
+                path = self.paths[index % len(self.paths)]
+                index += 1
+                sent = time.time()
+                if sent >= deadline:
+                    break
+                recording = sent >= record_after
+                if recording and not self._take_request():
+                    break
+                try:
+                    conn.request('GET', path)
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                except (socket.error, httplib.HTTPException):
+                    status = None
+                    conn.close()
+                    conn = httplib.HTTPConnection(self.host, self.port,
+                                                  timeout=self.timeout)
+                    backoff = min(max(backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+                else:
+                    backoff = 0
+                done = time.time()
+                if not recording:
+                    continue
+                if status is None:
+                    worker.errors += 1
+                else:
+                    worker.latencies.append(done - sent)
+                    worker.statuses[str(status)] += 1
+                worker.last_done = done
+        finally:
+            conn.close()
+
+    def summarize(self, workers, elapsed):
+        """Summarize the measurements.
+
+        Args:
+            workers: ([_Worker, ...]) The measurements.
+            elapsed: (float) The number of seconds that the recorded
+                requests took.
+
+        Returns:
+            (dict) The target, the paths, the load, the number of requests
+            (including errors), the number of errors (requests without a
+            response), the number of responses by status code, the
+            throughput in
+            responses per second, and the latencies of the responses in
+            milliseconds (percentiles, mean and max).
+        """
+        latencies = sorted(l for w in workers for l in w.latencies)
+        statuses = collections.Counter()
+        for worker in workers:
+            statuses.update(worker.statuses)
+        errors = sum(w.errors for w in workers)
+
+        latency_ms = dict(
+            (percentile_name(pct),
+             _ms(percentile(latencies, pct))) for pct in PERCENTILES)
+        latency_ms['mean'] = _ms(sum(latencies) / len(latencies)
+                                 if latencies else None)
+        latency_ms['max'] = _ms(latencies[-1] if latencies else None)
+
+        return {
+            'target': 'http://{0}:{1}'.format(self.host, self.port),
+            'paths': self.paths,
+            'concurrency': self.concurrency,
+            'duration_s': round(elapsed, 3),
+            'requests': len(latencies) + errors,
+            'errors': errors,
+            'statuses': dict(statuses),
+            'throughput_rps': (round(len(latencies) / elapsed, 2)
+                               if elapsed else 0.0),
+            'latency_ms': latency_ms,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def format_report(result):
+    """Describe a summary from LoadGenerator.run in a few lines of text."""
+    latency = result['latency_ms']
+    lines = ['{0}: {1} requests ({2} errors) in {3}s from {4} connections'
+             .format(result['target'], result['requests'], result['errors'],
+                     result['duration_s'], result['concurrency']),
+             'Throughput: {0} requests/s'.format(result['throughput_rps'])]
+    if latency['max'] is not None:
+        lines.append('Latency (ms): ' + ', '.join(
+            '{0} {1}'.format(name, latency[name])
+            for name in [percentile_name(p) for p in PERCENTILES] +
+            ['mean', 'max']))
+    return lines
+
+
+def run_together(generators):
+    """Run several load generators at the same time.
+
+    Args:
+        generators: ([LoadGenerator, ...]) The generators.
+
+    Returns:
+        ([dict, ...]) Their results, in the same order.
+    """
+    results = [None] * len(generators)
+
+    def run(i):
+        results[i] = generators[i].run()
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(generators))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def compare_paths(host, direct_port, proxy_port, **load_args):
+    """Measure the overhead of the dev_appserver proxy.
+
+    Args:
+        host: (basestring) The docker host.
+        direct_port: (int) The application's port.
+        proxy_port: (int) The proxy's port.
+        **load_args: (dict) Keyword arguments for both LoadGenerators.
+
+    Returns:
+        (dict) The results of each path under the shared load
+        ('concurrent') and on its own ('alone'), the latency that the proxy
+        adds at each percentile under the shared load, in milliseconds
+        ('proxy_overhead_ms'), and the throughput of each path on its own
+        ('throughput_ceiling_rps').
+    """
+    direct = LoadGenerator(host, direct_port, **load_args)
+    proxied = LoadGenerator(host, proxy_port, **load_args)
+    concurrent = run_together([direct, proxied])
+    alone = [direct.run(), proxied.run()]
+
+    overhead = {}
+    for name in concurrent[0]['latency_ms']:
+        direct_ms = concurrent[0]['latency_ms'][name]
+        proxy_ms = concurrent[1]['latency_ms'][name]
+        overhead[name] = (None if direct_ms is None or proxy_ms is None
+                          else round(proxy_ms - direct_ms, 3))
+    return {
+        'concurrent': {'direct': concurrent[0], 'proxy': concurrent[1]},
+        'alone': {'direct': alone[0], 'proxy': alone[1]},
+        'proxy_overhead_ms': overhead,
+        'throughput_ceiling_rps': {'direct': alone[0]['throughput_rps'],
+                                   'proxy': alone[1]['throughput_rps']},
+    }
+
+
+def format_comparison(result):
+    """Describe a result of compare_paths in a few lines of text."""
+    overhead = result['proxy_overhead_ms']
+    ceiling = result['throughput_ceiling_rps']
+    lines = []
+    for phase in ('concurrent', 'alone'):
+        for path in ('direct', 'proxy'):
+            lines.extend('{0}, {1}: {2}'.format(path, phase, line)
+                         for line in format_report(result[phase][path]))
+    if overhead['max'] is not None:
+        lines.append('Latency added by the proxy (ms): ' + ', '.join(
+            '{0} {1}'.format(name, overhead[name])
+            for name in [percentile_name(p) for p in PERCENTILES] +
+            ['mean']))
+    lines.append('Throughput ceiling: direct {0} requests/s, proxy {1} '
+                 'requests/s'.format(ceiling['direct'], ceiling['proxy']))
+    return lines
@@ -19,6 +19,7 @@
 # pylint: disable=bad-indentation
 
 import argparse
+from .. import bench
 from ..validator import contract
 
 
@@ -46,6 +47,18 @@ class StorePortMapAction(argparse.Action):
         setattr(namespace, self.dest, result)
 
 
+def positive_int(value):
+    """Argument type for options that take a number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid int value: {0!r}'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
+
+
 def make_appstart_parser():
     """Make an argument parser to take in command line arguments.
 
@@ -61,6 +74,7 @@ def make_appstart_parser():
     run_parser = subparsers.add_parser('run',
                                        help='Run a Managed VM application')
     add_appstart_args(run_parser)
+    add_run_args(run_parser)
 
     init_parser = subparsers.add_parser('init',
                                         help='Initialize the Docker '
@@ -69,6 +83,19 @@ def make_appstart_parser():
                                         '"appstart run"')
     add_init_args(init_parser)
 
+    reload_parser = subparsers.add_parser(
+        'reload',
+        help='Rebuild and restart the application of a running "appstart '
+        'run", without restarting the api server.')
+    add_reload_args(reload_parser)
+
+    bench_parser = subparsers.add_parser(
+        'bench',
+        help='Run the application, measure its throughput and latency '
+        'under load, and stop it.')
+    add_bench_args(bench_parser)
+    add_appstart_args(bench_parser)
+
     validate_parser = subparsers.add_parser('validate')
     validate_parser.set_defaults(parser_type='validate')
     add_validate_args(validate_parser)
@@ -76,6 +103,83 @@ def make_appstart_parser():
     return parser
 
 
+def add_run_args(parser):
+    """Adds command line arguments for 'appstart run' only."""
+    parser.add_argument('--watch',
+                        action='store_true',
+                        dest='watch',
+                        help='Watch the application directory, and rebuild '
+                        'and replace the containers that a change affects '
+                        'as soon as files are saved. Changes in the '
+                        'application directory rebuild the application '
+                        'image; changes to the config file or static files '
+                        'also rebuild the devappserver image.')
+    parser.set_defaults(watch=False)
+
+
+def add_bench_args(parser):
+    """Adds command line arguments for 'appstart bench'."""
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=bench.DEFAULT_CONCURRENCY,
+                        help='The number of connections to send requests '
+                        'on (and so the number of requests in flight).')
+    parser.add_argument('--duration',
+                        type=float,
+                        default=bench.DEFAULT_DURATION,
+                        help='How many seconds to send requests for, after '
+                        'the warmup.')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=None,
+                        help='Stop after this many requests, even if the '
+                        'duration is not over.')
+    parser.add_argument('--warmup',
+                        type=float,
+                        default=bench.DEFAULT_WARMUP,
+                        help='How many seconds to send requests for before '
+                        'measuring them.')
+    parser.add_argument('--path',
+                        action='append',
+                        dest='paths',
+                        default=None,
+                        help='A path to request (by default, /). Give more '
+                        'than once to request a mix of paths, in turn.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--through_proxy',
+                        action='store_true',
+                        dest='through_proxy',
+                        help='Send requests through the dev_appserver proxy '
+                        'port rather than directly to the application.')
+    target.add_argument('--compare',
+                        action='store_true',
+                        dest='compare',
+                        help='Measure the overhead of the dev_appserver '
+                        'proxy: load the application directly and through '
+                        'the proxy at the same time, report the latency '
+                        'the proxy adds, then load each path on its own to '
+                        'find its throughput ceiling.')
+    parser.set_defaults(through_proxy=False, compare=False)
+    parser.add_argument('--output',
+                        default=None,
+                        help='Write the results to this file as json. By '
+                        'default, they are printed to stdout.')
+
+
+def add_reload_args(parser):
+    """Adds command line arguments for 'appstart reload'."""
+    parser.add_argument('--image_name',
+                        default=None,
+                        help='The image that the application to reload was '
+                        'run with (if it was run without a config file).')
+    parser.add_argument('config_file',
+                        nargs='?',
+                        default=None,
+                        help='The config file that the application to reload '
+                        'was run with. May be omitted if only one '
+                        'application is running.')
+
+
 def add_validate_args(parser):
     """Adds command line arguments for the validator.
 
@@ -94,6 +198,22 @@ def add_validate_args(parser):
     parser.add_argument('--tags',
                         nargs='*',
                         help='Tag names of the tests to run')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=1,
+                        help='The maximum number of clauses to evaluate at '
+                        'once. Clauses of the same lifecycle point that do '
+                        'not depend on each other are evaluated concurrently. '
+                        'Results are reported in the same order regardless. '
+                        'Defaults to 1.')
+    parser.add_argument('--log_sample',
+                        type=int,
+                        default=0,
+                        metavar='LINES',
+                        help='Check large log files by sampling this many of '
+                        'their lines at random, rather than reading them in '
+                        'full. Match rates are then estimates. Defaults to 0 '
+                        '(check every line).')
     parser.add_argument('--verbose',
                         action='store_true',
                         dest='verbose',
@@ -198,6 +318,66 @@ def add_appstart_args(parser):
                         help='How many seconds to wait for the application '
                         'to start listening on port 8080. Defaults to 30 '
                         'seconds.')
+    parser.add_argument('--instances',
+                        type=int,
+                        default=1,
+                        help='The number of instances of the application to '
+                        'run. With more than one, a load balancer sends each '
+                        'connection to the instance with the fewest open '
+                        'connections. Needs a pinger image built by this '
+                        'version of appstart (run "appstart init").')
+    parser.add_argument('--module',
+                        action='append',
+                        dest='modules',
+                        metavar='CONFIG_FILE',
+                        help='The config file of another module of the '
+                        'application, to run next to the main one against '
+                        'the same api server. Can be given several times. '
+                        'Modules are published on consecutive ports after '
+                        '--application_port.')
+    parser.add_argument('--dispatch',
+                        dest='dispatch_file',
+                        metavar='DISPATCH_YAML',
+                        help='A dispatch.yaml file. Its rules are checked '
+                        'against the modules that run, and listed with their '
+                        'addresses.')
+    parser.add_argument('--app_limit',
+                        action='append',
+                        dest='app_limits',
+                        metavar='KEY=VALUE',
+                        help='A resource limit for the application '
+                        'containers. Can be given several times. Keys: '
+                        'memory (e.g. 512m), memory_swap, cpu_shares, cpus '
+                        '(e.g. 1.5), cpu_quota, cpu_period, cpuset (e.g. '
+                        '0-1) and ulimit (e.g. nofile=1024:2048). The limits '
+                        'that Docker applied are logged once the application '
+                        'is live.')
+    parser.add_argument('--devappserver_limit',
+                        action='append',
+                        dest='devappserver_limits',
+                        metavar='KEY=VALUE',
+                        help='A resource limit for the devappserver '
+                        'container, like --app_limit.')
+    parser.add_argument('--image_cache_size',
+                        type=positive_int,
+                        default=5,
+                        help='Appstart tags the images it builds with a '
+                        'digest of their contents, and reuses them on later '
+                        'runs if nothing has changed. This option specifies '
+                        'how many such images to keep around. Defaults to 5.')
+    parser.add_argument('--build_compression',
+                        type=int,
+                        default=0,
+                        choices=range(10),
+                        help='The gzip compression level (1-9) to use for '
+                        'build contexts that appstart sends to the Docker '
+                        'daemon. Compression helps with remote Docker hosts. '
+                        'Defaults to 0 (no compression).')
+    parser.add_argument('--trace_file',
+                        default=None,
+                        help='Where to write the startup trace when '
+                        '--profile_startup is given. Defaults to a '
+                        'timestamped file in the temporary directory.')
     parser.add_argument('config_file',
                         nargs='?',
                         default=None,
@@ -221,6 +401,35 @@ def add_appstart_args(parser):
                         'datastore, logging, etc.')
     parser.set_defaults(run_api_server=True)
 
+    parser.add_argument('--profile_startup',
+                        action='store_true',
+                        dest='profile_startup',
+                        help='Trace the steps of startup, including every '
+                        'Docker API call. A waterfall summary is printed '
+                        'once the application is up, and the trace is '
+                        'written to --trace_file in the Chrome trace format.')
+    parser.set_defaults(profile_startup=False)
+
+    parser.add_argument('--reuse',
+                        action='store_true',
+                        dest='reuse',
+                        help='Keep the devappserver container running when '
+                        'appstart exits, and reuse it the next time appstart '
+                        'runs with the same configuration. This saves the '
+                        'time it takes devappserver to boot. Has no effect '
+                        'with --clear_datastore.')
+    parser.set_defaults(reuse=False)
+
+    parser.add_argument('--mount_static',
+                        action='store_true',
+                        dest='mount_static',
+                        help='Bind the static directories into the '
+                        'devappserver container (read-only) instead of '
+                        'copying them into the devappserver image. Edits to '
+                        'static files are then served right away, without a '
+                        'rebuild.')
+    parser.set_defaults(mount_static=False)
+
     parser.add_argument('--force_version',
                         action='store_true',
                         dest='force_version',
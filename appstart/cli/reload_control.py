@@ -0,0 +1,178 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Let 'appstart reload' reach a running 'appstart run'.
+
+Each 'appstart run' writes a pidfile to RUN_DIR, named after the
+application it runs, and reloads its application when it receives
+SIGUSR1. 'appstart reload' finds the pidfile and sends the signal. (SIGHUP
+would be the usual choice, but it also means that the terminal was closed,
+which should end 'appstart run' rather than reload it.)
+
+The running process holds a lock on its pidfile, which the OS releases when
+the process dies. A pidfile that isn't locked was left behind by a process
+that crashed, and its pid may belong to an unrelated process by now, so it's
+removed rather than signalled.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import signal
+import tempfile
+import threading
+
+from .. import utils
+
+
+# Directory where running appstart processes register themselves.
+RUN_DIR = os.environ.get('APPSTART_RUN_DIR',
+                         os.path.expanduser('~/.appstart/run'))
+
+
+def app_key(config_file=None, image_name=None):
+    """Identify the application that an 'appstart run' runs."""
+    if config_file:
+        return os.path.abspath(config_file)
+    return 'image:{0}'.format(image_name)
+
+
+def _pidfile(key):
+    return os.path.join(RUN_DIR,
+                        hashlib.sha1(key).hexdigest()[:16] + '.pid')
+
+
+@contextlib.contextmanager
+def reload_requests(key):
+    """Register this process as running an application.
+
+    Args:
+        key: (basestring) The application's key, from app_key.
+
+    Yields:
+        (threading.Event) An event that is set whenever a reload is
+        requested. The caller should clear it before reloading.
+    """
+    requested = threading.Event()
+
+    # There's no SIGUSR1 on Windows, so there's no reloading either.
+    if not hasattr(signal, 'SIGUSR1'):
+        yield requested
+        return
+
+    prev = signal.signal(signal.SIGUSR1,
+                         lambda signo, frame: requested.set())
+    try:
+        os.makedirs(RUN_DIR)
+    except OSError:
+        if not os.path.isdir(RUN_DIR):
+            raise
+    # The pidfile is locked before it's moved into place, so that it's
+    # never seen unlocked.
+    path = _pidfile(key)
+    fd, temp_path = tempfile.mkstemp(dir=RUN_DIR, suffix='.tmp')
+    pidfile = os.fdopen(fd, 'w')
+    fcntl.flock(pidfile, fcntl.LOCK_EX)
+    json.dump({'pid': os.getpid(), 'app': key}, pidfile)
+    pidfile.flush()
+    os.rename(temp_path, path)
+    try:
+        yield requested
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        pidfile.close()
+        signal.signal(signal.SIGUSR1, prev)
+
+
+def _is_locked(pidfile):
+    """Check whether another process holds the lock on a pidfile."""
+    try:
+        fcntl.flock(pidfile, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except IOError as err:
+        if err.errno in (errno.EAGAIN, errno.EACCES):
+            return True
+        raise
+    fcntl.flock(pidfile, fcntl.LOCK_UN)
+    return False
+
+
+def _running():
+    """Find the running appstart processes.
+
+    Returns:
+        ({basestring: int}) The pids of the processes, keyed by the key of
+        the application they run. Pidfiles that no process holds a lock on
+        are removed.
+    """
+    running = {}
+    try:
+        names = os.listdir(RUN_DIR)
+    except OSError:
+        return running
+    for name in names:
+        if not name.endswith('.pid'):
+            continue
+        path = os.path.join(RUN_DIR, name)
+        try:
+            with open(path) as f:
+                if not _is_locked(f):
+                    os.remove(path)
+                    continue
+                entry = json.load(f)
+            running[entry['app']] = entry['pid']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            continue
+    return running
+
+
+def request_reload(config_file=None, image_name=None):
+    """Ask a running 'appstart run' to reload its application.
+
+    Args:
+        config_file: (basestring or None) The config file that the
+            application was run with.
+        image_name: (basestring or None) The image that the application
+            was run with, if it was run without a config file.
+
+    Raises:
+        utils.AppstartAbort: If there's no such process. If neither
+            argument is given, and there's not exactly one running
+            application.
+    """
+    running = _running()
+    if config_file or image_name:
+        key = app_key(config_file, image_name)
+        if key not in running:
+            raise utils.AppstartAbort(
+                'No running appstart found for {0}.'.format(key))
+    elif len(running) == 1:
+        key = running.keys()[0]
+    elif not running:
+        raise utils.AppstartAbort('No running appstart found.')
+    else:
+        raise utils.AppstartAbort(
+            'Several applications are running. Specify which one to '
+            'reload:\n  {0}'.format('\n  '.join(sorted(running))))
+
+    os.kill(running[key], signal.SIGUSR1)
+    utils.get_logger().info('Requested a reload of %s', key)
@@ -21,21 +21,151 @@ containers.
 # This file conforms to the external style guide
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import json
 import logging
 import os
 import sys
+import threading
 import time
 import warnings
 
+import docker
+import requests
+
+from .. import bench
 from .. import constants
 from .. import devappserver_init
 from .. import pinger
 from .. import utils
 from ..sandbox import container_sandbox
+from ..sandbox import file_watcher
 from ..validator import contract
 from ..validator import runtime_contract
 
 import parsing
+import reload_control
+
+
+def reload_sandbox(sandbox, changes=None):
+    """Reload the sandbox's application, reporting (not raising) failures.
+
+    If the new application doesn't start, or docker fails along the way,
+    appstart keeps running, so that the application can be fixed and
+    reloaded again.
+
+    Args:
+        sandbox: (container_sandbox.ContainerSandbox) The running sandbox.
+        changes: (set or None) The files that changed, if the reload was
+            triggered by --watch. Only the images that the changes affect
+            are rebuilt. If None, the application is rebuilt and replaced
+            unconditionally.
+    """
+    start = time.time()
+    try:
+        if changes is None:
+            sandbox.reload()
+        else:
+            kinds = file_watcher.classify(changes, sandbox.config_files(),
+                                          sandbox.static_dirs())
+            utils.get_logger().info('%d file(s) changed (%s)', len(changes),
+                                    ', '.join(sorted(kinds)))
+            # Mounted static files are served as soon as they're saved.
+            mounted = []
+            if sandbox.mount_static and sandbox.run_devappserver:
+                kinds.discard(file_watcher.STATIC)
+                mounted = sandbox.static_dirs()
+            # The application images are built from their whole
+            # directories, config and static files included.
+            app = (file_watcher.CODE in kinds or
+                   not sandbox.run_devappserver or
+                   file_watcher.any_inside(changes, sandbox.app_dirs(),
+                                           exclude=mounted))
+            devappserver = bool(kinds & set([file_watcher.CONFIG,
+                                             file_watcher.STATIC]))
+            if not (app or devappserver):
+                return
+            sandbox.reload(app=app, devappserver=devappserver, force=False)
+    except utils.AppstartAbort as err:
+        utils.get_logger().warning('Reload failed: %s', err.message)
+    except (docker.errors.DockerException,
+            requests.exceptions.RequestException) as err:
+        utils.get_logger().warning('Reload failed: docker error: %s', err)
+    else:
+        utils.get_logger().info('Reload took %.1fs', time.time() - start)
+
+
+def watch_sandbox(sandbox, requested):
+    """Request a reload of the sandbox whenever its files change.
+
+    Args:
+        sandbox: (container_sandbox.ContainerSandbox) The running sandbox.
+        requested: (threading.Event) The event to set when files change.
+
+    Returns:
+        (file_watcher.FileWatcher, callable) The started watcher, and a
+        function that returns (and forgets) the paths that changed since
+        it was last called.
+    """
+    lock = threading.Lock()
+    changes = set()
+
+    def on_change(paths):
+        with lock:
+            changes.update(paths)
+        requested.set()
+
+    def take_changes():
+        with lock:
+            taken = set(changes)
+            changes.clear()
+        return taken
+
+    watcher = file_watcher.FileWatcher(sandbox.watched_dirs(), on_change)
+    watcher.start()
+    utils.get_logger().info('Watching %s for changes',
+                            ', '.join(sandbox.watched_dirs()))
+    return watcher, take_changes
+
+
+def run_bench(sandbox_args, load_args, through_proxy=False, compare=False):
+    """Start a sandbox, put its application under load, and stop it.
+
+    Args:
+        sandbox_args: (dict) Keyword arguments for the ContainerSandbox.
+        load_args: (dict) Keyword arguments for the bench.LoadGenerator.
+        through_proxy: (bool) Whether to send the requests through the
+            dev_appserver proxy instead of to the application's port.
+        compare: (bool) Whether to measure both paths, and the overhead of
+            the proxy, with bench.compare_paths.
+
+    Raises:
+        utils.AppstartAbort: If the application can't be benchmarked.
+
+    Returns:
+        (dict) The results of bench.LoadGenerator.run (or of
+        bench.compare_paths), with the images that were measured (so that
+        results can be compared across builds).
+    """
+    with container_sandbox.ContainerSandbox(**sandbox_args) as sandbox:
+        if (through_proxy or compare) and not sandbox.run_devappserver:
+            raise utils.AppstartAbort('--{0} needs the api server.'.format(
+                'compare' if compare else 'through_proxy'))
+        host = sandbox.app_container.host
+        if compare:
+            utils.get_logger().info('Comparing %s:%d with the proxy at '
+                                    '%s:%d', host, sandbox.port, host,
+                                    sandbox.proxy_port)
+            result = bench.compare_paths(host, sandbox.port,
+                                         sandbox.proxy_port, **load_args)
+        else:
+            port = sandbox.proxy_port if through_proxy else sandbox.port
+            utils.get_logger().info('Benchmarking %s:%d', host, port)
+            result = bench.LoadGenerator(host, port, **load_args).run()
+        result['app_image'] = sandbox.app_image
+        result['devappserver_image'] = sandbox.devappserver_image
+        result['instances'] = sandbox.instances
+        result['limits'] = sandbox.applied_limits()
+    return result
 
 
 def main():
@@ -70,12 +200,61 @@ def main():
                 # Suppress the InsecurePlatformWarning generated by urllib3
                 # see: http://stackoverflow.com/questions/29134512/
                 warnings.simplefilter('ignore')
-                with container_sandbox.ContainerSandbox(**args):
-                    while True:
-                        # Sleeping like this is hacky, but it works. Note
-                        # that signal.pause is not compatible with Windows...
-                        time.sleep(10000)
+                watch = args.pop('watch')
+                if watch and not args['config_file']:
+                    utils.get_logger().warning(
+                        '--watch needs a config file. Not watching.')
+                key = reload_control.app_key(args['config_file'],
+                                             args['image_name'])
+                with container_sandbox.ContainerSandbox(**args) as sandbox:
+                    with reload_control.reload_requests(key) as requested:
+                        watcher = take_changes = None
+                        if watch and args['config_file']:
+                            watcher, take_changes = watch_sandbox(sandbox,
+                                                                  requested)
+                        try:
+                            while True:
+                                # Waiting like this is hacky, but it works.
+                                # Note that signal.pause is not compatible
+                                # with Windows...
+                                requested.wait(1)
+                                if requested.is_set():
+                                    requested.clear()
+                                    changes = take_changes and take_changes()
+                                    reload_sandbox(sandbox, changes or None)
+                        finally:
+                            if watcher:
+                                watcher.stop()
+
+        except KeyboardInterrupt:
+            utils.get_logger().info('Exiting')
+            sys.exit(0)
+        except utils.AppstartAbort as err:
+            if err.message:
+                utils.get_logger().warning(str(err.message))
+            sys.exit(1)
+
+    # In response to 'appstart reload', signal a running 'appstart run'.
+    elif parser_type == 'reload':
+        try:
+            reload_control.request_reload(args['config_file'],
+                                          args['image_name'])
+        except utils.AppstartAbort as err:
+            utils.get_logger().warning(str(err.message))
+            sys.exit(1)
 
+    # In response to 'appstart bench', run the application under load.
+    elif parser_type == 'bench':
+        load_args = dict((name, args.pop(name)) for name in
+                         ('concurrency', 'duration', 'requests', 'warmup'))
+        load_args['path'] = args.pop('paths') or '/'
+        through_proxy = args.pop('through_proxy')
+        compare = args.pop('compare')
+        output = args.pop('output')
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                result = run_bench(args, load_args, through_proxy, compare)
         except KeyboardInterrupt:
             utils.get_logger().info('Exiting')
             sys.exit(0)
@@ -84,6 +263,15 @@ def main():
                 utils.get_logger().warning(str(err.message))
             sys.exit(1)
 
+        report = bench.format_comparison if compare else bench.format_report
+        for line in report(result):
+            utils.get_logger().info(line)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+        else:
+            print json.dumps(result, indent=2, sort_keys=True)
+
     # In response to 'appstart validate', attempt to perform validation.
     elif parser_type == 'validate':
         logfile = args.pop('log_file')
@@ -91,6 +279,8 @@ def main():
         tags = args.pop('tags')
         verbose = args.pop('verbose')
         list_clauses = args.pop('list_clauses')
+        jobs = args.pop('jobs')
+        log_sample = args.pop('log_sample')
         success = False
         utils.get_logger().setLevel(logging.INFO)
         try:
@@ -100,7 +290,8 @@ def main():
                 if list_clauses:
                     validator.list_clauses()
                     sys.exit(0)
-                success = validator.validate(tags, threshold, logfile, verbose)
+                success = validator.validate(tags, threshold, logfile, verbose,
+                                             jobs, log_sample)
         except KeyboardInterrupt:
             utils.get_logger().info('Exiting')
         except utils.AppstartAbort as err:
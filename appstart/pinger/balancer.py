@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation
+
+"""Spreads connections over several instances of the application.
+
+Usage: balancer.py PORT BACKEND [BACKEND ...]
+
+Each BACKEND is a host:port at which an instance of the application
+listens. The balancer listens on PORT and forwards every connection it
+accepts to the backend with the fewest open connections (taking turns among
+backends that are tied). If a backend refuses a connection, it's skipped for
+DOWN_TIME seconds, and the connection goes to the next backend.
+
+When appstart runs more than one instance of the application, it runs the
+balancer in a container on devappserver's network stack, listening on 8080,
+where devappserver and the published application port expect to find the
+application. It's part of the pinger image, since that image has python.
+"""
+
+import logging
+import socket
+import sys
+import threading
+import time
+
+# Seconds for which a backend that refused a connection is skipped.
+DOWN_TIME = 5
+
+# Seconds to wait for a backend to accept a connection.
+CONNECT_TIMEOUT = 2
+
+BUFFER_SIZE = 64 * 1024
+
+
+class Backend(object):
+    """An instance of the application."""
+
+    def __init__(self, address):
+        host, _, port = address.rpartition(':')
+        self.address = (host, int(port))
+        self.active = 0
+        self.down_until = 0
+
+
+class Balancer(object):
+    """Picks backends, least connections first."""
+
+    def __init__(self, backends):
+        """Initializer for Balancer.
+
+        Args:
+            backends: ([basestring, ...]) The backends, as host:port.
+        """
+        self.backends = [Backend(address) for address in backends]
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self, exclude=()):
+        """Pick a backend for a new connection, and count the connection.
+
+        Args:
+            exclude: (collection of Backend) Backends that already failed
+                for this connection.
+
+        Returns:
+            (Backend or None) The backend, or None if none is up.
+        """
+        now = time.time()
+        with self._lock:
+            count = len(self.backends)
+            candidates = [
+                self.backends[(self._next + i) % count] for i in range(count)]
+            candidates = [b for b in candidates
+                          if b not in exclude and b.down_until <= now]
+            if not candidates:
+                return None
+            # min() returns the first of several equal backends, and the
+            # candidates start at a different backend every time.
+            backend = min(candidates, key=lambda b: b.active)
+            backend.active += 1
+            self._next = (self.backends.index(backend) + 1) % count
+            return backend
+
+    def release(self, backend, failed=False):
+        """Stop counting a connection.
+
+        Args:
+            backend: (Backend) The backend from acquire.
+            failed: (bool) Whether the backend refused the connection.
+        """
+        with self._lock:
+            backend.active -= 1
+            if failed:
+                backend.down_until = time.time() + DOWN_TIME
+
+    def connect(self):
+        """Connect to a backend, trying the others if it's down.
+
+        Returns:
+            ((socket.socket, Backend) or (None, None)) The connection, and
+            the backend it was made to, which must be released.
+        """
+        tried = set()
+        while True:
+            backend = self.acquire(exclude=tried)
+            if not backend:
+                return None, None
+            try:
+                conn = socket.create_connection(backend.address,
+                                                CONNECT_TIMEOUT)
+            except socket.error as err:
+                logging.warning('%s:%d is down: %s', backend.address[0],
+                                backend.address[1], err)
+                self.release(backend, failed=True)
+                tried.add(backend)
+                continue
+            conn.settimeout(None)
+            return conn, backend
+
+
+def pipe(source, dest):
+    """Copy from one socket to another until the source is done sending."""
+    try:
+        while True:
+            data = source.recv(BUFFER_SIZE)
+            if not data:
+                break
+            dest.sendall(data)
+    except socket.error:
+        pass
+    finally:
+        try:
+            dest.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+
+def handle(balancer, client):
+    """Forward a client's connection to a backend."""
+    conn, backend = balancer.connect()
+    if not conn:
+        client.close()
+        return
+    try:
+        upstream = threading.Thread(target=pipe, args=(client, conn))
+        upstream.daemon = True
+        upstream.start()
+        pipe(conn, client)
+        upstream.join()
+    finally:
+        conn.close()
+        client.close()
+        balancer.release(backend)
+
+
+def serve(port, balancer):
+    """Accept connections on port forever."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('0.0.0.0', port))
+    server.listen(128)
+    while True:
+        client, _ = server.accept()
+        thread = threading.Thread(target=handle, args=(balancer, client))
+        thread.daemon = True
+        thread.start()
+
+
+def main():
+    try:
+        port = int(sys.argv[1])
+        backends = sys.argv[2:]
+        if not backends:
+            raise ValueError('no backends')
+    except (IndexError, ValueError):
+        sys.exit('Usage: balancer.py PORT BACKEND [BACKEND ...]')
+    logging.info('Balancing port %d over %s', port, ', '.join(backends))
+    serve(port, Balancer(backends))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
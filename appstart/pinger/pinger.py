@@ -39,23 +39,28 @@ To actually run the pinger, a container is created and put on the same network
 stack as the application container. It's then possible to run the pinger via
 docker exec and see its exit status. The actual running of pinger.py is done in
 appstart.sandbox.container.PingerContainer.
+
+Rather than being exec'd once per check, the pinger can also be asked to wait
+for the application for a window of time. In that case, it probes the port
+in a tight loop and reports "ready" on stdout the moment that the connection
+succeeds, so the result can be read from the exec's output stream as soon as
+it is known.
 """
 
 import httplib
 import logging
 import socket
 import sys
+import time
 
+# Bounds (in seconds) of the backoff between connection attempts when the
+# pinger is asked to wait for the application.
+MIN_BACKOFF = 0.005
+MAX_BACKOFF = 0.05
 
-def ping():
-    """Check if container is listening on the specified port."""
-    try:
-        host = sys.argv[1]
-        port = int(sys.argv[2])
-    except (IndexError, ValueError):
-        host = '0.0.0.0'
-        port = 8080
 
+def can_connect(host, port):
+    """Return True iff a connection can be established with host:port."""
     con = None
     success = True
     try:
@@ -66,6 +71,64 @@ def ping():
     finally:
         if con:
             con.close()
+    return success
+
+
+def wait_for_port(host, port, window):
+    """Keep trying to connect to host:port for up to window seconds.
+
+    The attempts are cheap (they don't leave the container's network stack),
+    so they are retried with a short backoff. This lets the pinger report
+    the moment that the application starts listening.
+
+    Args:
+        host: (basestring) The host to connect to.
+        port: (int) The port to connect to.
+        window: (float) The number of seconds to keep trying.
+
+    Returns:
+        (bool) Whether or not a connection was established.
+    """
+    deadline = time.time() + window
+    delay = MIN_BACKOFF
+    while True:
+        if can_connect(host, port):
+            return True
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_BACKOFF)
+
+
+def ping():
+    """Check if container is listening on the specified port.
+
+    Usage: pinger.py [host [port [window]]]
+
+    Without a window, a single connection attempt is made and the result is
+    reported through the exit status. With a window, the pinger keeps
+    trying for that many seconds, and additionally prints "ready" or
+    "timeout" to stdout as soon as the outcome is known.
+    """
+    try:
+        host = sys.argv[1]
+        port = int(sys.argv[2])
+    except (IndexError, ValueError):
+        host = '0.0.0.0'
+        port = 8080
+
+    try:
+        window = float(sys.argv[3])
+    except (IndexError, ValueError):
+        window = None
+
+    if window is None:
+        success = can_connect(host, port)
+    else:
+        success = wait_for_port(host, port, window)
+        sys.stdout.write('ready\n' if success else 'timeout\n')
+        sys.stdout.flush()
+
     if success:
         logging.info('success')
         sys.exit(0)
@@ -16,11 +16,15 @@ import yaml
 from .. import utils
 
 
+# The name of the module that a configuration file without one configures.
+DEFAULT_MODULE = 'default'
+
+
 class ApplicationConfiguration(object):
     """Class to parse an xml or yaml config file.
 
-    Extract the necessary configuration details. Currently, only health
-    check information is required.
+    Extract the necessary configuration details: health check information,
+    and the name of the module.
     """
 
     def __init__(self, config_file):
@@ -80,6 +84,11 @@ class ApplicationConfiguration(object):
                 if value and value.nodeValue != 'true':
                     self.health_checks_enabled = False
 
+        self.module_name = DEFAULT_MODULE
+        module = root.getElementsByTagName('module')
+        if module and module[0].firstChild:
+            self.module_name = module[0].firstChild.nodeValue.strip()
+
     def _init_from_yaml_config(self, yaml_config):
         """Initialize from a yaml file.
 
@@ -104,6 +113,10 @@ class ApplicationConfiguration(object):
         else:
             self.health_checks_enabled = True
 
+        # Newer configurations call modules services.
+        self.module_name = str(yaml_dict.get('module') or
+                               yaml_dict.get('service') or DEFAULT_MODULE)
+
     @staticmethod
     def _verify_structure(full_config_file_path):
         """Verify the existence of the configuration files.
@@ -17,17 +17,16 @@
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
-import requests
 import signal
-import StringIO
 import tarfile
-import threading
 import urlparse
 
 import docker
 
 from .. import utils
 
+import log_multiplexer
+
 
 _EXITING = False
 
@@ -70,7 +69,13 @@ class Container(object):
         """
         # Anticipate the possibility of SIGINT during construction.
         # Note that graceful behavior is guaranteed only for SIGINT.
-        prev = signal.signal(signal.SIGINT, sig_handler)
+        # Handlers can only be installed from the main thread. Containers
+        # created from other threads (see scheduler.StartupScheduler) rely
+        # on the main thread waiting for the creation to finish instead.
+        try:
+            prev = signal.signal(signal.SIGINT, sig_handler)
+        except ValueError:
+            prev = None
 
         # Protecting create_container in this manner ensures that there
         # is GUARANTEED to be a container_id after this call. Then,
@@ -86,7 +91,8 @@ class Container(object):
                                       '{0}'.format(err))
 
         # Restore previous handler
-        signal.signal(signal.SIGINT, prev)
+        if prev is not None:
+            signal.signal(signal.SIGINT, prev)
 
         # If _EXITING is True, then the signal handler was called.
         if _EXITING:
@@ -94,6 +100,16 @@ class Container(object):
 
         self.name = docker_kwargs.get('name')
 
+    def adopt(self, container_id, name):
+        """Wrap an existing container, instead of creating one.
+
+        Args:
+            container_id: (basestring) The id of the container.
+            name: (basestring) The name of the container.
+        """
+        self._container_id = container_id
+        self.name = name
+
     def kill(self):
         """Kill the underlying container."""
 
@@ -131,48 +147,25 @@ class Container(object):
             stream: (bool) Whether or not to continue streaming stdout/stderr.
                 If False, only the current stdout/stderr buffer will be
                 collected from the container. If True, stdout/stderr collection
-                will continue as a subprocess.
-        """
-
-        def log_streamer():
-            # This loop tackles the problem of request timeouts. When the
-            # docker client is created, it establishes a timeout. The
-            # default is 60 seconds. If docker.Client.logs hangs for
-            # more than 60 seconds, this is considered a "timeout".
-            name = (self._dclient.inspect_container(self._container_id)
-                    .get('Name'))
-            while True:
-                try:
-                    # If a timeout happens, an error will be raise from inside
-                    # the log generator.
-                    logs = self._dclient.logs(container=self._container_id,
-                                              stream=True)
-                    for line in logs:
-                        utils.get_logger().debug('{0}: {1}'.format(
-                            name, line.strip()))
-
-                # In the case of a timeout, try to start collecting logs again.
-                except requests.exceptions.ReadTimeout:
-                    pass
-
-                # An APIError/NullResource occurs if the container doesn't
-                # exist anymore. This indicates that we're shutting down, so
-                # we can break and terminate the thread.  (The older versions
-                # produce an APIError).
-                except (docker.errors.APIError, docker.errors.NullResource):
-                    break
+                will continue in the background.
 
+        Returns:
+            (log_multiplexer.LogMultiplexer or None) If streaming, the
+            multiplexer that follows the logs. Its stop() method stops it.
+            To follow several containers, use a single LogMultiplexer for
+            all of them instead.
+        """
         if stream:
-            # If we want to stream the log output of the container,
-            # start another thread. There's no need to join this thread,
-            # because it's supposed to live until the container is removed.
-            thread = threading.Thread(target=log_streamer)
-            thread.start()
-        else:
-            logs = self._dclient.logs(container=self._container_id,
-                                      stream=False)
-            for line in logs.split('\n'):
-                utils.get_logger().debug(line.strip())
+            multiplexer = log_multiplexer.LogMultiplexer(self._dclient)
+            multiplexer.add(self)
+            multiplexer.start()
+            return multiplexer
+
+        logs = self._dclient.logs(container=self._container_id,
+                                  stream=False)
+        for line in logs.split('\n'):
+            utils.get_logger().debug(line.strip())
+        return None
 
     def running(self):
         """Check if the container is still running.
@@ -188,6 +181,24 @@ class Container(object):
     def get_id(self):
         return self._container_id
 
+    def ip_address(self):
+        """Get the container's address on the docker bridge network.
+
+        Returns:
+            (basestring) The IP address. Empty if the container isn't
+            running, or shares another container's network stack.
+        """
+        res = self._dclient.inspect_container(self._container_id)
+        return res['NetworkSettings']['IPAddress']
+
+    def inspect(self):
+        """Get the container's configuration, as docker applied it.
+
+        Returns:
+            (dict) The container's inspection.
+        """
+        return self._dclient.inspect_container(self._container_id)
+
     def execute(self, cmd, **create_kwargs):
         """Execute the command specified by cmd inside the container.
 
@@ -205,12 +216,17 @@ class Container(object):
         self._dclient.exec_start(exec_id)
         return self._dclient.exec_inspect(exec_id)
 
-    def extract_tar(self, path):
+    def extract_tar(self, path, spool_max_size=None):
         """Extract the file/directory specified by path as a TarWrapper object.
 
+        The archive is streamed from docker into a temporary file, which
+        stays in memory only if the archive is small (see utils.spool_file).
+
         Args:
             path: (basestring) The path (within the container)
                 to the file/directory to extract.
+            spool_max_size: (int or None) The largest archive to keep in
+                memory. Defaults to utils.SPOOL_MAX_SIZE.
 
         Raises:
             IOError: If path cannot be resolved within the container.
@@ -218,16 +234,53 @@ class Container(object):
         Returns:
             (utils.TarWrapper) The tar archive.
         """
+        reply = self._copy(path)
         try:
-            reply = self._dclient.copy(self._container_id, path)
-        except docker.errors.APIError:
-            raise IOError('File could not be found at {0}.'.format(path))
-
-        fileobj = StringIO.StringIO(reply.read())
+            fileobj = utils.spool_file(reply, spool_max_size)
+        finally:
+            reply.close()
 
         # Wrap the TarFile for more user-friendliness
         return utils.TarWrapper(tarfile.open(fileobj=fileobj))
 
+    def iter_tar(self, path):
+        """Stream the members of the file/directory specified by path.
+
+        Unlike extract_tar, the archive isn't stored anywhere: members are
+        read from docker's response as the caller asks for them, so only
+        one member has to be read at a time.
+
+        Args:
+            path: (basestring) The path (within the container)
+                to the file/directory to extract.
+
+        Raises:
+            IOError: If path cannot be resolved within the container.
+
+        Yields:
+            (tarfile.TarInfo, file-like object or None) Each member of the
+            archive, in archive order, and its contents if it's a file. The
+            contents can only be read until the next member is requested.
+        """
+        reply = self._copy(path)
+        try:
+            tar = tarfile.open(fileobj=reply, mode='r|')
+            for tinfo in tar:
+                yield tinfo, tar.extractfile(tinfo) if tinfo.isfile() else None
+        finally:
+            reply.close()
+
+    def _copy(self, path):
+        """Start copying path out of the container.
+
+        Returns:
+            (file-like object) docker's response, a tar archive of path.
+        """
+        try:
+            return self._dclient.copy(self._container_id, path)
+        except docker.errors.APIError:
+            raise IOError('File could not be found at {0}.'.format(path))
+
 
 class PingerContainer(Container):
     """Give devappserver the ability to ping the application.
@@ -235,9 +288,59 @@ class PingerContainer(Container):
     Relies on container having a pinger.py in the root directory.
     """
 
-    def ping_application_container(self):
-        """Return True iff the application is listening on port 8080."""
-        return self.execute('python /pinger.py')['ExitCode'] == 0
+    def __init__(self, *args, **kwargs):
+        super(PingerContainer, self).__init__(*args, **kwargs)
+
+        # Pinger images built by older versions of appstart have a pinger.py
+        # that can't wait for the application. This is set to False once
+        # such a pinger is detected.
+        self.supports_probe = True
+
+    def ping_application_container(self, host='0.0.0.0'):
+        """Return True iff the application is listening on port 8080.
+
+        Args:
+            host: (basestring) The address of the application, as seen
+                from the pinger. By default, the pinger is on the
+                application's network stack.
+        """
+        return self.execute(
+            'python /pinger.py {0} 8080'.format(host))['ExitCode'] == 0
+
+    def probe_application_container(self, window, host='0.0.0.0'):
+        """Wait up to window seconds for the application to listen on 8080.
+
+        The pinger is exec'd once and probes the port from inside the
+        container. Its output is streamed back, so this returns as soon as
+        the application starts listening rather than at the end of the
+        window.
+
+        If the pinger turns out not to support probing, supports_probe is
+        set to False and the result of its single ping is returned.
+
+        Args:
+            window: (float) The maximum number of seconds to wait.
+            host: (basestring) The address of the application, as seen
+                from the pinger.
+
+        Returns:
+            (bool) Whether or not the application is listening on port 8080.
+        """
+        exec_id = self._dclient.exec_create(
+            container=self._container_id,
+            cmd='python /pinger.py {0} 8080 {1:.3f}'.format(host, window)
+        ).get('Id')
+
+        # The pinger exits right after reporting, so the stream ends as soon
+        # as the outcome is known.
+        output = ''.join(self._dclient.exec_start(exec_id, stream=True))
+        if 'ready' in output:
+            return True
+        if 'timeout' in output:
+            return False
+
+        self.supports_probe = False
+        return self._dclient.exec_inspect(exec_id)['ExitCode'] == 0
 
 
 class ApplicationContainer(Container):
@@ -247,5 +350,16 @@ class ApplicationContainer(Container):
     """
 
     def __init__(self, app_config, *args, **kwargs):
+        """Initializer for ApplicationContainer.
+
+        Args:
+            app_config: (configuration.ApplicationConfiguration) The
+                application's configuration.
+            *args: (list) Arguments for Container.
+            **kwargs: (dict) Keyword arguments for Container. In addition,
+                log_path (basestring or None) is the directory on the docker
+                host that the container's log directory is bound to.
+        """
+        self.log_path = kwargs.pop('log_path', None)
         super(ApplicationContainer, self).__init__(*args, **kwargs)
         self.configuration = app_config
@@ -27,20 +27,38 @@ system tests in this manner.
 import io
 import os
 import sys
+import tempfile
 import time
 
 import docker
 
 import configuration
 import container
+import devappserver_pool
+import image_cache
+import log_multiplexer
+import modules as modules_lib
+import resources
+import scheduler
+from .. import tracing
 from .. import utils
 from .. import constants
 from ..utils import get_logger
 
 
-# Maximum attempts to health check application container.
+# Maximum number of seconds to wait for the application container to start.
 MAX_ATTEMPTS = 30
 
+# Number of seconds that the pinger waits for the application inside the
+# container before control returns to the sandbox (to check that the
+# containers are still running).
+PROBE_WINDOW = 2.0
+
+# Bounds (in seconds) of the backoff between pings, for pinger images that
+# cannot wait for the application themselves.
+MIN_BACKOFF = 0.025
+MAX_BACKOFF = 0.1
+
 # Default port that the application is expected to listen on inside
 # the application container.
 DEFAULT_APPLICATION_PORT = 8080
@@ -48,6 +66,13 @@ DEFAULT_APPLICATION_PORT = 8080
 # Time format for naming images/containers
 TIME_FMT = '%Y.%m.%d_%H.%M.%S'
 
+# Repository for the devappserver images built by the sandbox. Images are
+# tagged with a digest of their build context.
+DEVAPPSERVER_IMAGE_REPO = 'devappserver_image'
+
+# Repository for the application images built by the sandbox.
+APP_IMAGE_REPO = 'app_image'
+
 # Java offset for the xml file's location, relative to the root
 # diretory of the WAR archive
 JAVA_OFFSET = 'WEB-INF/'
@@ -84,7 +109,18 @@ class ContainerSandbox(object):
                  timeout=MAX_ATTEMPTS,
                  force_version=False,
                  devbase_image=constants.DEVAPPSERVER_IMAGE,
-                 extra_ports=None):
+                 extra_ports=None,
+                 image_cache_size=image_cache.DEFAULT_MAX_IMAGES,
+                 build_compression=0,
+                 profile_startup=False,
+                 trace_file=None,
+                 reuse=False,
+                 mount_static=False,
+                 instances=1,
+                 modules=None,
+                 dispatch_file=None,
+                 app_limits=None,
+                 devappserver_limits=None):
         """Get the sandbox ready to construct and run the containers.
 
         Args:
@@ -170,8 +206,49 @@ class ContainerSandbox(object):
             extra_ports: ({int: int, ...} or None) A mapping from application
                 docker container ports to host ports, allowing
                 additional application ports to be exposed.
+            image_cache_size: (int) How many digest-tagged images to keep
+                around for reuse. Older images are removed, least recently
+                used first.
+            build_compression: (int) The gzip compression level (0-9) for
+                the devappserver image's build context. 0 sends it
+                uncompressed, which is fastest when the docker daemon is
+                local.
+            profile_startup: (bool) Whether or not to trace the steps of
+                startup (including every docker API call), and report where
+                the time went once startup is done.
+            trace_file: (basestring or None) Where to write the startup
+                trace, in the Chrome trace event format, if profile_startup
+                is True. If None, a timestamped file in the temporary
+                directory is used.
+            reuse: (bool) Whether to keep the devappserver container
+                running when the sandbox stops, and to reuse a running one
+                with the same configuration when it starts (see
+                devappserver_pool). Ignored if clear_datastore is True.
+            mount_static: (bool) Whether to bind the static directories
+                into the devappserver container (read-only) instead of
+                adding them to the devappserver image.
+            instances: (int) The number of application containers to run.
+                With more than one, each container has its own network
+                stack, and a load balancer listens on port 8080 in their
+                place.
+            modules: ([basestring, ...] or None) The config files of other
+                modules of the application, to run next to the one of
+                config_file. Each is published on a port of its own, from
+                application_port + 1 up.
+            dispatch_file: (basestring or None) The path to a dispatch.yaml
+                file. Its rules are checked against the modules, and listed
+                with the modules' addresses once they're live.
+            app_limits: ([basestring, ...] or None) Resource limits for each
+                application container (and the containers of the other
+                modules), as KEY=VALUE strings (see resources).
+            devappserver_limits: ([basestring, ...] or None) Resource limits
+                for the devappserver container, in the same form.
         """
         self.cur_time = time.strftime(TIME_FMT)
+        self.app_limits = resources.ContainerLimits(app_limits,
+                                                    'application')
+        self.devappserver_limits = resources.ContainerLimits(
+            devappserver_limits, 'devappserver')
         self.app_id = (application_id or None)
         self.internal_api_port = internal_api_port
         self.internal_proxy_port = internal_proxy_port
@@ -186,16 +263,56 @@ class ContainerSandbox(object):
         self.image_name = image_name
         self.admin_port = admin_port
         self.proxy_port = proxy_port
-        self.dclient = utils.get_docker_client()
+        self.profile_startup = profile_startup
+        if profile_startup:
+            self.tracer = tracing.Tracer()
+            self.trace_file = trace_file or os.path.join(
+                tempfile.gettempdir(),
+                self.make_timestamped_name('appstart_trace',
+                                           self.cur_time) + '.json')
+        else:
+            self.tracer = tracing.NullTracer()
+            self.trace_file = None
+        self.dclient = self.docker_client()
+
+        # Containers with limits that the pinned API version can't express
+        # are created (and managed) with a client for a newer version.
+        self.app_dclient = self.docker_client(self.app_limits.api_version)
+        self.devappserver_dclient = self.docker_client(
+            self.devappserver_limits.api_version)
         self.devappserver_container = None
         self.app_container = None
         self.pinger_container = None
+
+        # With several instances, app_container is instance 0, and these
+        # are the others.
+        if instances < 1:
+            raise utils.AppstartAbort('At least one instance must run.')
+        self.instances = instances
+        self.other_app_containers = [None] * (instances - 1)
+        self.balancer_container = None
+        if instances > 1 and extra_ports:
+            get_logger().warning('With several instances, only port 8080 is '
+                                 'balanced. The extra ports lead nowhere.')
+
+        # The images that the current containers were created from.
+        self.devappserver_image = None
+        self.app_image = None
+
+        self.log_multiplexer = None
+        self.reloads = 0
+        self.reuse = reuse and not clear_datastore
+        self.mount_static = mount_static
+        self.devappserver_pool = None
+        self.devappserver_lease = None
         self.nocache = nocache
         self.run_devappserver = run_api_server
         self.timeout = timeout        
         self.devbase_image=constants.DEVAPPSERVER_IMAGE
         self.extra_ports = extra_ports
-        
+        self.image_cache_size = image_cache_size
+        self.build_compression = build_compression
+
         if devbase_image:
           self.devbase_image=devbase_image
 
@@ -217,6 +334,25 @@ class ContainerSandbox(object):
         self.das_offset = (JAVA_OFFSET if
                            self.application_configuration.is_java else '')
 
+        taken_ports = [self.port, self.admin_port, self.proxy_port]
+        taken_ports.extend((extra_ports or {}).values())
+        module_files = modules or []
+        self.modules = [
+            modules_lib.Module(module_file, port) for module_file, port in
+            zip(module_files, modules_lib.assign_ports(
+                len(module_files), self.port + 1, taken_ports))]
+        names = ([self.application_configuration.module_name] +
+                 [module.name for module in self.modules])
+        for name in set(names):
+            if names.count(name) > 1:
+                raise utils.AppstartAbort(
+                    'Several config files configure the module '
+                    '{0}.'.format(name))
+        self.dispatch_rules = []
+        if dispatch_file:
+            self.dispatch_rules = modules_lib.load_dispatch(dispatch_file,
+                                                            names)
+
         if not force_version:
             utils.check_docker_version(self.dclient)
 
@@ -227,150 +363,623 @@ class ContainerSandbox(object):
     def start(self):
         """Start the sandbox."""
         try:
-            self.create_and_run_containers()
+            with self.tracer.span('startup'):
+                self.create_and_run_containers()
         except:  # pylint: disable=bare-except
             self.stop()
             raise
+        finally:
+            if self.profile_startup:
+                self.report_startup_profile()
+
+    def report_startup_profile(self):
+        """Log a waterfall of the startup trace and write it to trace_file."""
+        get_logger().info('Startup profile:')
+        for line in self.tracer.waterfall():
+            get_logger().info('  %s', line)
+        try:
+            self.tracer.write_chrome_trace(self.trace_file)
+        except IOError as err:
+            get_logger().warning('Could not write startup trace: %s', err)
+        else:
+            get_logger().info('Startup trace written to %s '
+                              '(open it in chrome://tracing)',
+                              self.trace_file)
 
-    def create_and_run_containers(self):
+    def create_and_run_containers(self, devappserver_image=None,
+                                  app_image=None):
         """Creates and runs app and (optionally) devappserver containers.
 
         This includes the creation of a new devappserver image, unless
         self.run_devappserver is False. If image_name isn't specified, an
         image is created for the application as well. Newly made containers
         are cleaned up, but newly made images are not.
-        """
 
-        if self.run_devappserver:
-            # Devappserver must know APP_ID to properly interface with
-            # services like datastore, blobstore, etc. It also needs
-            # to know where to find the config file, which port to
-            # run the proxy on, and which port to run the api server on.
-            das_env = {'CLEAR_DATASTORE': self.clear_datastore,
-                       'PROXY_PORT': self.internal_proxy_port,
-                       'API_PORT': self.internal_api_port,
-                       'ADMIN_PORT': self.internal_admin_port,
-                       'CONFIG_FILE': os.path.join(
-                           self.das_offset,
-                           os.path.basename(self.conf_path))}
-
-            if self.app_id:
-                das_env['APP_ID'] = self.app_id
-
-            devappserver_image = self.build_devappserver_image(
-              devbase_image=self.devbase_image
-            )
-            devappserver_container_name = (
-                self.make_timestamped_name('devappserver',
-                                           self.cur_time))
-
-            port_bindings = {
-                DEFAULT_APPLICATION_PORT: self.port,
-                self.internal_admin_port: self.admin_port,
-                self.internal_proxy_port: self.proxy_port,
-            }
-            if self.extra_ports:
-                port_bindings.update(self.extra_ports)
-
-            # The host_config specifies port bindings and volume bindings.
-            # /storage is bound to the storage_path. Internally, the
-            # devappserver writes all the db files to /storage. The mapping
-            # thus allows these files to appear on the host machine. As for
-            # port mappings, we only want to expose the application (via the
-            # proxy), and the admin panel.
-            devappserver_hconf = docker.utils.create_host_config(
-                port_bindings=port_bindings,
-                binds={
-                    self.storage_path: {'bind': '/storage'},
-                }
-            )
-
-            self.devappserver_container = container.Container(self.dclient)
-            self.devappserver_container.create(
-                name=devappserver_container_name,
-                image=devappserver_image,
-                ports=port_bindings.keys(),
-                volumes=['/storage'],
-                host_config=devappserver_hconf,
-                environment=das_env)
-
-            self.devappserver_container.start()
-            get_logger().info('Starting container: %s',
-                              devappserver_container_name)
+        Steps that don't depend on each other (the image builds, and the
+        creation of the pinger) run concurrently. The application is only
+        started once devappserver is running, since it joins devappserver's
+        network stack, and the pinger in turn joins the application's. (With
+        several instances, see wait_for_start.)
 
-        # The application container needs several environment variables
-        # in order to start up the application properly, as well as
-        # look for the api server in the correct place. Notes:
-        #
-        # GAE_PARTITION is always dev for development modules.
-        # GAE_LONG_APP_ID is the "application ID". When devappserver
-        #     is invoked, it can be passed a "--application" flag. This
-        #     application must be consistent with GAE_LONG_APP_ID.
-        # API_HOST is 0.0.0.0 because application container runs on the
-        #     same network stack as devappserver.
-        # MODULE_YAML_PATH specifies the path to the app from the
-        #     app directory
+        Args:
+            devappserver_image: (basestring or None) A devappserver image
+                that was already built, if any.
+            app_image: (basestring or None) An application image that was
+                already built, if any.
+        """
+        sched = scheduler.StartupScheduler(tracer=self.tracer)
+        devappserver_deps = []
 
-        # TODO (find in g3 and link to here via comment)
-        app_env = {'API_HOST': '0.0.0.0',
-                   'API_PORT': self.internal_api_port,
-                   'GAE_LONG_APP_ID': self.app_id,
-                   'GAE_PARTITION': 'dev',
-                   'GAE_MODULE_INSTANCE': '0',
-                   'MODULE_YAML_PATH': os.path.basename(self.conf_path),
-                   'GAE_MODULE_NAME': 'default',  # TODO(gouzenko) parse app.yaml
-                   'GAE_MODULE_VERSION': '1',
-                   'GAE_SERVER_PORT': '8080',
-                   'USE_MVM_AGENT': 'true'}
+        if self.run_devappserver:
+            sched.add('devappserver_image',
+                      lambda: devappserver_image or
+                      self.build_devappserver_image(
+                          devbase_image=self.devbase_image))
+            sched.add('devappserver_create',
+                      lambda: self.create_devappserver_container(
+                          sched.results['devappserver_image']),
+                      deps=['devappserver_image'])
+            sched.add('devappserver_start',
+                      self.start_devappserver_container,
+                      deps=['devappserver_create'])
+            devappserver_deps.append('devappserver_start')
 
         # Build from the application directory iff image_name is not
         # specified.
-        app_image = self.image_name or self.build_app_image()
-        app_container_name = self.make_timestamped_name('test_app',
-                                                        self.cur_time)
+        sched.add('app_image',
+                  lambda: (app_image or self.image_name or
+                           self.build_app_image()))
+        # Several instances are told devappserver's address when they're
+        # created, and they don't join its network stack, so it's their
+        # creation that has to wait for devappserver instead.
+        app_create_deps, app_start_deps = ['app_image'], devappserver_deps
+        if self.instances > 1:
+            app_create_deps, app_start_deps = (app_create_deps +
+                                               devappserver_deps), []
+        for index in range(self.instances):
+            suffix = '_{0}'.format(index) if index else ''
+            sched.add('app_create' + suffix,
+                      lambda index=index: self.create_app_container(
+                          sched.results['app_image'], index),
+                      deps=app_create_deps)
+            sched.add('app_start' + suffix,
+                      lambda index=index: self.start_app_container(index),
+                      deps=['app_create' + suffix] + app_start_deps)
+        # Other modules are built concurrently, and, like several
+        # instances, are told devappserver's address when they're created.
+        for module in self.modules:
+            suffix = '_' + module.name
+            sched.add('module_image' + suffix,
+                      lambda module=module: self.build_app_image(
+                          module.app_dir))
+            sched.add('module_create' + suffix,
+                      lambda module=module: self.create_module_container(
+                          module, sched.results['module_image_' +
+                                                module.name]),
+                      deps=['module_image' + suffix] + devappserver_deps)
+            sched.add('module_start' + suffix,
+                      lambda module=module: module.container.start(),
+                      deps=['module_create' + suffix])
+        sched.add('pinger_create', self.create_pinger_container)
+        sched.add('pinger_start',
+                  self.start_pinger_container,
+                  deps=['pinger_create'] +
+                  (['app_start'] if self.instances == 1 else []))
 
-        # If devappserver is running, hook up the app to it.
-        if self.run_devappserver:
-            network_mode = ('container:%s' %
-                            self.devappserver_container.get_id())
+        try:
+            sched.run()
+        finally:
+            sched.log_timings()
+
+        with self.tracer.span('wait_for_start'):
+            self.wait_for_start()
+        self.follow_logs()
+
+    def reload(self, app=True, devappserver=False, force=True):
+        """Replace the application container, keeping devappserver running.
+
+        The new images are built, and (unless devappserver is rebuilt) the
+        new application and pinger containers are created, while the old
+        application keeps serving. If any of that fails, the old
+        application is left alone. Since the application shares
+        devappserver's network stack, the old container must be removed
+        before the new one can listen on port 8080, so the application is
+        unavailable from then until the pinger sees the new one listening.
+
+        A new devappserver image means a new devappserver container, and
+        the application has to join the new container's network stack, so
+        in that case every container is replaced. So they are with several
+        instances, or several modules.
+
+        Args:
+            app: (bool) Whether to rebuild the application image. If
+                False, the new application container is created from the
+                current image.
+            devappserver: (bool) Whether to rebuild the devappserver image
+                (with the application's configuration and static files).
+                Ignored if the sandbox doesn't run devappserver.
+            force: (bool) Whether to replace the containers even if the
+                images haven't changed.
+
+        Raises:
+            utils.AppstartAbort: If the new application could not be built
+                or started. In the latter case, the sandbox has no running
+                application until the next successful reload.
+        """
+        devappserver = devappserver and self.run_devappserver
+
+        # If an earlier reload left the sandbox without a devappserver,
+        # everything has to be started again.
+        if (self.run_devappserver and
+            not self.devappserver_container.running()):
+            devappserver = force = True
+
+        get_logger().info('Reloading the application')
+        self.reloads += 1
+        self.cur_time = '{0}.{1}'.format(time.strftime(TIME_FMT),
+                                         self.reloads)
+
+        sched = scheduler.StartupScheduler(tracer=self.tracer)
+        sched.add('app_image',
+                  lambda: (self.image_name or
+                           (self.build_app_image() if app
+                            else self.app_image)))
+        if devappserver:
+            sched.add('devappserver_image',
+                      lambda: self.build_devappserver_image(
+                          devbase_image=self.devbase_image))
+        if app:
+            for module in self.modules:
+                sched.add('module_image_' + module.name,
+                          lambda module=module: self.build_app_image(
+                              module.app_dir))
+        try:
+            sched.run()
+        finally:
+            sched.log_timings()
+        app_image = sched.results['app_image']
+        devappserver_image = sched.results.get('devappserver_image',
+                                               self.devappserver_image)
+        modules_changed = any(
+            sched.results.get('module_image_' + module.name,
+                              module.image) != module.image
+            for module in self.modules)
+
+        if (not force and app_image == self.app_image and
+            devappserver_image == self.devappserver_image and
+            not modules_changed):
+            get_logger().info('The images are unchanged. Nothing to reload.')
+            return
+
+        if devappserver or self.instances > 1 or self.modules:
+            self.stop()
+            try:
+                self.create_and_run_containers(
+                    devappserver_image=devappserver_image,
+                    app_image=app_image)
+            except:  # pylint: disable=bare-except
+                self.stop_and_remove_containers()
+                raise
+            get_logger().info('Reloaded the application and devappserver')
+            return
+
+        old_containers = [self.pinger_container, self.app_container]
+        sched = scheduler.StartupScheduler(tracer=self.tracer)
+        sched.add('app_create', lambda: self.create_app_container(app_image))
+        sched.add('pinger_create', self.create_pinger_container)
+        try:
+            sched.run()
+        except:  # pylint: disable=bare-except
+            # Remove whichever new containers were created, and go back to
+            # the old ones.
+            for new, old in zip([self.pinger_container, self.app_container],
+                                old_containers):
+                if new and new is not old and new.get_id():
+                    new.remove()
+            self.pinger_container, self.app_container = old_containers
+            raise
+        finally:
+            sched.log_timings()
+
+        # The pinger is on the old application's network stack, so it goes
+        # first.
+        for cont in old_containers:
+            if cont and cont.get_id():
+                if cont.running():
+                    cont.kill()
+                cont.remove()
+
+        self.start_app_container()
+        self.start_pinger_container()
+        self.wait_for_start()
+        if self.log_multiplexer:
+            self.log_multiplexer.add(self.app_container)
+            self.log_multiplexer.add(self.pinger_container)
+        get_logger().info('Reloaded the application')
+
+    def watched_dirs(self):
+        """The directories whose changes should trigger a reload.
+
+        Returns:
+            ([basestring, ...]) The application directory, those of the
+            other modules, and the static directories outside of them.
+        """
+        dirs = self.app_dirs()
+        for static_dir in self.static_dirs():
+            static_dir = os.path.abspath(static_dir)
+            if not static_dir.startswith(os.path.join(self.app_dir, '')):
+                dirs.append(static_dir)
+        return dirs
+
+    def app_dirs(self):
+        """The directories that the application images are built from."""
+        dirs = [self.app_dir]
+        dirs.extend(module.app_dir for module in self.modules
+                    if module.app_dir not in dirs)
+        return dirs
+
+    def static_dirs(self):
+        """The static directories that are added to devappserver's image."""
+        if self.application_configuration.is_java:
+            return []
+        return utils.static_dirs(self.conf_path)
+
+    def static_mounts(self):
+        """Where the static directories belong in devappserver's container.
+
+        Returns:
+            ({basestring: basestring}) The container path of each static
+            directory, keyed by its path on the host.
+        """
+        conf_dir = os.path.dirname(self.conf_path)
+        dest = os.path.join('/app', self.das_offset)
+        return dict(
+            (os.path.abspath(static_dir),
+             os.path.normpath(os.path.join(
+                 dest, os.path.relpath(static_dir, conf_dir))))
+            for static_dir in self.static_dirs())
+
+    def config_files(self):
+        """The configuration files that are added to devappserver's image."""
+        files = [self.conf_path]
+        if self.application_configuration.is_java:
+            files.append(self.get_web_xml(self.conf_path))
+        return files
+
+    def docker_client(self, api_version=None):
+        """Get a docker client, traced if startup is being profiled.
+
+        Args:
+            api_version: (basestring or None) The docker API version that
+                the client speaks. Defaults to utils.DOCKER_API_VERSION.
+
+        Returns:
+            (docker.Client) The client.
+        """
+        dclient = utils.get_docker_client(api_version)
+        if self.profile_startup:
+            dclient = tracing.TracedClient(dclient, self.tracer)
+        return dclient
+
+    def follow_logs(self):
+        """Log the output of all containers, on a single background thread.
+
+        The multiplexer reads through an untraced client, so that its polls
+        don't accumulate in the startup trace.
+        """
+        self.log_multiplexer = log_multiplexer.LogMultiplexer(
+            utils.get_docker_client())
+        for cont in self.app_containers() + [self.devappserver_container,
+                                             self.pinger_container,
+                                             self.balancer_container] + [
+                                                 module.container
+                                                 for module in self.modules]:
+            if cont:
+                # Don't repeat what a warm devappserver logged for earlier
+                # sandboxes.
+                self.log_multiplexer.add(
+                    cont, history=not (cont is self.devappserver_container and
+                                       self.devappserver_lease and
+                                       self.devappserver_lease.container_id))
+        self.log_multiplexer.start()
+
+    def create_devappserver_container(self, devappserver_image):
+        """Create (but don't start) the devappserver container.
+
+        Args:
+            devappserver_image: (basestring) The name of the image built by
+                build_devappserver_image.
+        """
+        self.devappserver_image = devappserver_image
+
+        # Devappserver must know APP_ID to properly interface with
+        # services like datastore, blobstore, etc. It also needs
+        # to know where to find the config file, which port to
+        # run the proxy on, and which port to run the api server on.
+        das_env = {'CLEAR_DATASTORE': self.clear_datastore,
+                   'PROXY_PORT': self.internal_proxy_port,
+                   'API_PORT': self.internal_api_port,
+                   'ADMIN_PORT': self.internal_admin_port,
+                   'CONFIG_FILE': os.path.join(
+                       self.das_offset,
+                       os.path.basename(self.conf_path))}
+
+        if self.app_id:
+            das_env['APP_ID'] = self.app_id
+
+        devappserver_container_name = (
+            self.make_timestamped_name('devappserver',
+                                       self.cur_time))
+
+        port_bindings = {
+            DEFAULT_APPLICATION_PORT: self.port,
+            self.internal_admin_port: self.admin_port,
+            self.internal_proxy_port: self.proxy_port,
+        }
+        if self.extra_ports:
+            port_bindings.update(self.extra_ports)
+
+        # The host_config specifies port bindings and volume bindings.
+        # /storage is bound to the storage_path. Internally, the
+        # devappserver writes all the db files to /storage. The mapping
+        # thus allows these files to appear on the host machine. As for
+        # port mappings, we only want to expose the application (via the
+        # proxy), and the admin panel.
+        binds = {self.storage_path: {'bind': '/storage'}}
+        if self.mount_static:
+            for static_dir, bind in self.static_mounts().iteritems():
+                binds[static_dir] = {'bind': bind, 'ro': True}
+        devappserver_hconf = docker.utils.create_host_config(
+            port_bindings=port_bindings,
+            binds=binds
+        )
+        devappserver_hconf.update(self.devappserver_limits.host_config)
+
+        self.devappserver_container = container.Container(
+            self.devappserver_dclient)
+        if self.reuse:
+            self.devappserver_pool = devappserver_pool.DevappserverPool(
+                self.dclient)
+            self.devappserver_lease = self.devappserver_pool.acquire(
+                devappserver_pool.pool_key(devappserver_image, das_env,
+                                           port_bindings, self.storage_path,
+                                           self.devappserver_limits.requested),
+                port_bindings.values())
+            devappserver_container_name = self.devappserver_lease.name
+            if self.devappserver_lease.container_id:
+                get_logger().info('Reusing warm devappserver container: %s',
+                                  devappserver_container_name)
+                self.devappserver_container.adopt(
+                    self.devappserver_lease.container_id,
+                    devappserver_container_name)
+                return
+
+        self.devappserver_container.create(
+            name=devappserver_container_name,
+            image=devappserver_image,
+            ports=port_bindings.keys(),
+            volumes=[bind['bind'] for bind in binds.itervalues()],
+            host_config=devappserver_hconf,
+            environment=das_env,
+            **self.devappserver_limits.create_kwargs)
+
+    def start_devappserver_container(self):
+        """Start the devappserver container, unless it's a warm one."""
+        if self.devappserver_lease and self.devappserver_lease.container_id:
+            return
+        self.devappserver_container.start()
+        get_logger().info('Starting container: %s',
+                          self.devappserver_container.name)
+
+    def create_app_container(self, app_image, index=0):
+        """Create (but don't start) the application container.
+
+        Args:
+            app_image: (basestring) The name of the application's image.
+            index: (int) The instance of the application the container
+                runs.
+        """
+        self.app_image = app_image
+        app_env = self.app_environment(
+            self.conf_path, self.application_configuration.module_name, index)
+
+        app_container_name = self.make_timestamped_name(
+            'test_app' if self.instances == 1 else 'test_app_%d' % index,
+            self.cur_time)
+
+        # Each instance logs to its own directory.
+        log_path = self.log_path
+        if index:
+            log_path = '{0}.{1}'.format(self.log_path, index)
+
+        # If devappserver is running, the app will share its network stack
+        # (see start_app_container), so it doesn't publish any ports.
+        # Several instances are only reached through the load balancer.
+        if self.run_devappserver or self.instances > 1:
             ports = port_bindings = None
         else:
             port_bindings = {DEFAULT_APPLICATION_PORT: self.port}
             ports = [DEFAULT_APPLICATION_PORT]
-            network_mode = None
+
+        if self.instances > 1 and self.run_devappserver:
+            app_env['API_HOST'] = self.devappserver_container.ip_address()
 
         app_hconf = docker.utils.create_host_config(
             port_bindings=port_bindings,
             binds={
-                self.log_path: {'bind': '/var/log/app_engine'}
+                log_path: {'bind': '/var/log/app_engine'}
             },
-
         )
+        app_hconf.update(self.app_limits.host_config)
 
-        self.app_container = container.ApplicationContainer(
+        app_container = container.ApplicationContainer(
             self.application_configuration,
-            self.dclient)
-        self.app_container.create(
+            self.app_dclient,
+            log_path=log_path)
+        if index:
+            self.other_app_containers[index - 1] = app_container
+        else:
+            self.app_container = app_container
+        app_container.create(
             name=app_container_name,
             image=app_image,
             ports=ports,
             volumes=['/var/log/app_engine'],
             host_config=app_hconf,
-            environment=app_env)
+            environment=app_env,
+            **self.app_limits.create_kwargs)
+
+    def app_environment(self, conf_path, module_name, index=0):
+        """Get the environment of an application container.
+
+        Args:
+            conf_path: (basestring) The path to the module's config file.
+            module_name: (basestring) The name of the module.
+            index: (int) The instance of the module the container runs.
+
+        Returns:
+            ({basestring: basestring}) The environment variables.
+        """
+        # The application container needs several environment variables
+        # in order to start up the application properly, as well as
+        # look for the api server in the correct place. Notes:
+        #
+        # GAE_PARTITION is always dev for development modules.
+        # GAE_LONG_APP_ID is the "application ID". When devappserver
+        #     is invoked, it can be passed a "--application" flag. This
+        #     application must be consistent with GAE_LONG_APP_ID.
+        # API_HOST is 0.0.0.0 because application container runs on the
+        #     same network stack as devappserver. Containers that don't
+        #     are given devappserver's address instead.
+        # MODULE_YAML_PATH specifies the path to the app from the
+        #     app directory
+
+        # TODO (find in g3 and link to here via comment)
+        return {'API_HOST': '0.0.0.0',
+                'API_PORT': self.internal_api_port,
+                'GAE_LONG_APP_ID': self.app_id,
+                'GAE_PARTITION': 'dev',
+                'GAE_MODULE_INSTANCE': str(index),
+                'MODULE_YAML_PATH': os.path.basename(conf_path),
+                'GAE_MODULE_NAME': module_name,
+                'GAE_MODULE_VERSION': '1',
+                'GAE_SERVER_PORT': '8080',
+                'USE_MVM_AGENT': 'true'}
+
+    def start_app_container(self, index=0):
+        """Start the application container.
+
+        If devappserver is running, hook up the app to it (unless there
+        are several instances).
+
+        Args:
+            index: (int) The instance of the application to start.
+        """
+        if self.run_devappserver and self.instances == 1:
+            network_mode = ('container:%s' %
+                            self.devappserver_container.get_id())
+        else:
+            network_mode = None
 
         # Start as a shared network container, putting the application
         # on devappserver's network stack. (If devappserver is not
         # running, network_mode is None).
         try:
-            self.app_container.start(network_mode=network_mode)
+            self.app_containers()[index].start(network_mode=network_mode)
         except utils.AppstartAbort:
             if self.run_devappserver:
                 self.abort_if_not_running(self.devappserver_container)
             raise
 
-        # Construct a pinger container and bind it to the application's network
-        # stack. This will allow the pinger to attempt to connect to the
-        # application's ports.
+    def create_module_container(self, module, image):
+        """Create (but don't start) the container of another module.
+
+        Args:
+            module: (modules.Module) The module.
+            image: (basestring) The name of the module's image.
+        """
+        module.image = image
+        env = self.app_environment(module.conf_path, module.name)
+        if self.run_devappserver:
+            env['API_HOST'] = self.devappserver_container.ip_address()
+        log_path = '{0}.{1}'.format(self.log_path, module.name)
+
+        module.container = container.ApplicationContainer(
+            module.configuration,
+            self.app_dclient,
+            log_path=log_path)
+        host_config = docker.utils.create_host_config(
+            port_bindings={DEFAULT_APPLICATION_PORT: module.port},
+            binds={log_path: {'bind': '/var/log/app_engine'}})
+        host_config.update(self.app_limits.host_config)
+        module.container.create(
+            name=self.make_timestamped_name('module_' + module.name,
+                                            self.cur_time),
+            image=image,
+            ports=[DEFAULT_APPLICATION_PORT],
+            volumes=['/var/log/app_engine'],
+            host_config=host_config,
+            environment=env,
+            **self.app_limits.create_kwargs)
+
+    def app_containers(self):
+        """The application containers, in the order of their instances."""
+        return [self.app_container] + self.other_app_containers
+
+    def applied_limits(self):
+        """Get the resource limits that docker applied to the containers.
+
+        Returns:
+            (dict) The limits (see resources.applied) of the application
+            container, and of the devappserver container if it runs.
+        """
+        limits = {'app': resources.applied(self.app_container.inspect())}
+        if self.run_devappserver:
+            limits['devappserver'] = resources.applied(
+                self.devappserver_container.inspect())
+        return limits
+
+    def start_balancer_container(self, backends):
+        """Create and start the load balancer in front of the instances.
+
+        The balancer runs from the pinger image. It takes the place of the
+        application: on devappserver's network stack if devappserver is
+        running, and otherwise publishing port 8080 itself.
+
+        Args:
+            backends: ([basestring, ...]) The addresses (as host:port) of
+                the instances.
+        """
+        if self.run_devappserver:
+            network_mode = ('container:%s' %
+                            self.devappserver_container.get_id())
+            ports = port_bindings = None
+        else:
+            network_mode = None
+            port_bindings = {DEFAULT_APPLICATION_PORT: self.port}
+            ports = [DEFAULT_APPLICATION_PORT]
+
+        self.balancer_container = container.Container(self.dclient)
+        self.balancer_container.create(
+            name=self.make_timestamped_name('balancer', self.cur_time),
+            image=constants.PINGER_IMAGE,
+            entrypoint=['python', '/balancer.py',
+                        str(DEFAULT_APPLICATION_PORT)] + backends,
+            ports=ports,
+            host_config=docker.utils.create_host_config(
+                port_bindings=port_bindings))
+        self.balancer_container.start(network_mode=network_mode)
+        if self.log_multiplexer:
+            self.log_multiplexer.add(self.balancer_container)
+
+    def balancer_address(self):
+        """The address of the load balancer, as seen from the pinger."""
+        if self.run_devappserver:
+            return self.devappserver_container.ip_address()
+        return self.balancer_container.ip_address()
+
+    def create_pinger_container(self):
+        """Create (but don't start) the pinger container."""
         pinger_name = self.make_timestamped_name('pinger', self.cur_time)
         self.pinger_container = container.PingerContainer(self.dclient)
         try:
@@ -383,6 +992,17 @@ class ContainerSandbox(object):
                                           'init"? ')
             raise
 
+    def start_pinger_container(self):
+        """Start the pinger on the application's network stack.
+
+        This will allow the pinger to attempt to connect to the
+        application's ports. With several instances, the pinger has a
+        network stack of its own, and connects to the instances (and the
+        load balancer) by their addresses.
+        """
+        if self.instances > 1:
+            self.pinger_container.start()
+            return
         try:
             self.pinger_container.start(
                 network_mode='container:{}'.format(self.app_container.get_id()))
@@ -390,12 +1010,17 @@ class ContainerSandbox(object):
             self.abort_if_not_running(self.app_container)
             raise
 
-        self.wait_for_start()
-        self.app_container.stream_logs()
-
     def stop(self):
         """Remove containers to clean up the environment."""
+        if self.log_multiplexer:
+            # Emit the containers' last words before they're removed.
+            self.log_multiplexer.stop()
+            get_logger().debug('Log multiplexer: %s',
+                               self.log_multiplexer.stats())
+            self.log_multiplexer = None
         self.stop_and_remove_containers()
+        get_logger().debug('Docker client pool: %s',
+                           utils.get_docker_client_pool().stats())
 
     @staticmethod
     def abort_if_not_running(cont):
@@ -409,28 +1034,123 @@ class ContainerSandbox(object):
 
     def stop_and_remove_containers(self):
         """Stop and remove application containers."""
-        containers_to_remove = [self.app_container,
-                                self.devappserver_container,
-                                self.pinger_container]
+        # A warm devappserver is returned to the pool instead.
+        containers_to_remove = self.app_containers() + [
+            None if self.devappserver_lease else self.devappserver_container,
+            self.pinger_container,
+            self.balancer_container] + [
+                module.container for module in self.modules]
         for cont in containers_to_remove:
-            if cont and cont.running():
+            if not cont:
+                continue
+            if cont.running():
                 cont_id = cont.get_id()
                 get_logger().info('Stopping %s', cont_id)
                 cont.kill()
+            else:
+                # Containers that were created but never started (because
+                # another startup step failed) must be removed as well.
+                cont_id = cont.get_id()
+                if not cont_id:
+                    continue
 
-                get_logger().info('Removing %s', cont_id)
-                cont.remove()
+            get_logger().info('Removing %s', cont_id)
+            cont.remove()
+
+        if self.devappserver_lease:
+            # Keep the devappserver warm for the next sandbox, unless it
+            # stopped (or never started).
+            self.devappserver_pool.release(
+                self.devappserver_lease,
+                keep=self.devappserver_container.running())
+            self.devappserver_lease = None
 
     def wait_for_start(self):
         """Wait for the app container to start.
 
+        With several instances, each instance is waited for in turn, and
+        then the load balancer is started in front of them (so that it
+        never sends a request to an instance that isn't listening yet).
+
         Raises:
             utils.AppstartAbort: If the application server doesn't
                 start after timeout reach it on 8080.
         """
         host = self.app_container.host
+        deadline = time.time() + self.timeout
+
+        if self.instances > 1:
+            backends = []
+            for index, cont in enumerate(self.app_containers()):
+                get_logger().info('Waiting for instance %d to listen on '
+                                  'port 8080', index)
+                address = cont.ip_address()
+                self.wait_for_listener(cont, deadline, address)
+                backends.append('{0}:{1}'.format(address,
+                                                 DEFAULT_APPLICATION_PORT))
+            self.start_balancer_container(backends)
+            get_logger().info('Waiting for the load balancer')
+            self.wait_for_listener(self.balancer_container, deadline,
+                                   self.balancer_address())
+        else:
+            get_logger().info('Waiting for application to listen on port 8080')
+            self.wait_for_listener(self.app_container, deadline)
 
-        get_logger().info('Waiting for application to listen on port 8080')
+        for module in self.modules:
+            get_logger().info('Waiting for module %s', module.name)
+            self.wait_for_listener(module.container, deadline,
+                                   module.container.ip_address())
+
+        # Tell the user where to connect, depending on whether or not the
+        # devappserver is running.
+        if self.run_devappserver:
+            port = self.proxy_port
+        else:
+            port = self.port
+        get_logger().info('Your application is live. '
+                          'Access it at: {0}:{1}'.format(host, port))
+        if self.run_devappserver:
+            get_logger().info('(port {0} goes through the dev_appserver '
+                              'proxy, for direct access use {1})'.format(
+                                  self.proxy_port,
+                                  self.port))
+        module_ports = {self.application_configuration.module_name: port}
+        for module in self.modules:
+            module_ports[module.name] = module.port
+            get_logger().info('Module {0} is live at {1}:{2}'.format(
+                module.name, host, module.port))
+        if self.dispatch_rules:
+            get_logger().info('Dispatch rules:')
+            for url, name in self.dispatch_rules:
+                get_logger().info('  {0} -> {1} ({2}:{3})'.format(
+                    url, name, host, module_ports[name]))
+        if self.app_limits or self.devappserver_limits:
+            requested = {'app': self.app_limits,
+                         'devappserver': self.devappserver_limits}
+            for name, limits in sorted(self.applied_limits().iteritems()):
+                get_logger().info('Resource limits of the %s container: %s',
+                                  name, resources.describe(limits))
+                for mismatch in requested[name].mismatches(limits):
+                    get_logger().warning('Docker did not apply the %s '
+                                         "container's limit as requested "
+                                         '(%s).', name, mismatch)
+
+    def wait_for_listener(self, cont, deadline, host=None):
+        """Wait for something to listen on port 8080.
+
+        Args:
+            cont: (container.Container) The container that should be
+                listening.
+            deadline: (float) When to give up.
+            host: (basestring or None) The address to connect to from the
+                pinger, or None if the pinger is on the container's network
+                stack.
+
+        Raises:
+            utils.AppstartAbort: If nothing listens before the deadline, or
+                if a container stops.
+        """
+        probe_args = {'host': host} if host else {}
         attempt = 1
         graphical = sys.stdout.isatty()
 
@@ -444,14 +1164,16 @@ class ContainerSandbox(object):
             raise utils.AppstartAbort(error)
 
         print_if_graphical('Waiting ')
+        delay = MIN_BACKOFF
         while True:
-            if attempt > self.timeout:
+            remaining = deadline - time.time()
+            if remaining <= 0:
                 exit_loop_with_error('The application server timed out.')
 
             if self.run_devappserver:
                 self.abort_if_not_running(self.devappserver_container)
 
-            self.abort_if_not_running(self.app_container)
+            self.abort_if_not_running(cont)
 
             if attempt % 4 == 0:
                 # \033[3D moves the cursor left 3 times. \033[K clears to the
@@ -460,26 +1182,28 @@ class ContainerSandbox(object):
             else:
                 print_if_graphical('.')
 
-            if self.pinger_container.ping_application_container():
+            # The probe waits inside the pinger container and returns as soon
+            # as the application is listening. Between probes, make sure that
+            # the containers haven't died.
+            with self.tracer.span('ping_attempt', args={'attempt': attempt}):
+                if self.pinger_container.supports_probe:
+                    ready = self.pinger_container.probe_application_container(
+                        min(PROBE_WINDOW, remaining), **probe_args)
+                else:
+                    ready = self.pinger_container.ping_application_container(
+                        **probe_args)
+
+            if ready:
                 print_if_graphical('\n')
                 break
 
             attempt += 1
-            time.sleep(1)
 
-        # Tell the user where to connect, depending on whether or not the
-        # devappserver is running.
-        if self.run_devappserver:
-            port = self.proxy_port
-        else:
-            port = self.port
-        get_logger().info('Your application is live. '
-                          'Access it at: {0}:{1}'.format(host, port))
-        if self.run_devappserver:
-            get_logger().info('(port {0} goes through the dev_appserver '
-                              'proxy, for direct access use {1})'.format(
-                                  self.proxy_port,
-                                  self.port))
+            # Older pinger images can only be polled, so back off between
+            # pings.
+            if not self.pinger_container.supports_probe:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_BACKOFF)
 
     @staticmethod
     def app_directory_from_config(full_config_file_path):
@@ -498,30 +1222,97 @@ class ContainerSandbox(object):
         else:
             return os.path.dirname(conf_file_dir)
 
-    def build_app_image(self):
+    def build_app_image(self, app_dir=None):
         """Build the app image from the Dockerfile in the root directory.
 
+        The image is tagged with a digest of the application directory, as
+        docker would see it, and of the IDs of the images the Dockerfile
+        builds FROM. If an image with that tag exists, the build (and the
+        upload of the directory to the docker daemon) is skipped.
+
+        Args:
+            app_dir: (basestring or None) The directory of the module to
+                build, if not the sandbox's own.
+
         Returns:
             (basestring) The name of the new app image.
         """
-        name = self.make_timestamped_name('app_image', self.cur_time)
-        utils.build_from_directory(self.app_dir, name)
+        app_dir = app_dir or self.app_dir
+
+        # Every module's image counts towards the cache, so keep room for
+        # all of them.
+        cache = image_cache.ImageCache(
+            self.dclient,
+            APP_IMAGE_REPO,
+            self.image_cache_size + len(self.modules))
+        base_image_ids = self.base_image_ids(app_dir)
+        name = cache.image_name(image_cache.digest_directory(
+            app_dir, [image_id or '' for image_id in base_image_ids]))
+        if (not self.nocache and all(base_image_ids) and
+                cache.lookup(name)):
+            get_logger().info('Reusing application image: %s', name)
+            return name
+        utils.build_from_directory(app_dir, name, nocache=self.nocache,
+                                   dclient=self.dclient)
+        cache.record(name)
         return name
 
+    def base_image_ids(self, app_dir):
+        """Resolve the images that app_dir's Dockerfile builds FROM.
+
+        Base images that aren't on the docker host yet are pulled first,
+        like the build would. The empty 'scratch' image isn't a real image,
+        and is left out.
+
+        Args:
+            app_dir: (basestring) The directory of the Dockerfile.
+
+        Returns:
+            ([basestring or None, ...]) The ID of each base image, or None
+            if it couldn't be found.
+        """
+        image_ids = []
+        for base in image_cache.dockerfile_bases(app_dir):
+            if base == 'scratch':
+                continue
+            image_id = self.image_id(base)
+            if not image_id:
+                repo, tag = docker.utils.parse_repository_tag(base)
+                get_logger().info('Pulling base image: %s', base)
+                try:
+                    # Without a tag, docker pulls every tag of the
+                    # repository. The build would use 'latest'.
+                    self.dclient.pull(repo, tag=tag or 'latest')
+                except docker.errors.APIError as err:
+                    get_logger().debug('Could not pull %s: %s', base, err)
+                image_id = self.image_id(base)
+            image_ids.append(image_id)
+        return image_ids
+
+    def image_id(self, image_name):
+        """Get the ID of an image, or None if it isn't on the docker host."""
+        try:
+            return self.dclient.inspect_image(image_name)['Id']
+        except docker.errors.APIError:
+            return None
+
     def build_devappserver_image(self,devbase_image=constants.DEVAPPSERVER_IMAGE):
         """Build a layer over devappserver to include application files.
 
-        The new image contains the user's config files.
+        The new image contains the user's config files, and the static
+        files unless they're mounted (see static_mounts). It is tagged with a
+        digest of its build context (the files, the Dockerfile and the ID of
+        the base image), so if nothing has changed since an earlier run, the
+        image from that run is reused and no build takes place.
 
         Returns:
             (basestring) The name of the new devappserver image.
         """
         # Collect the files that should be added to the docker build
         # context.
-        files_to_add = {self.conf_path: None}
-        if self.application_configuration.is_java:
-            files_to_add[self.get_web_xml(self.conf_path)] = None
-        utils.add_files_from_static_dirs(files_to_add, self.conf_path)
+        files_to_add = dict.fromkeys(self.config_files())
+        if not self.mount_static:
+            utils.add_files_from_static_dirs(files_to_add, self.conf_path)
 
         # The Dockerfile should add the config files to
         # the /app folder in devappserver's container.
@@ -533,19 +1324,36 @@ class ContainerSandbox(object):
                'path': os.path.dirname(self.conf_path),
                'dest': os.path.join('/app', self.das_offset)}
 
+        try:
+            base_image_id = self.dclient.inspect_image(devbase_image)['Id']
+        except docker.errors.APIError:
+            raise utils.AppstartAbort('No devappserver base image found. '
+                                      'Did you forget to run "appstart '
+                                      'init"?')
+
+        cache = image_cache.ImageCache(self.dclient,
+                                       DEVAPPSERVER_IMAGE_REPO,
+                                       self.image_cache_size)
+        image_name = cache.image_name(image_cache.digest_build_context(
+            dockerfile, files_to_add, base_image_id))
+        if not self.nocache and cache.lookup(image_name):
+            get_logger().info('Reusing devappserver image: %s', image_name)
+            return image_name
+
         # Construct a file-like object from the Dockerfile.
         dockerfile_obj = io.BytesIO(dockerfile.encode('utf-8'))
-        build_context = utils.make_tar_build_context(dockerfile_obj,
-                                                     files_to_add)
-        image_name = self.make_timestamped_name('devappserver_image',
-                                                self.cur_time)
-
-        # Build the devappserver image.
-        res = self.dclient.build(fileobj=build_context,
-                                 custom_context=True,
-                                 rm=True,
-                                 nocache=self.nocache,
-                                 tag=image_name)
+        build_context = utils.stream_tar_build_context(
+            dockerfile_obj, files_to_add, self.build_compression)
+
+        # Build the devappserver image. The context is streamed to the
+        # docker daemon as it's generated.
+        res = self.dclient.build(
+            fileobj=build_context,
+            custom_context=True,
+            encoding='gzip' if self.build_compression else None,
+            rm=True,
+            nocache=self.nocache,
+            tag=image_name)
 
         # Log the output of the build.
         try:
@@ -556,6 +1364,7 @@ class ContainerSandbox(object):
                                           'Did you forget to run "appstart '
                                           'init"?')
             raise
+        cache.record(image_name)
         return image_name
 
     @staticmethod
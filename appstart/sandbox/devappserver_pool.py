@@ -0,0 +1,275 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A pool of warm devappserver containers, shared by appstart invocations.
+
+Booting devappserver takes much longer than starting most applications.
+With --reuse, the sandbox leaves its devappserver container running when it
+stops, and the next sandbox with the same devappserver configuration joins
+its application to that container's network stack instead of creating a new
+devappserver.
+
+Warm containers are named after a digest of everything that went into
+creating them (the image, which is itself tagged with a digest of the
+application's configuration, the environment, the port bindings and the
+storage path), so they can be found by name. The pool index, a json file in
+image_cache.CACHE_DIR, records the host ports of each warm container and
+when it was last used. A lock file per container ensures that only one
+sandbox uses it at a time; the lock is released by the OS if appstart dies.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import docker
+
+from .. import utils
+
+import image_cache
+
+
+# Default number of warm containers to keep.
+DEFAULT_MAX_WARM = 3
+
+# Warm containers are named NAME_PREFIX followed by part of their key.
+NAME_PREFIX = 'devappserver_warm_'
+
+# Serializes updates of the pool index between threads. Other processes
+# are kept out with a lock file.
+_index_lock = threading.Lock()
+
+
+def pool_key(image, environment, port_bindings, storage_path, limits=None):
+    """Compute the key of a devappserver container's configuration.
+
+    Args:
+        image: (basestring) The name of the devappserver image.
+        environment: (dict) The container's environment variables.
+        port_bindings: ({int: int, ...}) Container ports mapped to host
+            ports.
+        storage_path: (basestring) The host directory bound to /storage.
+        limits: (dict or None) The resource limits requested for the
+            container, as from resources.parse_limits.
+
+    Returns:
+        (basestring) A hex digest. Containers with the same key are
+        interchangeable.
+    """
+    config = [image,
+              sorted((k, str(v)) for k, v in environment.iteritems()),
+              sorted((str(k), str(v)) for k, v in port_bindings.iteritems()),
+              os.path.abspath(storage_path)]
+    if limits:
+        config.append(sorted(limits.iteritems()))
+    return hashlib.sha256(json.dumps(config)).hexdigest()
+
+
+class Lease(object):
+    """A sandbox's exclusive use of a warm container."""
+
+    def __init__(self, name, lock_file, container_id):
+        """Initializer for Lease.
+
+        Args:
+            name: (basestring) The name of the warm container.
+            lock_file: (file) The locked lock file of the container.
+            container_id: (basestring or None) The id of the running warm
+                container, or None if there is none yet and the sandbox
+                must create it (with this name).
+        """
+        self.name = name
+        self.container_id = container_id
+        self._lock_file = lock_file
+
+    def unlock(self):
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class DevappserverPool(object):
+    """Hands out warm devappserver containers."""
+
+    def __init__(self, dclient, max_warm=DEFAULT_MAX_WARM):
+        """Initializer for DevappserverPool.
+
+        Args:
+            dclient: (docker.Client) The docker client that manages the
+                containers.
+            max_warm: (int) The maximum number of warm containers to keep.
+                Least recently used idle containers beyond that number are
+                removed.
+        """
+        self._dclient = dclient
+        self.max_warm = max_warm
+        self._index_path = os.path.join(image_cache.CACHE_DIR,
+                                        'devappserver_pool.json')
+        self._lock_dir = os.path.join(image_cache.CACHE_DIR, 'locks')
+
+    def acquire(self, key, host_ports):
+        """Lease the warm container for key, if there is one.
+
+        Idle warm containers with a different key that publish any of the
+        same host ports are removed, since they'd keep a new container from
+        starting.
+
+        Args:
+            key: (basestring) The key of the configuration, from pool_key.
+            host_ports: ([int, ...]) The host ports the container publishes.
+
+        Raises:
+            utils.AppstartAbort: If another sandbox is using the container.
+
+        Returns:
+            (Lease) The lease. Its container_id is None if the sandbox has
+            to create the container.
+        """
+        name = NAME_PREFIX + key[:image_cache.TAG_LENGTH]
+        lock_file = self._try_lock(name)
+        if not lock_file:
+            raise utils.AppstartAbort(
+                'The warm devappserver container {0} is being used by '
+                'another appstart process.'.format(name))
+
+        container_id = None
+        try:
+            info = self._dclient.inspect_container(name)
+        except docker.errors.APIError:
+            pass
+        else:
+            if info['State']['Running']:
+                container_id = info['Id']
+            else:
+                self._remove(name)
+
+        host_ports = set(host_ports)
+        with _index_lock:
+            index_lock_file = self._lock_index()
+            try:
+                index = self._load_index()
+                for other in list(index):
+                    if (other != name and
+                            host_ports & set(index[other]['ports'])):
+                        self._evict(other, index)
+                index[name] = {'ports': sorted(host_ports),
+                               'last_used': time.time()}
+                image_cache.atomic_write_json(self._index_path, index)
+            finally:
+                index_lock_file.close()
+        return Lease(name, lock_file, container_id)
+
+    def release(self, lease, keep=True):
+        """Return a container to the pool.
+
+        Args:
+            lease: (Lease) The lease returned by acquire.
+            keep: (bool) Whether the container should stay warm. If False
+                (e.g. because it stopped), it's removed.
+        """
+        with _index_lock:
+            index_lock_file = self._lock_index()
+            try:
+                index = self._load_index()
+                if keep:
+                    index[lease.name] = dict(
+                        index.get(lease.name, {'ports': []}),
+                        last_used=time.time())
+                else:
+                    self._remove(lease.name)
+                    index.pop(lease.name, None)
+                lease.unlock()
+
+                by_age = sorted(index, key=lambda n: index[n]['last_used'],
+                                reverse=True)
+                for name in by_age[self.max_warm:]:
+                    self._evict(name, index)
+                image_cache.atomic_write_json(self._index_path, index)
+            finally:
+                index_lock_file.close()
+
+    def _evict(self, name, index):
+        """Remove a warm container, unless it's in use."""
+        lock_file = self._try_lock(name)
+        if not lock_file:
+            return
+        try:
+            utils.get_logger().info('Removing warm container: %s', name)
+            self._remove(name)
+            del index[name]
+        finally:
+            lock_file.close()
+
+    def _remove(self, name):
+        try:
+            self._dclient.remove_container(name, force=True)
+        except docker.errors.APIError as err:
+            # The container may be gone already.
+            utils.get_logger().debug('Could not remove %s: %s', name, err)
+
+    def _lock_index(self):
+        """Lock the index's lock file, waiting for other processes.
+
+        Returns:
+            (file) The locked file. Closing it releases the lock.
+        """
+        self._make_lock_dir()
+        lock_file = open(os.path.join(self._lock_dir,
+                                      'devappserver_pool.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except IOError:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _make_lock_dir(self):
+        try:
+            os.makedirs(self._lock_dir)
+        except OSError:
+            if not os.path.isdir(self._lock_dir):
+                raise
+
+    def _try_lock(self, name):
+        """Lock a container's lock file without blocking.
+
+        Returns:
+            (file or None) The locked file (closing it releases the lock),
+            or None if another process holds the lock.
+        """
+        self._make_lock_dir()
+        lock_file = open(os.path.join(self._lock_dir, name + '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            lock_file.close()
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        return lock_file
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return index if isinstance(index, dict) else {}
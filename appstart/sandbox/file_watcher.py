@@ -0,0 +1,363 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Watch the application's files, and report what kind of change was made.
+
+On Linux, the watcher uses inotify (through ctypes, so there's nothing to
+install), and learns about a change as soon as it's written. Elsewhere, or if
+inotify is unavailable (e.g. because the user's watch limit is reached), it
+falls back to comparing the modification times of the files every
+POLL_INTERVAL seconds.
+
+Editors tend to save a file in several steps (write a backup, write the
+file, rename, change attributes), and tools like `git checkout` change many
+files at once, so changes are debounced: a batch of changes is reported
+once no file has changed for `debounce` seconds.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import select
+import struct
+import threading
+import time
+
+from .. import utils
+
+
+# Seconds without changes after which a batch of changes is reported.
+DEFAULT_DEBOUNCE = 0.2
+
+# Seconds between scans, when inotify is unavailable.
+POLL_INTERVAL = 1
+
+# Files and directories that are never watched: version control, editor
+# swap and backup files, and compiled python.
+IGNORE_PATTERNS = ['.*', '*~', '#*#', '4913', '*.pyc', '*.pyo',
+                   '__pycache__']
+
+# Dotfiles that are watched nonetheless, since they change what goes into
+# the application image (see image_cache.digest_directory).
+WATCHED_DOTFILES = ['.dockerignore']
+
+# The kinds of changes.
+CODE = 'code'
+CONFIG = 'config'
+STATIC = 'static'
+
+
+def ignored(name):
+    """Check whether a file or directory name matches IGNORE_PATTERNS."""
+    if name in WATCHED_DOTFILES:
+        return False
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORE_PATTERNS)
+
+
+def classify(paths, config_files, static_dirs):
+    """Find out what kinds of changes were made.
+
+    Args:
+        paths: (iterable) The paths of the files that changed.
+        config_files: ([basestring, ...]) The paths of the configuration
+            files.
+        static_dirs: ([basestring, ...]) The paths of the static
+            directories.
+
+    Returns:
+        (set) The kinds of the changes: CONFIG for configuration files,
+        STATIC for files in static directories, and CODE for anything else.
+    """
+    config_files = set(os.path.abspath(f) for f in config_files)
+    kinds = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if path in config_files:
+            kinds.add(CONFIG)
+        elif _inside(path, static_dirs):
+            kinds.add(STATIC)
+        else:
+            kinds.add(CODE)
+    return kinds
+
+
+def any_inside(paths, dirs, exclude=()):
+    """Check whether any of the paths is inside one of the directories.
+
+    Args:
+        paths: (iterable) The paths of the files that changed.
+        dirs: ([basestring, ...]) The directories.
+        exclude: ([basestring, ...]) Directories (inside dirs) whose files
+            don't count.
+
+    Returns:
+        (bool) True iff a path is in one of dirs, but not in exclude.
+    """
+    return any(_inside(path, dirs) and not _inside(path, exclude)
+               for path in paths)
+
+
+def _inside(path, dirs):
+    """Check whether path is one of dirs, or is inside one of them."""
+    path = os.path.join(os.path.abspath(path), '')
+    return any(path.startswith(os.path.join(os.path.abspath(d), ''))
+               for d in dirs)
+
+
+class _Inotify(object):
+    """Recursively watches directories with inotify."""
+
+    # Flags from <sys/inotify.h>.
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+    # struct inotify_event, without its variable-length name.
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, roots):
+        """Start watching.
+
+        Args:
+            roots: ([basestring, ...]) The directories to watch.
+
+        Raises:
+            OSError: If inotify is unavailable.
+        """
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # Watch descriptors, and the directories they watch.
+        self._dirs = {}
+        try:
+            for root in roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, top):
+        for dirname, subdirs, _ in os.walk(top):
+            subdirs[:] = [d for d in subdirs if not ignored(d)]
+            wd = self._libc.inotify_add_watch(self._fd, dirname,
+                                              self.MASK | self.IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # The directory may be gone already.
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(err, 'Could not watch {0}'.format(dirname))
+            self._dirs[wd] = dirname
+
+    def read(self, timeout):
+        """Wait for changes.
+
+        Args:
+            timeout: (float) The maximum number of seconds to wait.
+
+        Returns:
+            ([basestring, ...]) The paths that changed, if any. A new
+            directory is reported as a change of the directory itself.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost; all that's known is that something
+                # changed.
+                paths.extend(self._dirs.values())
+                continue
+            if mask & self.IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            dirname = self._dirs.get(wd)
+            if dirname is None or (name and ignored(name)):
+                continue
+            path = os.path.join(dirname, name) if name else dirname
+            paths.append(path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE |
+                                                self.IN_MOVED_TO):
+                self._add_tree(path)
+        return paths
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _Poller(object):
+    """Finds changes by comparing the modification times of files."""
+
+    def __init__(self, roots, interval=POLL_INTERVAL):
+        self._roots = roots
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self._roots:
+            for dirname, subdirs, files in os.walk(root):
+                subdirs[:] = [d for d in subdirs if not ignored(d)]
+                for name in files:
+                    if ignored(name):
+                        continue
+                    path = os.path.join(dirname, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def read(self, timeout):
+        """Wait for changes. Same as _Inotify.read."""
+        time.sleep(min(timeout, self._interval))
+        snapshot = self._scan()
+        old_snapshot, self._snapshot = self._snapshot, snapshot
+        return [path for path in set(snapshot) | set(old_snapshot)
+                if snapshot.get(path) != old_snapshot.get(path)]
+
+    def close(self):
+        pass
+
+
+class FileWatcher(object):
+    """Reports batches of changes to a set of directories."""
+
+    def __init__(self, roots, on_change, debounce=DEFAULT_DEBOUNCE,
+                 use_inotify=True):
+        """Initializer for FileWatcher.
+
+        Args:
+            roots: ([basestring, ...]) The directories to watch,
+                recursively.
+            on_change: (callable) Called (on the watcher's thread) with the
+                set of paths that changed, for each batch of changes.
+            debounce: (float) The number of seconds without changes after
+                which a batch is reported.
+            use_inotify: (bool) Whether to try inotify before falling back
+                to polling.
+        """
+        self._roots = roots
+        self._on_change = on_change
+        self._debounce = debounce
+        self._stopped = threading.Event()
+        self._thread = None
+        self._backend = None
+        if use_inotify:
+            try:
+                self._backend = _Inotify(roots)
+            except (OSError, AttributeError) as err:
+                utils.get_logger().debug('Not using inotify: %s', err)
+        if not self._backend:
+            self._backend = _Poller(roots)
+
+    def start(self):
+        """Watch on a background thread until stop() is called."""
+        self._thread = threading.Thread(target=self._run,
+                                        name='file-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching, waiting for the background thread to exit."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._backend.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            changes = self.wait_for_changes(timeout=0.5)
+            if changes and not self._stopped.is_set():
+                self._on_change(changes)
+
+    def wait_for_changes(self, timeout):
+        """Wait for a batch of changes.
+
+        Args:
+            timeout: (float) The maximum number of seconds to wait for the
+                first change. Once a change is seen, this waits until the
+                files have been quiet for the debounce interval.
+
+        Returns:
+            (set) The paths that changed. Empty if nothing changed within
+            the timeout.
+        """
+        changes = set(self._read(timeout))
+        if not changes:
+            return changes
+        while not self._stopped.is_set():
+            more = self._read(self._debounce)
+            if not more:
+                break
+            changes.update(more)
+        return changes
+
+    def _read(self, timeout):
+        """Read changes from the backend, falling back to polling.
+
+        inotify can fail to watch a new directory, e.g. once the user's
+        watch limit is reached (ENOSPC), or if the directory can't be read.
+        The watcher then switches to polling rather than stopping.
+        """
+        try:
+            return self._backend.read(timeout)
+        except OSError as err:
+            if isinstance(self._backend, _Poller):
+                raise
+            utils.get_logger().warning(
+                'Could not watch the application with inotify (%s). '
+                'Polling for changes instead.', err)
+            self._backend.close()
+            self._backend = _Poller(self._roots)
+            # The changes that came with the error are lost, so report
+            # everything as changed.
+            return list(self._roots)
@@ -0,0 +1,364 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed caching of the images that appstart builds.
+
+Images are tagged with a digest of everything that went into their build
+context. If an image tagged with the current digest already exists, the
+build can be skipped entirely. When digesting application directories, file
+digests are themselves cached by modification time and size, so unchanged
+files aren't read again.
+
+The ImageCache keeps track of when each digest-tagged image was last used so
+that stale images can be removed in least-recently-used order.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import docker
+
+from .. import utils
+
+
+# Directory where appstart keeps its cache indexes.
+CACHE_DIR = os.environ.get('APPSTART_CACHE_DIR',
+                           os.path.expanduser('~/.appstart/cache'))
+
+# Default number of digest-tagged images to keep per repository.
+DEFAULT_MAX_IMAGES = 5
+
+# Number of hex digits of the digest used in image tags.
+TAG_LENGTH = 16
+
+# Size of the blocks in which files are read while hashing.
+_BLOCK_SIZE = 64 * 1024
+
+# Serializes updates of the cache indexes between threads. Other processes
+# are kept out with a lock file per index.
+_index_lock = threading.Lock()
+
+
+def hash_file(path, hasher):
+    """Feed the contents of the file at path to hasher."""
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(_BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+
+
+def digest_build_context(dockerfile, context_files, base_image_id):
+    """Compute a digest that identifies a custom build context.
+
+    Args:
+        dockerfile: (basestring) The contents of the Dockerfile.
+        context_files: ({basestring: basestring, ...}) A dictionary mapping
+            absolute filepaths to their destination name in the build
+            context (or None to use the filepath), as accepted by
+            utils.make_tar_build_context.
+        base_image_id: (basestring) The ID of the image that the Dockerfile
+            builds FROM.
+
+    Returns:
+        (basestring) A hex digest of the build context.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(base_image_id)
+    hasher.update('\0')
+    hasher.update(dockerfile)
+    for path in sorted(context_files):
+        hasher.update('\0')
+        hasher.update(context_files[path] or path)
+        hasher.update('\0')
+        hash_file(path, hasher)
+    return hasher.hexdigest()
+
+
+def read_dockerignore(dirname):
+    """Read the exclusion patterns from dirname's .dockerignore file.
+
+    Args:
+        dirname: (basestring) The root of a docker build context.
+
+    Returns:
+        ([basestring, ...]) The patterns, as docker.Client.build would read
+        them.
+    """
+    dockerignore = os.path.join(dirname, '.dockerignore')
+    if not os.path.exists(dockerignore):
+        return []
+    with open(dockerignore) as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+class FileDigestIndex(object):
+    """A persistent record of file digests, keyed by path.
+
+    A file's digest is only recomputed if its modification time or size has
+    changed since the digest was recorded. The index is saved in CACHE_DIR
+    between runs, so an unchanged directory can be digested without reading
+    any of its files.
+    """
+
+    def __init__(self, dirname):
+        """Initializer for FileDigestIndex.
+
+        Args:
+            dirname: (basestring) The absolute path to the directory whose
+                files the index covers.
+        """
+        self._index_path = os.path.join(
+            CACHE_DIR,
+            'files.{0}.json'.format(
+                hashlib.sha1(dirname).hexdigest()[:TAG_LENGTH]))
+        try:
+            with open(self._index_path) as f:
+                self._entries = json.load(f)
+        except (IOError, ValueError):
+            self._entries = {}
+        self._used = {}
+
+    def digest(self, path, stat_result):
+        """Get the digest of the contents of the file at path.
+
+        Args:
+            path: (basestring) The absolute path to a regular file.
+            stat_result: (posix.stat_result) The result of stat'ing path.
+
+        Returns:
+            (basestring) A hex digest of the file's contents.
+        """
+        key = [stat_result.st_mtime, stat_result.st_size]
+        entry = self._entries.get(path)
+        if entry and entry[:2] == key:
+            digest = entry[2]
+        else:
+            hasher = hashlib.sha256()
+            hash_file(path, hasher)
+            digest = hasher.hexdigest()
+        self._used[path] = key + [digest]
+        return digest
+
+    def save(self):
+        """Save the digests used since the index was loaded."""
+        atomic_write_json(self._index_path, self._used)
+
+
+def dockerfile_bases(dirname):
+    """Find the images that dirname's Dockerfile builds FROM.
+
+    Args:
+        dirname: (basestring) The root of a docker build context.
+
+    Returns:
+        ([basestring, ...]) The base images, in the order of their FROM
+        instructions. Empty if there is no Dockerfile.
+    """
+    try:
+        with open(os.path.join(dirname, 'Dockerfile')) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return []
+    bases = []
+    for line in lines:
+        words = line.split()
+        if len(words) >= 2 and words[0].upper() == 'FROM':
+            bases.append(words[1])
+    return bases
+
+
+def digest_directory(dirname, base_image_ids=()):
+    """Compute a digest of the build context docker would make of dirname.
+
+    Paths excluded by the directory's .dockerignore file are not part of
+    the digest, since docker doesn't send them to the daemon either.
+
+    Args:
+        dirname: (basestring) The absolute path to a directory containing a
+            Dockerfile.
+        base_image_ids: ([basestring, ...]) The IDs of the images that the
+            Dockerfile builds FROM (see dockerfile_bases), so that pulling
+            or rebuilding a base image changes the digest.
+
+    Returns:
+        (basestring) A hex digest of the build context.
+    """
+    index = FileDigestIndex(dirname)
+    hasher = hashlib.sha256()
+    for base_image_id in base_image_ids:
+        hasher.update('{0}\0'.format(base_image_id))
+    paths = docker.utils.exclude_paths(dirname, read_dockerignore(dirname))
+    for path in sorted(paths):
+        full_path = os.path.join(dirname, path)
+        stat_result = os.lstat(full_path)
+        hasher.update('\0{0}\0{1:o}\0'.format(path, stat_result.st_mode))
+        if stat.S_ISREG(stat_result.st_mode):
+            hasher.update(index.digest(full_path, stat_result))
+        elif stat.S_ISLNK(stat_result.st_mode):
+            hasher.update(os.readlink(full_path))
+    index.save()
+    return hasher.hexdigest()
+
+
+def _is_not_found(err):
+    """Check whether a docker.errors.APIError means "no such image"."""
+    response = getattr(err, 'response', None)
+    return response is not None and response.status_code == 404
+
+
+def atomic_write_json(path, obj):
+    """Write obj to path, so that concurrent runs never see partial files."""
+    try:
+        os.makedirs(CACHE_DIR)
+    except OSError:
+        if not os.path.isdir(CACHE_DIR):
+            raise
+    fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    os.rename(temp_path, path)
+
+
+class ImageCache(object):
+    """Tracks the digest-tagged images of a repository.
+
+    The cache index is a json file mapping image names to the time they were
+    last used. It lives in CACHE_DIR, and is shared by every appstart
+    invocation.
+    """
+
+    def __init__(self, dclient, repository, max_images=DEFAULT_MAX_IMAGES):
+        """Initializer for ImageCache.
+
+        Args:
+            dclient: (docker.Client) The docker client that manages the
+                images.
+            repository: (basestring) The repository that digest-tagged
+                images are put in.
+            max_images: (int) The maximum number of images to keep in the
+                repository. Least recently used images beyond that number
+                are removed.
+        """
+        self._dclient = dclient
+        self.repository = repository
+        self.max_images = max_images
+        self._index_path = os.path.join(CACHE_DIR, repository + '.json')
+
+    def image_name(self, digest):
+        """Get the name of the image built from a context with digest."""
+        return '{0}:{1}'.format(self.repository, digest[:TAG_LENGTH])
+
+    def lookup(self, image_name):
+        """Check if image_name has already been built.
+
+        Args:
+            image_name: (basestring) The image to look for, as returned by
+                image_name().
+
+        Returns:
+            (bool) True iff the image exists. Found images are marked as
+            recently used.
+        """
+        try:
+            self._dclient.inspect_image(image_name)
+        except docker.errors.APIError:
+            return False
+        self.record(image_name)
+        return True
+
+    def record(self, image_name):
+        """Mark image_name as used just now and evict stale images.
+
+        Args:
+            image_name: (basestring) The name of an image in the repository.
+        """
+        # Several images may be built at once (one per module), and other
+        # appstart invocations share the index, so hold its lock while it's
+        # updated.
+        with _index_lock:
+            lock_file = self._lock_index()
+            try:
+                index = self._load_index()
+                index[image_name] = time.time()
+                self._collect_garbage(index, image_name)
+                self._save_index(index)
+            finally:
+                lock_file.close()
+
+    def _collect_garbage(self, index, keep):
+        """Remove the least recently used images beyond max_images.
+
+        Args:
+            index: (dict) The cache index, which is updated.
+            keep: (basestring) The image that was just used. It's never
+                removed, since its container may not exist yet.
+        """
+        by_age = sorted(index, key=index.get, reverse=True)
+        for image_name in by_age[self.max_images:]:
+            if image_name == keep:
+                continue
+            utils.get_logger().info('Removing stale image: %s', image_name)
+            try:
+                self._dclient.remove_image(image_name)
+            except docker.errors.APIError as err:
+                # An image that's still in use by a container stays in the
+                # index, so that removing it is retried next time.
+                utils.get_logger().debug('Could not remove %s: %s',
+                                         image_name, err)
+                if not _is_not_found(err):
+                    continue
+            del index[image_name]
+
+    def _lock_index(self):
+        """Lock the index's lock file, waiting for other processes.
+
+        Returns:
+            (file) The locked file. Closing it releases the lock.
+        """
+        lock_dir = os.path.join(CACHE_DIR, 'locks')
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            if not os.path.isdir(lock_dir):
+                raise
+        lock_file = open(os.path.join(lock_dir, self.repository + '.lock'),
+                         'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except IOError:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _save_index(self, index):
+        atomic_write_json(self._index_path, index)
@@ -0,0 +1,325 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Follow the logs of several containers on a single thread.
+
+Rather than holding a streaming logs request open per container (which
+times out every minute, and has to be reopened), the LogMultiplexer
+periodically asks docker for the most recent lines of each container's
+logs, with timestamps. Each container has a cursor (the timestamp of the
+last line that was emitted, and how many lines with that timestamp were
+emitted), so lines are never emitted twice, even if several of them have the
+same timestamp.
+
+Polling adapts to the containers: while they're logging, the multiplexer
+polls often, and when they're quiet, it backs off. At most `tail` lines are
+read per container and poll, which bounds the memory used no matter how
+chatty the containers are. If a container writes more than that between two
+polls, the window is widened (up to MAX_TAIL) and read again before anything
+is emitted, and it narrows again once the container quietens down.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import re
+import threading
+
+import docker
+
+from .. import utils
+
+
+# Bounds (in seconds) of the delay between polls.
+MIN_INTERVAL = 0.25
+MAX_INTERVAL = 4
+
+# Bounds of the number of lines requested per container and poll.
+DEFAULT_TAIL = 200
+MAX_TAIL = 5000
+
+# The RFC 3339 timestamps that docker prefixes log lines with.
+TIMESTAMP_RX = re.compile(
+    r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,9})?Z$')
+
+
+def parse_timestamp(timestamp):
+    """Turn a docker log timestamp into something that sorts correctly.
+
+    Docker writes RFC 3339 timestamps in UTC, with up to nine digits of
+    fractional seconds, and trailing zeros removed. Those don't compare
+    correctly as strings ('...:36Z' > '...:36.5Z').
+
+    Args:
+        timestamp: (basestring) A timestamp, e.g.
+            '2015-10-10T13:55:36.123456789Z'.
+
+    Returns:
+        ((basestring, basestring)) The whole seconds, and the nanoseconds
+        as a string of nine digits.
+    """
+    seconds, _, fraction = timestamp.rstrip('Z').partition('.')
+    return seconds, fraction.ljust(9, '0')
+
+
+def split_logs(logs):
+    """Split docker's timestamped logs into lines.
+
+    Lines end with '\n' only: a '\r' (e.g. from a progress bar) is part of
+    a line. Anything that doesn't start with a timestamp is skipped, since
+    it can't be placed relative to the cursor.
+
+    Args:
+        logs: (basestring) The logs, as returned by docker.Client.logs with
+            timestamps=True.
+
+    Returns:
+        ([((basestring, basestring), basestring), ...]) The timestamp of
+        each line (as from parse_timestamp) and its message.
+    """
+    lines = []
+    for line in logs.split('\n'):
+        timestamp, _, message = line.partition(' ')
+        if TIMESTAMP_RX.match(timestamp):
+            lines.append((parse_timestamp(timestamp), message))
+    return lines
+
+
+def log_line(name, line):
+    """Log a line of a container's output."""
+    utils.get_logger().debug('{0}: {1}'.format(name, line))
+
+
+class _Followed(object):
+    """The state of a container that the multiplexer follows."""
+
+    def __init__(self, cont, tail):
+        self.container = cont
+        self.name = cont.name
+        self.tail = tail
+
+        # Set once the container no longer exists.
+        self.gone = False
+
+        # The timestamp of the last line that was emitted, as from
+        # parse_timestamp, or None if no line was. Several lines can have
+        # the same timestamp (docker's clock may be coarser than the rate
+        # at which lines are written), so the number of lines that were
+        # emitted with the cursor's timestamp is kept as well.
+        self.cursor = None
+        self.lines_at_cursor = 0
+
+        # The number of lines emitted, and their size in bytes (without
+        # timestamps).
+        self.lines = 0
+        self.bytes = 0
+
+    def advance(self, timestamp, message):
+        """Move the cursor past a line that's being emitted."""
+        if timestamp == self.cursor:
+            self.lines_at_cursor += 1
+        else:
+            self.cursor = timestamp
+            self.lines_at_cursor = 1
+        self.lines += 1
+        self.bytes += len(message) + 1
+
+
+class LogMultiplexer(object):
+    """Follows the stdout/stderr of any number of containers."""
+
+    def __init__(self, dclient, sink=log_line, tail=DEFAULT_TAIL):
+        """Initializer for LogMultiplexer.
+
+        Args:
+            dclient: (docker.Client) The client to read logs with.
+            sink: (callable) Called with the name of the container and a
+                line (without its timestamp or line ending) for each line.
+            tail: (int) The number of lines to request per container and
+                poll, initially.
+        """
+        self._dclient = dclient
+        self._sink = sink
+        self._tail = tail
+        self._followed = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # The number of polls of individual containers, and the number of
+        # bytes they read (which includes lines that had already been
+        # emitted).
+        self._polls = 0
+        self._bytes_read = 0
+
+    def add(self, cont, history=True):
+        """Start following a container's logs.
+
+        Args:
+            cont: (container.Container) A created container.
+            history: (bool) Whether to emit the lines that the container
+                logged before it was added (as many as fit in the window).
+                Containers that were in use before, such as warm
+                devappserver containers, have histories that are not
+                worth repeating.
+        """
+        state = _Followed(cont, self._tail)
+        if not history:
+            try:
+                logs = self._dclient.logs(container=cont.get_id(),
+                                          stream=False, timestamps=True,
+                                          tail=state.tail)
+            except (docker.errors.APIError, docker.errors.NullResource):
+                logs = ''
+            for timestamp, _ in split_logs(logs):
+                state.advance(timestamp, '')
+            state.lines = state.bytes = 0
+        with self._lock:
+            self._followed.append(state)
+
+    def start(self):
+        """Follow the logs on a background thread until stop() is called."""
+        self._thread = threading.Thread(target=self._run,
+                                        name='log-multiplexer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, flush=True):
+        """Stop following logs, waiting for the background thread to exit.
+
+        Args:
+            flush: (bool) Whether to emit the lines that were logged since
+                the last poll before returning. The containers must still
+                exist for that.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.poll()
+
+    def _run(self):
+        interval = MIN_INTERVAL
+        while not self._stopped.wait(interval):
+            if self.poll():
+                interval = MIN_INTERVAL
+            else:
+                interval = min(interval * 2, MAX_INTERVAL)
+
+    def poll(self):
+        """Emit the lines that were logged since the last poll.
+
+        Containers that no longer exist are no longer followed.
+
+        Returns:
+            (int) The number of lines that were emitted.
+        """
+        with self._lock:
+            followed = [state for state in self._followed if not state.gone]
+
+        emitted = 0
+        for state in followed:
+            try:
+                emitted += self._poll_container(state)
+            except (docker.errors.APIError, docker.errors.NullResource):
+                state.gone = True
+        return emitted
+
+    def stats(self):
+        """Report how much has been read and emitted.
+
+        Returns:
+            ({str: int}) A dictionary with the number of lines and bytes
+            emitted (in total, and for each container, as
+            '<name>_lines' and '<name>_bytes'), the number of times a
+            container's logs were polled, and the number of bytes those
+            polls read.
+        """
+        with self._lock:
+            result = {'polls': self._polls,
+                      'bytes_read': self._bytes_read,
+                      'lines': 0,
+                      'bytes': 0}
+            for state in self._followed:
+                result['{0}_lines'.format(state.name)] = state.lines
+                result['{0}_bytes'.format(state.name)] = state.bytes
+                result['lines'] += state.lines
+                result['bytes'] += state.bytes
+        return result
+
+    def _read_logs(self, state):
+        logs = self._dclient.logs(container=state.container.get_id(),
+                                  stream=False,
+                                  timestamps=True,
+                                  tail=state.tail)
+        with self._lock:
+            self._polls += 1
+            self._bytes_read += len(logs)
+        return split_logs(logs)
+
+    def _poll_container(self, state):
+        while True:
+            lines = self._read_logs(state)
+            new_lines = self._new_lines(state, lines)
+
+            # If a full window doesn't reach back before the cursor, lines
+            # may have been logged before it: either every line in it is
+            # new, or it starts with the cursor's timestamp, and the lines
+            # with that timestamp can only be told apart by counting them
+            # from the first one. Read a wider window before emitting
+            # anything.
+            if (state.cursor is None or len(lines) < state.tail or
+                    lines[0][0] < state.cursor):
+                break
+            if state.tail >= MAX_TAIL:
+                if lines[0][0] == state.cursor:
+                    utils.get_logger().warning(
+                        '%s logged more than %d lines with the same '
+                        'timestamp. Some lines may be skipped or repeated.',
+                        state.name, MAX_TAIL)
+                else:
+                    utils.get_logger().warning(
+                        '%s logged more than %d lines between two polls. '
+                        'Some lines were skipped.', state.name, MAX_TAIL)
+                break
+            state.tail = min(state.tail * 2, MAX_TAIL)
+
+        # Once the container has quietened down, narrow the window again so
+        # that idle polls stay cheap.
+        if state.tail > self._tail and len(new_lines) * 4 <= state.tail:
+            state.tail = max(state.tail // 2, self._tail)
+
+        for timestamp, message in new_lines:
+            self._sink(state.name, message.rstrip())
+            state.advance(timestamp, message)
+        return len(new_lines)
+
+    @staticmethod
+    def _new_lines(state, lines):
+        """Pick the lines of a window that come after the cursor."""
+        new_lines = []
+        seen_at_cursor = 0
+        for timestamp, message in lines:
+            if state.cursor is not None:
+                if timestamp < state.cursor:
+                    continue
+                if timestamp == state.cursor:
+                    # The first lines_at_cursor lines with the cursor's
+                    # timestamp were emitted by an earlier poll.
+                    seen_at_cursor += 1
+                    if seen_at_cursor <= state.lines_at_cursor:
+                        continue
+            new_lines.append((timestamp, message))
+        return new_lines
@@ -0,0 +1,123 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The modules of an application, besides the default one.
+
+The sandbox runs the module of its config file as before, on devappserver's
+network stack. Every other module gets a container of its own (with its own
+network stack, reaching the api server at devappserver's address), and is
+published on a port of its own.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+
+import yaml
+
+from .. import utils
+
+import configuration
+
+
+class Module(object):
+    """A module that runs next to the sandbox's main one."""
+
+    def __init__(self, config_file, port):
+        """Initializer for Module.
+
+        Args:
+            config_file: (basestring) The path to the module's config file.
+            port: (int) The host port that the module is published on.
+
+        Raises:
+            utils.AppstartAbort: If the config file is invalid.
+        """
+        # container_sandbox imports this module, so it's imported here.
+        import container_sandbox  # pylint: disable=g-import-not-at-top
+
+        self.conf_path = os.path.abspath(config_file)
+        self.configuration = configuration.ApplicationConfiguration(
+            self.conf_path)
+        self.name = self.configuration.module_name
+        sandbox_class = container_sandbox.ContainerSandbox
+        self.app_dir = sandbox_class.app_directory_from_config(self.conf_path)
+        self.port = port
+
+        # The image and the container, once they're made.
+        self.image = None
+        self.container = None
+
+
+def assign_ports(count, first_port, taken):
+    """Choose host ports for modules.
+
+    Args:
+        count: (int) The number of ports needed.
+        first_port: (int) The lowest port to use.
+        taken: (iterable) Ports that are already in use by the sandbox.
+
+    Returns:
+        ([int, ...]) count consecutive free ports, skipping taken ones.
+    """
+    taken = set(taken)
+    ports = []
+    port = first_port
+    while len(ports) < count:
+        if port not in taken:
+            ports.append(port)
+        port += 1
+    return ports
+
+
+def load_dispatch(dispatch_file, module_names):
+    """Read the routing rules of a dispatch.yaml file.
+
+    Args:
+        dispatch_file: (basestring) The path to the file.
+        module_names: (container) The names of the modules that run.
+
+    Raises:
+        utils.AppstartAbort: If the file is malformed, or routes to a
+            module that doesn't run.
+
+    Returns:
+        ([(basestring, basestring), ...]) The rules, as (url pattern,
+        module name) pairs, in order.
+    """
+    try:
+        with open(dispatch_file) as f:
+            config = yaml.safe_load(f)
+    except (IOError, yaml.YAMLError) as err:
+        raise utils.AppstartAbort('Could not read {0}: {1}'.format(
+            dispatch_file, err))
+    rules = config.get('dispatch') if isinstance(config, dict) else None
+    if not isinstance(rules, list):
+        raise utils.AppstartAbort('{0} has no "dispatch" '
+                                  'list'.format(dispatch_file))
+
+    result = []
+    for rule in rules:
+        if not (isinstance(rule, dict) and rule.get('url') and
+                (rule.get('module') or rule.get('service'))):
+            raise utils.AppstartAbort('Invalid rule in {0}: {1!r}'.format(
+                dispatch_file, rule))
+        name = str(rule.get('module') or rule.get('service'))
+        if name not in module_names:
+            raise utils.AppstartAbort(
+                '{0} routes {1} to the module {2}, which is not '
+                'running.'.format(dispatch_file, rule['url'], name))
+        result.append((str(rule['url']), name))
+    return result
@@ -0,0 +1,266 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resource limits for the sandbox's containers.
+
+Limits are given as KEY=VALUE strings (e.g. from --app_limit), one per
+limit:
+
+    memory=512m         Memory limit (bytes, or with a b/k/m/g suffix).
+    memory_swap=1g      Memory plus swap limit. -1 means unlimited swap.
+    cpu_shares=512      Relative CPU weight (docker's default is 1024).
+    cpuset=0-1,3        The CPUs the container may run on.
+    cpus=1.5            Shorthand for cpu_period=100000, cpu_quota=150000.
+    cpu_quota=50000     Microseconds of CPU time per cpu_period.
+    cpu_period=100000   The CFS period, in microseconds.
+    ulimit=nofile=1024:2048
+                        A ulimit, as NAME=SOFT[:HARD]. May be repeated.
+
+Where each limit goes in the create request depends on the docker API
+version, and some limits don't exist in the version that appstart speaks
+(utils.DOCKER_API_VERSION), so ContainerLimits picks the lowest version that
+can express all of the requested limits (see MIN_API_VERSIONS), and lets
+docker-py build the request for it. Containers with such limits are created
+with a client for that version; every docker that appstart supports speaks
+it. What docker actually applied is read back by inspecting the container
+(see applied), so that it can be checked against the request and recorded
+next to benchmark results.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import re
+
+import docker
+
+from .. import utils
+
+
+# The default CFS period, used by the cpus shorthand.
+DEFAULT_CPU_PERIOD = 100000
+
+CPUSET_RX = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+
+# The lowest docker API version that takes each limit.
+MIN_API_VERSIONS = {'ulimits': '1.18',
+                    'cpu_quota': '1.19',
+                    'cpu_period': '1.19'}
+
+# From this docker API version on, memory limits are part of the HostConfig
+# rather than of the container's Config.
+HOST_CONFIG_MEMORY_API_VERSION = '1.19'
+
+# The names of the limits, the docker-py arguments that set them, and the
+# keys (in the HostConfig, or else in the Config) that docker reports them
+# with when a container is inspected.
+LIMITS = [('memory', 'mem_limit', ['Memory']),
+          ('memory_swap', 'memswap_limit', ['MemorySwap']),
+          ('cpu_shares', 'cpu_shares', ['CpuShares']),
+          ('cpuset', 'cpuset', ['CpusetCpus', 'Cpuset']),
+          ('cpu_quota', 'cpu_quota', ['CpuQuota']),
+          ('cpu_period', 'cpu_period', ['CpuPeriod']),
+          ('ulimits', 'ulimits', ['Ulimits'])]
+
+
+def _parse_bytes(value):
+    try:
+        return docker.utils.parse_bytes(value)
+    except docker.errors.DockerException as err:
+        raise ValueError(str(err))
+
+
+def _parse_cpuset(value):
+    if not CPUSET_RX.match(value):
+        raise ValueError('expected a list of CPUs, like 0-1,3')
+    return value
+
+
+def _parse_ulimit(value):
+    name, sep, limits = value.partition('=')
+    soft, _, hard = limits.partition(':')
+    if not (name and sep and soft):
+        raise ValueError('expected NAME=SOFT[:HARD]')
+    soft = int(soft)
+    return {'Name': name, 'Soft': soft, 'Hard': int(hard) if hard else soft}
+
+
+# The parser of each limit (except cpus and ulimit, which are special).
+_PARSERS = {
+    'memory': _parse_bytes,
+    'memory_swap': lambda v: -1 if v == '-1' else _parse_bytes(v),
+    'cpu_shares': int,
+    'cpu_quota': int,
+    'cpu_period': int,
+    'cpuset': _parse_cpuset,
+}
+
+
+def parse_limits(specs, container_name):
+    """Parse KEY=VALUE limits.
+
+    Args:
+        specs: ([basestring, ...] or None) The limits.
+        container_name: (basestring) The container the limits are for, to
+            report errors with.
+
+    Raises:
+        utils.AppstartAbort: If a limit is unknown or malformed.
+
+    Returns:
+        (dict) The limits, by their names in LIMITS. cpus is turned into
+        cpu_quota and cpu_period, and ulimits are a list of dicts with
+        docker's Name, Soft and Hard keys.
+    """
+    limits = {}
+    cpus = None
+    for spec in specs or []:
+        key, sep, value = spec.partition('=')
+        key = key.strip()
+        value = value.strip()
+        try:
+            if not sep or not value:
+                raise ValueError('expected KEY=VALUE')
+            if key == 'cpus':
+                cpus = float(value)
+                if cpus <= 0:
+                    raise ValueError('must be positive')
+            elif key == 'ulimit':
+                limits.setdefault('ulimits', []).append(_parse_ulimit(value))
+            elif key in _PARSERS:
+                limits[key] = _PARSERS[key](value)
+            else:
+                raise ValueError('unknown limit. Expected one of: {0}'.format(
+                    ', '.join(sorted(list(_PARSERS) + ['cpus', 'ulimit']))))
+        except ValueError as err:
+            raise utils.AppstartAbort('Invalid {0} limit "{1}": {2}'.format(
+                container_name, spec, err))
+
+    # cpus is a fraction of whichever period applies, wherever it was given.
+    if cpus is not None:
+        if 'cpu_quota' in limits:
+            raise utils.AppstartAbort('The {0} limits cpus and cpu_quota '
+                                      'cannot be combined.'.format(
+                                          container_name))
+        limits.setdefault('cpu_period', DEFAULT_CPU_PERIOD)
+        limits['cpu_quota'] = int(cpus * limits['cpu_period'])
+    return limits
+
+
+class ContainerLimits(object):
+    """The resource limits of a container, as docker-py takes them."""
+
+    def __init__(self, specs, container_name, api_version=None):
+        """Initializer for ContainerLimits.
+
+        Args:
+            specs: ([basestring, ...] or None) The limits, as KEY=VALUE
+                strings.
+            container_name: (basestring) The container the limits are for,
+                to report errors with.
+            api_version: (basestring or None) The docker API version that
+                the container would be created with, unless the limits need
+                a newer one. Defaults to utils.DOCKER_API_VERSION.
+
+        Raises:
+            utils.AppstartAbort: If a limit is unknown or malformed.
+        """
+        api_version = api_version or utils.DOCKER_API_VERSION
+        self.requested = parse_limits(specs, container_name)
+        for name, min_version in sorted(MIN_API_VERSIONS.iteritems()):
+            if (name in self.requested and
+                    docker.utils.compare_version(min_version,
+                                                 api_version) < 0):
+                api_version = min_version
+
+        # The docker API version to create the container with.
+        self.api_version = api_version
+
+        # Keyword arguments of docker.Client.create_container.
+        self.create_kwargs = {}
+        # Keyword arguments of docker.utils.create_host_config.
+        host_config_kwargs = {}
+        memory_in_host_config = docker.utils.compare_version(
+            HOST_CONFIG_MEMORY_API_VERSION, api_version) >= 0
+        for name, kwarg, _ in LIMITS:
+            if name not in self.requested:
+                continue
+            if (name in ('cpu_shares', 'cpuset') or
+                    (name in ('memory', 'memory_swap') and
+                     not memory_in_host_config)):
+                self.create_kwargs[kwarg] = self.requested[name]
+            else:
+                host_config_kwargs[kwarg] = self.requested[name]
+
+        # The entries to add to the container's HostConfig. Only the limits
+        # are kept: create_host_config fills in defaults (e.g. NetworkMode)
+        # that the sandbox sets itself.
+        self.host_config = {}
+        if host_config_kwargs:
+            host_config = docker.utils.create_host_config(
+                version=api_version, **host_config_kwargs)
+            for _, _, keys in LIMITS:
+                if keys[0] in host_config:
+                    self.host_config[keys[0]] = host_config[keys[0]]
+
+    def __nonzero__(self):
+        return bool(self.requested)
+
+    def mismatches(self, applied_limits):
+        """Find the requested limits that docker didn't apply.
+
+        Args:
+            applied_limits: (dict) The limits of the container, as from
+                applied.
+
+        Returns:
+            ([basestring, ...]) A description of each difference.
+        """
+        return ['{0}: requested {1}, applied {2}'.format(
+            name, self.requested[name], applied_limits.get(name))
+                for name, _, _ in LIMITS
+                if name in self.requested and
+                self.requested[name] != applied_limits.get(name)]
+
+
+def applied(inspection):
+    """Get the limits from a container's inspection.
+
+    Args:
+        inspection: (dict) The container, as from docker.Client.
+            inspect_container.
+
+    Returns:
+        (dict) The limits, by their names in LIMITS. Docker reports 0 (or
+        nothing) for limits that aren't set.
+    """
+    sections = [inspection.get('HostConfig') or {},
+                inspection.get('Config') or {}]
+    limits = {}
+    for name, _, keys in LIMITS:
+        values = [section.get(key) for section in sections for key in keys
+                  if section.get(key)]
+        limits[name] = values[0] if values else (
+            [] if name == 'ulimits' else '' if name == 'cpuset' else 0)
+    return limits
+
+
+def describe(limits):
+    """Describe applied limits in one line of text."""
+    parts = ['{0}={1}'.format(name, limits[name])
+             for name, _, _ in LIMITS if name != 'ulimits' and
+             limits.get(name)]
+    parts.extend('ulimit={0}={1}:{2}'.format(l['Name'], l['Soft'], l['Hard'])
+                 for l in limits.get('ulimits', []))
+    return ', '.join(parts) or 'unlimited'
@@ -0,0 +1,197 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run interdependent startup steps concurrently.
+
+The sandbox's startup consists of a handful of slow steps (image builds,
+container creation) with a few ordering constraints between them (the
+application can only join devappserver's network stack once devappserver is
+running). The StartupScheduler runs each step on a small pool of worker
+threads as soon as the steps it depends on have finished.
+
+If a step fails (or the main thread is interrupted), no further steps are
+started, but the steps that are already running are allowed to finish. This
+way, every container that was created is known to the sandbox by the time
+the error reaches it, and the sandbox can clean up as usual.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import Queue
+import sys
+import threading
+import time
+
+from .. import tracing
+from .. import utils
+
+
+# Default number of worker threads.
+DEFAULT_MAX_WORKERS = 4
+
+# How often (in seconds) the main thread wakes up while waiting for steps.
+# Waiting with a timeout keeps the main thread responsive to SIGINT.
+_POLL_INTERVAL = 0.1
+
+
+class StartupScheduler(object):
+    """Runs named steps in dependency order on a pool of threads."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, tracer=None):
+        """Initializer for StartupScheduler.
+
+        Args:
+            max_workers: (int) The maximum number of steps to run at once.
+            tracer: (tracing.Tracer or None) If given, each step is recorded
+                as a span.
+        """
+        self.max_workers = max_workers
+        self.tracer = tracer or tracing.NullTracer()
+
+        # Insertion-ordered list of step names, and their definitions.
+        self._order = []
+        self._steps = {}
+
+        # The return values of finished steps, keyed by step name.
+        self.results = {}
+
+        # The (start, end) times of finished steps, relative to the start of
+        # run(), keyed by step name.
+        self.timings = {}
+        self._start_time = None
+
+    def add(self, name, func, deps=()):
+        """Add a step.
+
+        Args:
+            name: (basestring) A unique name for the step.
+            func: (callable) A function taking no arguments. Its return
+                value is stored in self.results[name].
+            deps: ([basestring, ...]) The names of the steps that must finish
+                before this one starts.
+
+        Raises:
+            ValueError: If a step with the same name was already added.
+        """
+        if name in self._steps:
+            raise ValueError('Step {0} was already added.'.format(name))
+        self._order.append(name)
+        self._steps[name] = (func, tuple(deps))
+
+    def run(self):
+        """Run all steps, blocking until they're done.
+
+        Raises:
+            ValueError: If a step depends on an unknown step, or if the
+                dependencies form a cycle.
+            Exception: The first exception raised by a step is re-raised
+                (with its original traceback) once all running steps have
+                finished.
+        """
+        self._check_dependencies()
+        ready = Queue.Queue()
+        done = Queue.Queue()
+        workers = [threading.Thread(target=self._work, args=(ready, done))
+                   for _ in range(min(self.max_workers, len(self._order)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        self._start_time = time.time()
+        waiting = list(self._order)
+        running = 0
+        error = None
+        try:
+            while waiting or running:
+                if error is None:
+                    for name in list(waiting):
+                        if all(d in self.results
+                               for d in self._steps[name][1]):
+                            waiting.remove(name)
+                            ready.put(name)
+                            running += 1
+                if not running:
+                    break
+
+                try:
+                    name, result, exc_info = done.get(timeout=_POLL_INTERVAL)
+                except Queue.Empty:
+                    continue
+                except KeyboardInterrupt:
+                    error = error or sys.exc_info()
+                    continue
+                running -= 1
+                if exc_info:
+                    error = error or exc_info
+                else:
+                    self.results[name] = result
+        finally:
+            for _ in workers:
+                ready.put(None)
+
+        if error:
+            raise error[0], error[1], error[2]
+
+    def log_timings(self):
+        """Log when each step started and how long it took."""
+        if not self.timings:
+            return
+        width = max(len(name) for name in self.timings)
+        utils.get_logger().info('Startup phases:')
+        for name in sorted(self.timings, key=self.timings.get):
+            start, end = self.timings[name]
+            utils.get_logger().info('  %s  %6.2fs -> %6.2fs (%.2fs)',
+                                    name.ljust(width), start, end,
+                                    end - start)
+        utils.get_logger().info('  %s  %.2fs total', 'startup'.ljust(width),
+                                max(end for _, end in self.timings.values()))
+
+    def _work(self, ready, done):
+        """Run steps from the ready queue until None is received."""
+        while True:
+            name = ready.get()
+            if name is None:
+                return
+            start = time.time() - self._start_time
+            try:
+                with self.tracer.span(name, 'step'):
+                    result = self._steps[name][0]()
+            except:  # pylint: disable=bare-except
+                result, exc_info = None, sys.exc_info()
+            else:
+                exc_info = None
+            self.timings[name] = (start, time.time() - self._start_time)
+            done.put((name, result, exc_info))
+
+    def _check_dependencies(self):
+        """Make sure every dependency exists and there are no cycles."""
+        visited = set()
+        for name in self._order:
+            self._visit(name, visited, [])
+
+    def _visit(self, name, visited, path):
+        if name in path:
+            raise ValueError('Circular dependency: {0}'.format(
+                ' -> '.join(path + [name])))
+        if name in visited:
+            return
+        if name not in self._steps:
+            raise ValueError('{0} depends on unknown step {1}'.format(
+                path[-1], name))
+        path.append(name)
+        for dep in self._steps[name][1]:
+            self._visit(dep, visited, path)
+        path.pop()
+        visited.add(name)
@@ -0,0 +1,240 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Span-based tracing of appstart's startup.
+
+A Tracer collects spans (named, timed intervals) from any number of threads.
+Wrapping a docker client in a TracedClient records a span for every docker
+API call made through it. The collected trace can be summarized as a text
+waterfall, or written out in the Chrome trace event format (viewable in
+chrome://tracing).
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import contextlib
+import json
+import os
+import threading
+import time
+import types
+
+
+# Width (in characters) of the bars in the waterfall summary.
+WATERFALL_WIDTH = 40
+
+# Keyword arguments of docker calls that are recorded with their spans.
+_RECORDED_KWARGS = ('name', 'image', 'tag', 'container', 'cmd')
+
+
+class Span(object):
+    """A named interval of time, recorded by a Tracer."""
+
+    def __init__(self, name, category, start, depth, thread_id, args):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = None
+        self.depth = depth
+        self.thread_id = thread_id
+        self.args = args
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Tracer(object):
+    """Collects spans from all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._spans = []
+        self.start_time = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name, category='appstart', args=None):
+        """Record the time spent in a with statement as a span.
+
+        Spans opened within another span (on the same thread) are nested
+        under it.
+
+        Args:
+            name: (basestring) The name of the span.
+            category: (basestring) A category to group spans by.
+            args: (dict or None) Extra information to record with the span.
+
+        Yields:
+            (Span) The span being recorded.
+        """
+        stack = self._stack()
+        span = self.begin(name, category, args)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            self.finish(span)
+
+    def begin(self, name, category='appstart', args=None):
+        """Start a span that isn't confined to a with statement.
+
+        The span must be passed to finish() to be recorded. Unlike spans
+        from span(), it doesn't become the parent of spans opened after it.
+
+        Args:
+            name: (basestring) The name of the span.
+            category: (basestring) A category to group spans by.
+            args: (dict or None) Extra information to record with the span.
+
+        Returns:
+            (Span) The span that was started.
+        """
+        return Span(name, category, time.time(), len(self._stack()),
+                    threading.current_thread().ident, args or {})
+
+    def finish(self, span):
+        """Record a span started with begin()."""
+        span.end = time.time()
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        """Get the finished spans, ordered by their start time."""
+        with self._lock:
+            return sorted(self._spans, key=lambda s: (s.start, s.depth))
+
+    def waterfall(self):
+        """Summarize the trace as a text waterfall.
+
+        Returns:
+            ([basestring, ...]) The lines of the summary.
+        """
+        spans = self.spans()
+        if not spans:
+            return []
+        end = max(s.end for s in spans)
+        total = max(end - self.start_time, 1e-6)
+        names = ['  ' * s.depth + s.name for s in spans]
+        width = max(len(name) for name in names)
+
+        lines = ['{0}  {1:>8}  {2:>8}'.format('span'.ljust(width),
+                                             'start', 'duration')]
+        for name, span in zip(names, spans):
+            offset = span.start - self.start_time
+            first = int(offset / total * WATERFALL_WIDTH)
+            length = max(1, int(span.duration / total * WATERFALL_WIDTH))
+            bar = (' ' * first + '#' * length).ljust(WATERFALL_WIDTH)
+            lines.append('{0}  {1:7.3f}s  {2:7.3f}s  |{3}|'.format(
+                name.ljust(width), offset, span.duration,
+                bar[:WATERFALL_WIDTH]))
+        lines.append('{0}  {1:7.3f}s'.format('total'.ljust(width), total))
+        return lines
+
+    def chrome_trace(self):
+        """Get the trace in the Chrome trace event format.
+
+        Returns:
+            (dict) An object that can be serialized with json.dump.
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans():
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': int((span.start - self.start_time) * 1e6),
+                'dur': int(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': span.args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        """Write the trace to path in the Chrome trace event format."""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def _stack(self):
+        """Get the stack of open spans for the current thread."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+
+class NullTracer(Tracer):
+    """A Tracer that doesn't record anything."""
+
+    @contextlib.contextmanager
+    def span(self, name, category='appstart', args=None):
+        yield None
+
+    def begin(self, name, category='appstart', args=None):
+        return None
+
+    def finish(self, span):
+        pass
+
+
+class TracedClient(object):
+    """Wraps a docker.Client, recording a span for each API call."""
+
+    def __init__(self, dclient, tracer):
+        """Initializer for TracedClient.
+
+        Args:
+            dclient: (docker.Client) The client to wrap.
+            tracer: (Tracer) The tracer that records the calls.
+        """
+        self._dclient = dclient
+        self._tracer = tracer
+
+    def __getattr__(self, attr):
+        value = getattr(self._dclient, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+
+        def traced(*args, **kwargs):
+            span_args = {k: kwargs[k] for k in _RECORDED_KWARGS
+                         if isinstance(kwargs.get(k), basestring)}
+            if args and isinstance(args[0], basestring):
+                span_args['arg'] = args[0]
+            with self._tracer.span('docker.' + attr, 'docker', span_args):
+                result = value(*args, **kwargs)
+
+            # Streaming calls (build, exec_start, logs) return generators.
+            # The time spent reading them belongs to the call as well.
+            # File-like replies (e.g. from copy) are iterable too, but
+            # they're read and closed as files, so they're left alone.
+            if hasattr(result, 'read'):
+                return result
+            if (isinstance(result, types.GeneratorType) or
+                    kwargs.get('stream')):
+                return self._trace_stream(attr, result, span_args)
+            return result
+
+        traced.__name__ = attr
+        return traced
+
+    def _trace_stream(self, attr, stream, span_args):
+        span = self._tracer.begin('docker.{0}:stream'.format(attr),
+                                  'docker', span_args)
+        try:
+            for item in stream:
+                yield item
+        finally:
+            self._tracer.finish(span)
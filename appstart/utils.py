@@ -17,10 +17,12 @@
 # This file follows the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import collections
 import logging
 import io
 import json
 import os
+import posixpath
 import re
 import requests
 import socket
@@ -28,7 +30,9 @@ import ssl
 import sys
 import tarfile
 import tempfile
+import threading
 import yaml
+import zlib
 
 import docker
 
@@ -36,6 +40,13 @@ import docker
 # HTTP timeout for docker client
 TIMEOUT_SECS = 60
 
+# Size of the blocks in which build context files are read.
+BUILD_CHUNK_SIZE = 64 * 1024
+
+# Files copied out of containers are held in memory up to this many bytes,
+# and spilled to a temporary file beyond that.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 # Default docker host if user isn't using boot2docker
 LINUX_DOCKER_HOST = '/var/run/docker.sock'
 
@@ -124,30 +135,157 @@ def check_docker_version(dclient):
                                             format_version(MAX_DOCKER_VERSION),
                                             format_version(server_version)))
 
-# TODO(mmuller): "ClientWrapper" is a pretty horrible kludge.  Rewrite it so
-# that it doesn't indiscriminately reconnect every time an attribute is
-# accessed.
 
+class DockerClientPool(object):
+    """A thread-safe cache of docker clients.
+
+    docker.Client is a requests.Session, so a single client keeps a pool of
+    keep-alive connections to the docker daemon. The pool hands out one
+    client per set of connection parameters (base_url, TLS configuration,
+    API version and timeout), so that every component of appstart - including
+    the log streaming threads - reuses the same connections rather than
+    paying for a new connection (and TLS handshake) on every API call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._created = 0
+        self._reused = 0
+
+    @staticmethod
+    def _make_key(params):
+        """Compute the cache key for a set of docker.Client parameters.
 
-class ClientWrapper(object):
+        Args:
+            params: (dict) Keyword arguments for docker.Client.
 
-    def __init__(self, **params):
-        self.__params = params
+        Returns:
+            (tuple) A hashable key identifying the connection.
+        """
+        tls = params.get('tls')
+        tls_key = None
+        if tls:
+            tls_key = (repr(getattr(tls, 'cert', None)),
+                       repr(getattr(tls, 'verify', None)),
+                       getattr(tls, 'ssl_version', None),
+                       getattr(tls, 'assert_hostname', None))
+        return (params.get('base_url'),
+                params.get('version'),
+                params.get('timeout'),
+                tls_key)
+
+    def get(self, **params):
+        """Get a client for params, creating one if necessary.
 
-    def __getattr__(self, attrname):
-        return getattr(docker.Client(**self.__params), attrname)
+        Args:
+            **params: (dict) Keyword arguments for docker.Client.
 
+        Returns:
+            (docker.Client) A shared docker client.
+        """
+        key = self._make_key(params)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = docker.Client(**params)
+                self._clients[key] = client
+                self._created += 1
+            else:
+                self._reused += 1
+            return client
+
+    def discard(self, client):
+        """Remove client from the pool (e.g. after it failed to connect)."""
+        with self._lock:
+            for key, value in self._clients.items():
+                if value is client:
+                    del self._clients[key]
+            close = getattr(client, 'close', None)
+            if close:
+                close()
+
+    def clear(self):
+        """Close and forget all pooled clients."""
+        with self._lock:
+            for client in self._clients.values():
+                close = getattr(client, 'close', None)
+                if close:
+                    close()
+            self._clients = {}
+            self._created = 0
+            self._reused = 0
+
+    def stats(self):
+        """Report how well clients and their connections are being reused.
+
+        Connection counts are read from the urllib3 connection pools
+        underlying each client's transport adapters.
 
-def get_docker_client():
+        Returns:
+            ({str: int}) A dictionary with the number of clients created,
+            the number of times a pooled client was reused, and the number
+            of HTTP requests and new connections made by pooled clients.
+            The difference between the last two is the number of requests
+            that were served on a reused keep-alive connection.
+        """
+        requests_made = 0
+        connections = 0
+        with self._lock:
+            clients = self._clients.values()
+            result = {'clients_created': self._created,
+                      'clients_reused': self._reused}
+        for client in clients:
+            for conn_pool in _connection_pools(client):
+                requests_made += getattr(conn_pool, 'num_requests', 0)
+                connections += getattr(conn_pool, 'num_connections', 0)
+        result['requests'] = requests_made
+        result['connections'] = connections
+        result['connections_reused'] = max(requests_made - connections, 0)
+        return result
+
+
+def _connection_pools(client):
+    """Find the urllib3 connection pools used by a docker client."""
+    pools = []
+    for adapter in getattr(client, 'adapters', {}).values():
+        # requests.adapters.HTTPAdapter keeps its pools in a PoolManager,
+        # docker's UnixAdapter keeps them directly.
+        container = getattr(getattr(adapter, 'poolmanager', None), 'pools',
+                            None) or getattr(adapter, 'pools', None)
+        if container is None:
+            continue
+        for key in container.keys():
+            conn_pool = container.get(key)
+            if conn_pool is not None:
+                pools.append(conn_pool)
+    return pools
+
+
+# Clients shared across all components of appstart.
+_client_pool = DockerClientPool()
+
+
+def get_docker_client_pool():
+    """Get the pool that get_docker_client draws its clients from."""
+    return _client_pool
+
+
+def get_docker_client(api_version=None):
     """Get the user's docker client.
 
+    Args:
+        api_version: (basestring or None) The docker API version that the
+            client speaks. Defaults to DOCKER_API_VERSION.
+
     Raises:
         AppstartAbort: If there was an error in connecting to the
             Docker Daemon.
 
     Returns:
         (docker.Client) a docker client that can be used to manage
-        containers and images.
+        containers and images. Clients are pooled, so repeated calls
+        with the same docker environment return the same client.
     """
     host = os.environ.get('DOCKER_HOST')
     cert_path = os.environ.get('DOCKER_CERT_PATH')
@@ -186,20 +324,22 @@ def get_docker_client():
             assert_hostname=False)
 
     # pylint: disable=star-args
-    client = ClientWrapper(version=DOCKER_API_VERSION,
-                           timeout=TIMEOUT_SECS,
-                           **params)
+    client = _client_pool.get(version=api_version or DOCKER_API_VERSION,
+                              timeout=TIMEOUT_SECS,
+                              **params)
     try:
         client.ping()
     except requests.exceptions.ConnectionError as excep:
+        # Don't hand out a client that can't connect the next time around.
+        _client_pool.discard(client)
         raise AppstartAbort('Failed to connect to Docker '
                             'Daemon due to: {0}'.format(excep.message))
     return client
 
 
-def build_from_directory(dirname, image_name, nocache=False):
+def build_from_directory(dirname, image_name, nocache=False, dclient=None):
     """Builds devappserver base image from source using a Dockerfile."""
-    dclient = get_docker_client()
+    dclient = dclient or get_docker_client()
 
     res = dclient.build(path=dirname,
                         rm=True,
@@ -212,8 +352,14 @@ def build_from_directory(dirname, image_name, nocache=False):
         raise AppstartAbort(err.message)
 
 
-def make_tar_build_context(dockerfile, context_files):
-    """Compose tar file for the new devappserver layer's build context.
+def stream_tar_build_context(dockerfile, context_files, compresslevel=0,
+                             chunk_size=BUILD_CHUNK_SIZE):
+    """Generate a tar build context, a chunk at a time.
+
+    Nothing is written to disk: the tar headers and file contents are
+    produced as the files are read, so the generator can be handed straight
+    to docker.Client.build (as a custom context) and the docker daemon can
+    start reading the context while later files are still being walked.
 
     Args:
         dockerfile: (io.BytesIO or file) a file-like object
@@ -222,14 +368,25 @@ def make_tar_build_context(dockerfile, context_files):
             mapping absolute filepaths to their destination name in
             the tar build context. This is used to specify other files
             that should be added to the build context.
+        compresslevel: (int) The gzip compression level, from 0 to 9. If
+            0, the context is not compressed.
+        chunk_size: (int) The size of the blocks in which files are read.
 
-    Returns:
-        (tempfile.NamedTemporaryFile) a temporary tarfile
-        representing the docker build context.
+    Yields:
+        (str) Consecutive pieces of the (possibly gzipped) tar archive.
     """
+    chunks = _generate_tar(dockerfile, context_files, chunk_size)
+    if compresslevel:
+        chunks = _gzip_chunks(chunks, compresslevel)
+    for chunk in chunks:
+        yield chunk
 
-    f = tempfile.NamedTemporaryFile()
-    t = tarfile.open(mode='w', fileobj=f)
+
+def _generate_tar(dockerfile, context_files, chunk_size):
+    """Generate an uncompressed tar archive. See stream_tar_build_context."""
+    # The TarFile is never written to. It's only used to build headers,
+    # so that they come out exactly as tarfile.addfile would write them.
+    t = tarfile.open(mode='w', fileobj=io.BytesIO())
 
     # Add dockerfile to top level under the name "Dockerfile"
     if isinstance(dockerfile, io.BytesIO):
@@ -238,33 +395,103 @@ def make_tar_build_context(dockerfile, context_files):
         dockerfile.seek(0)
     else:
         dfinfo = t.gettarinfo(fileobj=dockerfile, arcname='Dockerfile')
-    t.addfile(dfinfo, dockerfile)
+    for chunk in _tar_member(t, dfinfo, dockerfile, chunk_size):
+        yield chunk
 
-    # Open all of the context files and add them to the tarfile.
     for path in context_files:
-        with open(path) as file_object:
+        with open(path, 'rb') as file_object:
             file_info = t.gettarinfo(fileobj=file_object,
                                      arcname=context_files[path])
-            t.addfile(file_info, file_object)
+            for chunk in _tar_member(t, file_info, file_object, chunk_size):
+                yield chunk
+
+    # The end of the archive is marked by two empty blocks.
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def _tar_member(t, tarinfo, fileobj, chunk_size):
+    """Generate the header and (padded) contents of one tar member."""
+    yield tarinfo.tobuf(t.format, t.encoding, t.errors)
+    if not tarinfo.isreg():
+        return
+
+    remaining = tarinfo.size
+    while remaining:
+        chunk = fileobj.read(min(chunk_size, remaining))
+        if not chunk:
+            # The file shrank since it was stat'ed. Its header (with the
+            # old size) has already been sent, so the archive is unusable.
+            raise AppstartAbort('{0} changed while building the docker '
+                                'build context.'.format(tarinfo.name))
+        remaining -= len(chunk)
+        yield chunk
+
+    padding = -tarinfo.size % tarfile.BLOCKSIZE
+    if padding:
+        yield tarfile.NUL * padding
+
+
+def _gzip_chunks(chunks, compresslevel):
+    """Gzip a stream of chunks."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def make_tar_build_context(dockerfile, context_files):
+    """Compose tar file for the new devappserver layer's build context.
+
+    Prefer stream_tar_build_context, which doesn't write the context to
+    disk.
 
-    t.close()
+    Args:
+        dockerfile: (io.BytesIO or file) a file-like object
+            representing the Dockerfile.
+        context_files: ({basestring: basestring, ...}) a dictionary
+            mapping absolute filepaths to their destination name in
+            the tar build context. This is used to specify other files
+            that should be added to the build context.
+
+    Returns:
+        (tempfile.NamedTemporaryFile) a temporary tarfile
+        representing the docker build context.
+    """
+    f = tempfile.NamedTemporaryFile()
+    for chunk in stream_tar_build_context(dockerfile, context_files):
+        f.write(chunk)
     f.seek(0)
     return f
 
 
-def add_files_from_static_dirs(file_dict, config_name):
-    """Add all files from static directories specified in the config file.
+def static_dirs(config_name):
+    """Find the static directories specified in the config file.
 
     Args:
-        file_dict: ({str: NoneType}) A dictionary who's keys are filenames.
         config_name: (str) Name of the config file.
 
     Raises:
-        AppstartAbort: An invalid field type was discovered.
+        AppstartAbort: The config file can't be read or parsed, or an
+            invalid field type was discovered.
+
+    Returns:
+        ([str, ...]) The paths of the directories.
     """
-    config = yaml.load(open(config_name))
+    # With --watch, this reads files that may be half-saved.
+    try:
+        with open(config_name) as f:
+            config = yaml.load(f)
+    except (IOError, yaml.YAMLError) as err:
+        raise AppstartAbort('Could not read {0}: {1}'.format(config_name,
+                                                             err))
+    if not isinstance(config, dict):
+        raise AppstartAbort('Malformed yaml file: {0}'.format(config_name))
     root_dir = os.path.dirname(config_name)
     handlers = config.get('handlers')
+    dirs = []
     if handlers and isinstance(handlers, list):
         for handler in handlers:
             if not isinstance(handler, dict):
@@ -274,24 +501,119 @@ def add_files_from_static_dirs(file_dict, config_name):
             if static_dir:
                 if not isinstance(static_dir, basestring):
                     raise AppstartAbort('"handlers" section of {!r} contains a '
-                                        'non-string static_dir.' % config_name)
-                print 'walking %s' % static_dir
-                for dirname, subdirs, files in os.walk(
-                    os.path.join(root_dir, static_dir)):
-                    for filename in files:
-                        file_dict[os.path.join(dirname, filename)] = None
+                                        'non-string static_dir.'.format(
+                                            config_name))
+                dirs.append(os.path.join(root_dir, static_dir))
+    return dirs
+
+
+def add_files_from_static_dirs(file_dict, config_name):
+    """Add all files from static directories specified in the config file.
+
+    Args:
+        file_dict: ({str: NoneType}) A dictionary who's keys are filenames.
+        config_name: (str) Name of the config file.
+
+    Raises:
+        AppstartAbort: An invalid field type was discovered.
+    """
+    for static_dir in static_dirs(config_name):
+        get_logger().debug('Adding static files from %s', os.path.relpath(
+            static_dir, os.path.dirname(config_name)))
+        for dirname, subdirs, files in os.walk(static_dir):
+            for filename in files:
+                file_dict[os.path.join(dirname, filename)] = None
+
+
+def spool_file(fileobj, max_size=None, chunk_size=BUILD_CHUNK_SIZE):
+    """Copy a file-like object to a seekable temporary file.
+
+    The copy is held in memory if it's small, and written to disk once it
+    grows beyond max_size. Either way, fileobj is only read chunk_size
+    bytes at a time.
+
+    Args:
+        fileobj: (file-like object) The file to copy. Only read(size) is
+            used, so it can be a stream (such as an HTTP response).
+        max_size: (int or None) The largest copy to keep in memory.
+            Defaults to SPOOL_MAX_SIZE.
+        chunk_size: (int) How many bytes to read at a time.
+
+    Returns:
+        (tempfile.SpooledTemporaryFile) The copy, positioned at its start.
+        It's deleted when it's closed (or garbage collected).
+    """
+    spooled = tempfile.SpooledTemporaryFile(
+        max_size=max_size or SPOOL_MAX_SIZE)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
 
 
 class TarWrapper(object):
     """A convenience wrapper around a tar archive.
 
-    Helps to list contents of directories and read contents of files.
+    Helps to list contents of directories and read contents of files. The
+    archive's members are indexed once, when the wrapper is created, so
+    lookups don't have to scan the archive.
     """
 
     def __init__(self, tar_file):
         """Initializer for TarWrapper."""
         self.tarfile = tar_file
 
+        # Members keyed by their path (without leading or trailing slashes),
+        # and the names of the members in each directory, keyed by the
+        # directory's path. Later members replace earlier ones with the same
+        # path, as in tarfile.TarFile.getmember. The root of the archive is
+        # the empty path.
+        self._members = {}
+        self._children = collections.defaultdict(collections.OrderedDict)
+        for tinfo in tar_file.getmembers():
+            path = tinfo.name.strip('/')
+            if not path:
+                continue
+            self._members[path] = tinfo
+            parent, name = posixpath.split(path)
+            self._children[parent][name] = None
+
+    def get_member(self, path):
+        """Get the TarInfo for a path in the archive.
+
+        Args:
+            path: (basestring) The path, relative to the root of the tar
+                archive.
+
+        Raises:
+            KeyError: If path cannot be found.
+
+        Returns:
+            (tarfile.TarInfo) The member.
+        """
+        return self._members[path.strip('/')]
+
+    def _get_dir(self, path):
+        """Get the normalized path of a directory in the archive."""
+        path = path.strip('/')
+        if path and not self.get_member(path).isdir():
+            raise ValueError('"{0}" is not a directory.'.format(path))
+        return path
+
+    def _list_dir(self, path):
+        files = []
+        dirs = []
+        for name in self._children.get(path, ()):
+            tinfo = self._members[posixpath.join(path, name)]
+            if tinfo.isfile():
+                files.append(name)
+            elif tinfo.isdir():
+                dirs.append(name)
+        return files, dirs
+
     def list(self, path):
         """Return the contents of dir_path as a list of file/directory names.
 
@@ -311,33 +633,35 @@ class TarWrapper(object):
             The first element of the tuple is a list of files and the second
             a list of directories.
         """
-        tinfo = self.tarfile.getmember(path.lstrip('/'))
-        if not tinfo.isdir():
-            raise ValueError('"{0}" is not a directory.'.format(path))
+        return self._list_dir(self._get_dir(path))
 
-        if not path.endswith('/'):
-            path += '/'
-
-        files = []
-        dirs = []
+    def walk(self, path):
+        """Walk the directory tree rooted at path, like os.walk.
 
-        # Find all files rooted at path.
-        names = [n for n in self.tarfile.getnames() if n.startswith(path)]
+        Directories are visited top-down, so callers can prune the walk by
+        removing names from the yielded list of directories.
 
-        # Calculate the number of components in the path.
-        path_len = len(path.strip(os.sep).split(os.sep))
+        Args:
+            path: (basestring) The path to the directory, relative to the
+                root of the tar archive.
 
-        for name in names:
-            # If the name is one component longer, it must be directly inside
-            # the directory specified by path (as opposed to being inside a
-            # hierarchy of subdirectories that begin at path).
-            if len(name.split(os.sep)) - path_len == 1:
-                if self.tarfile.getmember(name).isfile():
-                    files.append(os.path.basename(name))
-                elif self.tarfile.getmember(name).isdir():
-                    dirs.append(os.path.basename(name))
+        Raises:
+            ValueError: If path resolves to something other than a
+                directory.
+            KeyError: If path cannot be found.
 
-        return files, dirs
+        Yields:
+            (basestring, [basestring, ...], [basestring, ...]) The path of
+            each directory, and the names of the directories and files in
+            it.
+        """
+        pending = [self._get_dir(path)]
+        while pending:
+            dirpath = pending.pop()
+            files, dirs = self._list_dir(dirpath)
+            yield dirpath, dirs, files
+            pending.extend(posixpath.join(dirpath, name)
+                           for name in reversed(dirs))
 
     def get_file(self, path):
         """Return a file-like object from within the tar archive.
@@ -354,7 +678,7 @@ class TarWrapper(object):
         Returns:
             (basestring) The contents of the file.
         """
-        tinfo = self.tarfile.getmember(path)
+        tinfo = self.get_member(path)
         if not tinfo.isfile():
             raise ValueError('"{0}" is not a file.'.format(path))
         return self.tarfile.extractfile(tinfo)
@@ -60,10 +60,12 @@ import unittest
 import yaml
 
 from ..sandbox import container_sandbox
+from ..sandbox import scheduler
 from .. import utils
 
 import errors
 import color_logging
+import log_access
 
 ################################################################################
 # Error level descriptions                                                     #
@@ -356,6 +358,54 @@ class ContractTestResult(unittest.TextTestResult):
             self.stream.writeln(lvl=logging.DEBUG)
 
 
+class RecordingTestResult(unittest.TestResult):
+    """Record the outcome of a single clause, to be reported later.
+
+    Clauses that are evaluated in parallel report their outcomes to a
+    RecordingTestResult. Once all of them are done, the outcomes are replayed
+    into the ContractTestResult in the order of the contract, so the report
+    looks exactly as it would if the clauses had run one after another.
+    """
+
+    def __init__(self, success_set):
+        """Initializer for RecordingTestResult.
+
+        Args:
+            success_set: (set) A set of test classes that have succeeded thus
+                far. Successful tests are added right away, so that clauses
+                depending on them can run before the outcome is replayed.
+        """
+        super(RecordingTestResult, self).__init__()
+        self.__success_set = success_set
+        self.outcomes = []
+
+    def addSuccess(self, test):
+        self.__success_set.add(test.__class__)
+        self.outcomes.append(('addSuccess', ()))
+
+    def addError(self, test, err):
+        self.outcomes.append(('addError', (err,)))
+
+    def addFailure(self, test, err):
+        self.outcomes.append(('addFailure', (err,)))
+
+    def addSkip(self, test, reason):
+        self.outcomes.append(('addSkip', (reason,)))
+
+    def addExpectedFailure(self, test, err):
+        self.outcomes.append(('addExpectedFailure', (err,)))
+
+    def addUnexpectedSuccess(self, test):
+        self.outcomes.append(('addUnexpectedSuccess', ()))
+
+    def replay(self, test, result):
+        """Report the recorded outcomes of test to result."""
+        result.startTest(test)
+        for method, args in self.outcomes:
+            getattr(result, method)(test, *args)
+        result.stopTest(test)
+
+
 class ContractTestRunner(unittest.TextTestRunner):
     """Test runner for a single suite of runtime contract clauses.
 
@@ -363,7 +413,8 @@ class ContractTestRunner(unittest.TextTestRunner):
     ContractTestRunner corresponds to a single _TIMELINE point.
     """
 
-    def __init__(self, success_set, threshold, logfile, verbose_printing):
+    def __init__(self, success_set, threshold, logfile, verbose_printing,
+                 jobs=1):
         """Create a ContractTestRunner.
 
         Args:
@@ -376,9 +427,11 @@ class ContractTestRunner(unittest.TextTestRunner):
             logfile: (basestring) The logfile to append messages to.
             verbose_printing: (bool) Whether or not to create a verbose
                 LoggingStream (one that prints to console verbosely).
+            jobs: (int) The maximum number of clauses to evaluate at once.
         """
         super(ContractTestRunner, self).__init__()
         self.__threshold = threshold
+        self.__jobs = jobs
         self.stream = color_logging.LoggingStream(logfile, verbose_printing)
         self.__success_set = success_set
 
@@ -394,7 +447,7 @@ class ContractTestRunner(unittest.TextTestRunner):
                                   self.descriptions,
                                   self.verbosity)
 
-    def run(self, tests, point):
+    def run(self, tests, point, parallel=False):
         """Run the test suite.
 
         This should be called once per point in _TIMELINE. This function
@@ -405,6 +458,9 @@ class ContractTestRunner(unittest.TextTestRunner):
             tests: (unittest.TestSuite) a suite of ContractClauses,
                 corresponding to a point in _TIMELINE.
             point: (basestring) the name of the point in _TIMELINE.
+            parallel: (bool) Whether or not clauses that don't depend on
+                each other may be evaluated concurrently (using up to
+                self.jobs threads).
 
         Returns:
             (ContractTestResult) The result of the tests.
@@ -420,7 +476,10 @@ class ContractTestRunner(unittest.TextTestRunner):
         if start_test_run is not None:
             start_test_run()
         try:
-            tests(result)
+            if parallel and self.__jobs > 1:
+                self._run_parallel(list(tests), result)
+            else:
+                tests(result)
         finally:
             stop_test_run = getattr(result, 'stopTestRun', None)
             if stop_test_run is not None:
@@ -454,6 +513,35 @@ class ContractTestRunner(unittest.TextTestRunner):
         self.stream.writeln('=' * 100)
         return result
 
+    def _run_parallel(self, clauses, result):
+        """Evaluate clauses concurrently, respecting their dependencies.
+
+        A clause is evaluated once all the clauses in its dependencies and
+        before sets (that belong to the same lifecycle point) have been
+        evaluated. Outcomes are reported to result in the order of clauses.
+
+        Args:
+            clauses: ([ContractClause, ...]) The clauses to evaluate, in
+                contract order.
+            result: (ContractTestResult) The result to report outcomes to.
+        """
+        sched = scheduler.StartupScheduler(max_workers=self.__jobs)
+        recordings = []
+        names = {clause.__class__: clause.__class__.__name__
+                 for clause in clauses}
+        for clause in clauses:
+            recording = RecordingTestResult(self.__success_set)
+            recordings.append(recording)
+            deps = [names[c] for c in clause.dependencies | clause.before
+                    if c in names]
+            sched.add(names[clause.__class__],
+                      lambda c=clause, r=recording: c(r),
+                      deps=deps)
+        sched.run()
+
+        for clause, recording in zip(clauses, recordings):
+            recording.replay(clause, result)
+
 
 class ContractClause(unittest.TestCase):
     """A single clause of the contract.
@@ -579,18 +667,22 @@ class ContractClause(unittest.TestCase):
                 # Tag the clause with its own name.
                 cls.tags.add(name)
 
-    def __init__(self, sandbox):
+    def __init__(self, sandbox, options=None):
         """Initializer for ContractClause.
 
         Args:
             sandbox: (sandbox.container_sandbox.ContainerSandbox)
                 A sandbox that manages the container to be tested.
+            options: (dict or None) Options that tune how clauses are
+                evaluated, shared by all clauses of a validator (see
+                ContractValidator.validate).
         """
 
         # Register the function 'run_test' to be executed as the
         # test driver.
         super(ContractClause, self).__init__('run_test')
         self.__sandbox = sandbox
+        self.options = options if options is not None else {}
 
     def shortDescription(self):
         """Return a short description of the clause."""
@@ -626,6 +718,9 @@ class ContractValidator(object):
         self.sandbox = container_sandbox.ContainerSandbox(
             **sandbox_kwargs)
 
+        # Options shared by all clauses. Set by validate().
+        self.options = {}
+
         # Set of clauses that have been added to the contract.
         self.__added_clauses = set()
 
@@ -826,7 +921,7 @@ class ContractValidator(object):
         recursion_stack.pop()
 
         # Construct an actual instance of this clause with the sandbox.
-        clause = clause_class(self.sandbox)
+        clause = clause_class(self.sandbox, self.options)
 
         # Add the clause to the appropriate list. Note that the list may not yet
         # exist.
@@ -1052,7 +1147,9 @@ class ContractValidator(object):
                  tags=None,
                  threshold='WARNING',
                  logfile=None,
-                 verbose=False):
+                 verbose=False,
+                 jobs=1,
+                 log_sample=0):
         """Evaluate all clauses.
 
         Args:
@@ -1069,11 +1166,19 @@ class ContractValidator(object):
                 some non-essential information is ommitted from the output
                 printed to stdout. Note that ALL information is logged to
                 the logfile, if one is specified.
+            jobs: (int) The maximum number of clauses to evaluate at once.
+                Clauses are only evaluated concurrently if they belong to
+                the same lifecycle point and don't depend on each other.
+                Results are reported in the same order either way.
+            log_sample: (int) If nonzero, large log files are checked by
+                sampling this many of their lines, rather than reading
+                them in full.
 
         Returns:
             (bool) True if validation was successful. False otherwise.
         """
         self._tags.update(tags or set())
+        self.options['log_sample'] = log_sample
 
         # The threshold comes in as a string. Convert it to a numerical value.
         threshold = LEVEL_NAMES_TO_NUMBERS[threshold]
@@ -1081,16 +1186,24 @@ class ContractValidator(object):
         test_runner = ContractTestRunner(self.__success_set,
                                          threshold=threshold,
                                          logfile=logfile,
-                                         verbose_printing=verbose)
+                                         verbose_printing=verbose,
+                                         jobs=jobs)
         validation_passed = True
         try:
             self.sandbox.start()
             for point in _TIMELINE:
                 if point not in self.contract: continue
+
+                # Clauses share a snapshot of the application's logs, which
+                # must be retaken at each lifecycle point.
+                log_access.invalidate_snapshots()
                 suite = unittest.TestSuite(self.contract.get(point))
-                res = test_runner.run(suite, _TIMELINE_NUMBERS_TO_NAMES[point])
+                res = test_runner.run(suite,
+                                      _TIMELINE_NUMBERS_TO_NAMES[point],
+                                      parallel=point not in _SINGULAR_POINTS)
                 validation_passed = validation_passed and res.success
         finally:
+            log_access.invalidate_snapshots()
             self.sandbox.stop()
 
         return validation_passed
@@ -0,0 +1,507 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared access to the logs that the application container writes.
+
+Several clauses of the runtime contract inspect the application's log
+directory. Rather than having each of them copy files out of the container,
+the directory is copied once per lifecycle point, and every clause reads
+from that snapshot.
+
+The sandbox bind-mounts the log directory to a directory on the docker host.
+If the docker daemon runs on this machine, that directory is read directly
+(with mmap), and nothing has to be copied at all.
+"""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import collections
+import errno
+import mmap
+import os
+import posixpath
+import random
+import threading
+
+from .. import utils
+
+
+# Absolute path to directory where the application is expected to write logs.
+LOG_DIR = '/var/log/app_engine'
+
+# Hostnames under which the docker daemon is reachable iff it runs locally
+# (see Container.host).
+LOCAL_HOSTS = ('localhost', '127.0.0.1')
+
+# How many bytes of a log file to read at a time.
+CHUNK_SIZE = 1024 * 1024
+
+
+class LogSnapshot(object):
+    """A copy of a directory in a container, taken at a single moment.
+
+    Paths are absolute paths within the container. Paths outside of the
+    snapshotted directory, or paths that didn't exist when the snapshot was
+    taken, raise IOError, just like Container.iter_tar does.
+    """
+
+    def __init__(self, log_dir, members):
+        """Initializer for LogSnapshot.
+
+        The archive is read once, in order, and each file is copied as it
+        goes by (see utils.spool_file), so the archive as a whole is never
+        held anywhere.
+
+        Args:
+            log_dir: (basestring) The absolute path of the directory that
+                the snapshot was taken of.
+            members: (iterable or None) The members of an archive of the
+                directory, as yielded by Container.iter_tar. None if the
+                directory didn't exist.
+        """
+        self.log_dir = log_dir
+
+        # Members keyed by their path in the archive, as (TarInfo, copy of
+        # the contents or None), and the names of the members in each
+        # directory. None if there's no archive.
+        self._members = None
+        self._children = collections.defaultdict(collections.OrderedDict)
+        if members is not None:
+            self._members = {}
+            for tinfo, contents in members:
+                path = tinfo.name.strip('/')
+                if not path:
+                    continue
+                self._members[path] = (
+                    tinfo, utils.spool_file(contents) if contents else None)
+                parent, name = posixpath.split(path)
+                self._children[parent][name] = None
+
+        # The copies are shared by every reader, so reads are serialized.
+        self._lock = threading.Lock()
+
+    def _member_name(self, path):
+        """Translate an absolute path to its name within the archive."""
+        relpath = os.path.relpath(path, self.log_dir)
+        if relpath.startswith(os.pardir):
+            raise IOError('{0} is not in {1}'.format(path, self.log_dir))
+        root = os.path.basename(self.log_dir)
+        return root if relpath == os.curdir else os.path.join(root, relpath)
+
+    def _get_member(self, path):
+        if self._members is None:
+            raise IOError('{0} could not be found.'.format(self.log_dir))
+        name = self._member_name(path)
+        try:
+            return name, self._members[name]
+        except KeyError:
+            raise IOError('File could not be found at {0}.'.format(path))
+
+    def exists(self, path):
+        """Check whether path existed when the snapshot was taken."""
+        try:
+            self._get_member(path)
+        except IOError:
+            return False
+        return True
+
+    def get_file(self, path):
+        """Get the contents of a file in the snapshot.
+
+        Args:
+            path: (basestring) The absolute path to the file.
+
+        Raises:
+            IOError: If the file isn't in the snapshot.
+            ValueError: If path resolves to something other than a file.
+
+        Returns:
+            (SharedFileReader) The file's contents. Each call returns an
+            independent (seekable) reader of the copy that was made when
+            the snapshot was taken.
+        """
+        name, (_, contents) = self._get_member(path)
+        if contents is None:
+            raise ValueError('"{0}" is not a file.'.format(name))
+        return SharedFileReader(contents, self._lock)
+
+    def list(self, path):
+        """List a directory in the snapshot.
+
+        Args:
+            path: (basestring) The absolute path to the directory.
+
+        Raises:
+            IOError: If the directory isn't in the snapshot.
+            ValueError: If path resolves to something other than a
+                directory.
+
+        Returns:
+            ([basestring, ...], [basestring, ...]) The names of the files
+            and directories in the directory, as from utils.TarWrapper.list.
+        """
+        name, (tinfo, _) = self._get_member(path)
+        if not tinfo.isdir():
+            raise ValueError('"{0}" is not a directory.'.format(name))
+        files = []
+        dirs = []
+        for child in self._children.get(name, ()):
+            child_info, _ = self._members[posixpath.join(name, child)]
+            if child_info.isfile():
+                files.append(child)
+            elif child_info.isdir():
+                dirs.append(child)
+        return files, dirs
+
+
+class SharedFileReader(object):
+    """A reader of a file that other readers share.
+
+    Each reader has its own offset, and seeks the shared file to it under
+    the lock before every access, so readers don't disturb each other.
+    Supports the same subset of the file interface as MappedFile.
+    """
+
+    def __init__(self, shared, lock):
+        """Initializer for SharedFileReader.
+
+        Args:
+            shared: (file-like object) The seekable file to read.
+            lock: (threading.Lock) The lock that serializes access to
+                shared.
+        """
+        self._shared = shared
+        self._lock = lock
+        self._offset = 0
+
+    def read(self, size=-1):
+        with self._lock:
+            self._shared.seek(self._offset)
+            data = self._shared.read(size)
+            self._offset = self._shared.tell()
+        return data
+
+    def readline(self):
+        with self._lock:
+            self._shared.seek(self._offset)
+            line = self._shared.readline()
+            self._offset = self._shared.tell()
+        return line
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._offset = offset
+        elif whence == os.SEEK_CUR:
+            self._offset += offset
+        else:
+            with self._lock:
+                self._shared.seek(offset, whence)
+                self._offset = self._shared.tell()
+
+    def tell(self):
+        return self._offset
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        # The shared file belongs to the snapshot.
+        pass
+
+
+class MappedFile(object):
+    """A read-only, memory-mapped file.
+
+    Supports the subset of the file interface that the log checks use.
+    Pages are only read from disk as they're accessed, so even large logs
+    don't need to be read into memory.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+
+            # Empty files can't be mapped.
+            self._map = (mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                         if size else None)
+
+    def read(self, size=-1):
+        if self._map is None:
+            return ''
+        if size < 0:
+            size = len(self._map) - self._map.tell()
+        return self._map.read(size)
+
+    def readline(self):
+        return self._map.readline() if self._map is not None else ''
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self._map is not None:
+            self._map.seek(offset, whence)
+
+    def tell(self):
+        return self._map.tell() if self._map is not None else 0
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class HostLogSnapshot(object):
+    """Reads a container's log directory from its bind mount on the host.
+
+    Unlike LogSnapshot, this is a live view of the directory. It has the
+    same interface, so clauses don't need to know which one they get.
+    """
+
+    def __init__(self, log_dir, host_dir, fallback):
+        """Initializer for HostLogSnapshot.
+
+        Args:
+            log_dir: (basestring) The absolute path of the log directory
+                inside the container.
+            host_dir: (basestring) The directory on the host that log_dir
+                is bound to.
+            fallback: (callable) Returns a LogSnapshot of the directory.
+                Used for files that the current user isn't allowed to read
+                (containers often write their logs as root).
+        """
+        self.log_dir = log_dir
+        self.host_dir = host_dir
+        self._fallback = fallback
+
+    def _host_path(self, path):
+        relpath = os.path.relpath(path, self.log_dir)
+        if relpath.startswith(os.pardir):
+            raise IOError('{0} is not in {1}'.format(path, self.log_dir))
+        return os.path.normpath(os.path.join(self.host_dir, relpath))
+
+    def exists(self, path):
+        try:
+            return os.path.exists(self._host_path(path))
+        except IOError:
+            return False
+
+    def get_file(self, path):
+        host_path = self._host_path(path)
+        if os.path.isdir(host_path):
+            raise ValueError('"{0}" is not a file.'.format(path))
+        try:
+            return MappedFile(host_path)
+        except (IOError, OSError) as err:
+            if err.errno == errno.EACCES:
+                return self._fallback().get_file(path)
+            raise IOError('File could not be found at {0}.'.format(path))
+
+    def list(self, path):
+        host_path = self._host_path(path)
+        try:
+            names = os.listdir(host_path)
+        except OSError as err:
+            if err.errno == errno.EACCES:
+                return self._fallback().list(path)
+            if err.errno == errno.ENOTDIR:
+                raise ValueError('"{0}" is not a directory.'.format(path))
+            raise IOError('File could not be found at {0}.'.format(path))
+
+        files = []
+        dirs = []
+        for name in names:
+            full_path = os.path.join(host_path, name)
+            if os.path.isdir(full_path):
+                dirs.append(name)
+            elif os.path.isfile(full_path):
+                files.append(name)
+        return files, dirs
+
+
+def iter_line_batches(logfile, chunk_size=None):
+    """Read a file in chunks, and split the chunks into lines.
+
+    Only one chunk (plus the line straddling its end) is held in memory at
+    a time, so arbitrarily large files can be read.
+
+    Args:
+        logfile: (file-like object) The file to read. Only read(size) is
+            used.
+        chunk_size: (int or None) How many bytes to read at a time.
+            Defaults to CHUNK_SIZE.
+
+    Yields:
+        ([basestring, ...]) Batches of consecutive lines, without their
+        line endings.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    partial = ''
+    while True:
+        chunk = logfile.read(chunk_size)
+        if not chunk:
+            break
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
+
+
+def file_size(logfile):
+    """Get the size of a seekable file-like object, in bytes."""
+    position = logfile.tell()
+    logfile.seek(0, os.SEEK_END)
+    size = logfile.tell()
+    logfile.seek(position)
+    return size
+
+
+def sample_lines(logfile, sample_size, rng=random):
+    """Read randomly chosen lines from a file, without reading all of it.
+
+    Random byte offsets are drawn, and the line following each offset (or
+    the first line, for offset 0) is read. Lines are therefore picked with a
+    probability proportional to the length of the line preceding them,
+    which is close enough to uniform for log files, whose lines are of
+    similar length. The same line may be picked more than once.
+
+    Args:
+        logfile: (file-like object) The file to read. Must support seek(),
+            tell() and readline().
+        sample_size: (int) How many offsets to draw.
+        rng: (random.Random) The source of randomness.
+
+    Returns:
+        ([basestring, ...]) The sampled lines, without their line endings,
+        in the order they appear in the file. There may be fewer than
+        sample_size of them, because offsets within the last line of the
+        file don't yield a line.
+    """
+    size = file_size(logfile)
+    if not size:
+        return []
+    lines = []
+    for offset in sorted(rng.randrange(size) for _ in xrange(sample_size)):
+        if offset:
+            # Skip the rest of the line that offset - 1 falls in, so that an
+            # offset at the start of a line picks that line.
+            logfile.seek(offset - 1)
+            logfile.readline()
+        else:
+            logfile.seek(0)
+        line = logfile.readline()
+        if line:
+            lines.append(line.rstrip('\n'))
+    return lines
+
+
+class LogSnapshotCache(object):
+    """Hands out one LogSnapshot per container and lifecycle point."""
+
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self._key = None
+        self._snapshot = None
+
+    def get(self, app_container, lifecycle_point):
+        """Get a snapshot of the container's logs for a lifecycle point.
+
+        The first call for a given container and lifecycle point copies the
+        log directory out of the container. Later calls (including
+        concurrent ones) get the same snapshot. If the log directory is
+        bind-mounted to a directory on this machine, that directory is
+        read instead (and only files that can't be read from there are
+        copied).
+
+        Args:
+            app_container: (container.Container) The container whose logs
+                to get.
+            lifecycle_point: (int) The lifecycle point being evaluated.
+
+        Returns:
+            (LogSnapshot) The snapshot.
+        """
+        key = (app_container.get_id(), lifecycle_point)
+        with self._lock:
+            if self._key != key:
+                self._snapshot = self._make_snapshot(app_container)
+                self._key = key
+            return self._snapshot
+
+    def _make_snapshot(self, app_container):
+        copy_lock = threading.Lock()
+        copies = []
+
+        def copy_snapshot():
+            with copy_lock:
+                if not copies:
+                    try:
+                        snapshot = LogSnapshot(
+                            self.log_dir,
+                            app_container.iter_tar(self.log_dir))
+                    except IOError:
+                        snapshot = LogSnapshot(self.log_dir, None)
+                    copies.append(snapshot)
+                return copies[0]
+
+        host_dir = self._host_log_dir(app_container)
+        if host_dir:
+            return HostLogSnapshot(self.log_dir, host_dir, copy_snapshot)
+        return copy_snapshot()
+
+    @staticmethod
+    def _host_log_dir(app_container):
+        """Get the host directory bound to the log directory, if readable.
+
+        Returns:
+            (basestring or None) The directory, or None if the docker daemon
+            is remote, or the directory can't be read.
+        """
+        host_dir = getattr(app_container, 'log_path', None)
+        if (host_dir and app_container.host in LOCAL_HOSTS and
+            os.path.isdir(host_dir) and
+            os.access(host_dir, os.R_OK | os.X_OK)):
+            return host_dir
+        return None
+
+    def invalidate(self):
+        """Forget the current snapshot, so that the next get() copies anew."""
+        with self._lock:
+            self._key = None
+            self._snapshot = None
+
+
+_snapshots = LogSnapshotCache()
+
+
+def get_snapshot(app_container, lifecycle_point):
+    """Get the shared snapshot of app_container's logs. See LogSnapshotCache."""
+    return _snapshots.get(app_container, lifecycle_point)
+
+
+def invalidate_snapshots():
+    """Forget the shared snapshot."""
+    _snapshots.invalidate()
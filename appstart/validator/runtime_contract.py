@@ -6,12 +6,17 @@
 # see: https://www.python.org/dev/peps/pep-0008/.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import collections
 import json
+import math
 import os
 import re
 import requests
 
+from .. import utils
+
 import contract
+import log_access
 
 
 # Fields that diagnostic log entries are required to have.
@@ -21,7 +26,7 @@ _DIAGNOSTIC_FIELDS = ['timestamp', 'severity', 'thread', 'message']
 _TIMESTAMP_FIELDS = ['seconds', 'nanos']
 
 # Absolute path to directory where the application is expected to write logs.
-_LOG_LOCATION = '/var/log/app_engine'
+_LOG_LOCATION = log_access.LOG_DIR
 
 # Diagnostic log location
 _DLOG_LOCATION = os.path.join(_LOG_LOCATION, 'app.log.json')
@@ -32,10 +37,238 @@ _ALOG_LOCATION = os.path.join(_LOG_LOCATION, 'request.log')
 # Custom log directory
 _CLOG_LOCATION = os.path.join(_LOG_LOCATION, 'custom_logs')
 
+# Number of offending lines to show when a log file is improperly formatted.
+_MAX_OFFENDERS = 5
+
+# Offending lines are truncated to this many characters in reports.
+_MAX_OFFENDER_LENGTH = 200
+
+# The fields that lines in the Common Log Format start with: host, ident,
+# user, [time], "request", status and size. Every pattern below is applied
+# with re.M to many lines at once, so none of them may match a newline.
+_CLF_FIELDS = r'^\S* \S* \S* \[[^]\n]*\] "[^"\n]*" \S* \S*'
+
+# Lines that start with the Common Log Format's fields. Some servers append
+# fields of their own (e.g. the time taken), which is allowed.
+_CLF_PREFIX_RE = re.compile(_CLF_FIELDS, re.M)
+
+# Names of the access log formats, and patterns for the complete lines in
+# them. Lines that start like the Common Log Format, but aren't in any of
+# these formats, count as _CLF_EXTRA_FORMAT.
+_ACCESS_LOG_FORMATS = [
+    ('Common', re.compile(_CLF_FIELDS + '$', re.M)),
+    ('Combined', re.compile(_CLF_FIELDS + r' "[^"\n]*" "[^"\n]*"$', re.M)),
+]
+_CLF_EXTRA_FORMAT = 'Common with extra fields'
+
+# Lines in the W3C Extended Log File Format. Their fields are declared by a
+# "#Fields:" directive.
+_W3C_FORMAT = 'Extended'
+_W3C_FIELDS_DIRECTIVE = '#Fields:'
+_W3C_TOKEN_RE = re.compile(r'"(?:[^"]|"")*"|\S+')
+
 # Permissible status codes for a container to return from _ah/start
 _STATUS_CODES = [200, 202, 404, 503]
 
 
+class LogStats(object):
+    """Aggregate statistics about a log file."""
+
+    def __init__(self, max_offenders=_MAX_OFFENDERS):
+        self.lines = 0
+        self.bad_lines = 0
+
+        # [(line_number, reason, line), ...] for the first bad lines.
+        self.offenders = []
+        self.max_offenders = max_offenders
+
+    def add_bad_line(self, line, reason):
+        self.bad_lines += 1
+        if len(self.offenders) < self.max_offenders:
+            self.offenders.append(
+                (self.lines, reason, line[:_MAX_OFFENDER_LENGTH]))
+
+    def summary(self):
+        """Describe the statistics in a human readable way."""
+        return '\n'.join(self._summary_lines())
+
+    def _summary_lines(self):
+        lines = ['{0} of {1} lines improperly formatted.'.format(
+            self.bad_lines, self.lines)]
+        for line_number, reason, line in self.offenders:
+            lines.append('  line {0}: {1}: "{2}"'.format(line_number, reason,
+                                                         line))
+        if self.bad_lines > len(self.offenders):
+            lines.append('  ... and {0} more'.format(
+                self.bad_lines - len(self.offenders)))
+        return lines
+
+
+class JsonLogStats(LogStats):
+    """Aggregate statistics about a json log file."""
+
+    def __init__(self, max_offenders=_MAX_OFFENDERS):
+        super(JsonLogStats, self).__init__(max_offenders)
+
+        # Number of entries of each severity.
+        self.severities = collections.Counter()
+
+    def _summary_lines(self):
+        lines = super(JsonLogStats, self)._summary_lines()
+        if self.severities:
+            lines.append('Severities: {0}'.format(', '.join(
+                '{0}={1}'.format(severity, count) for severity, count
+                in sorted(self.severities.iteritems()))))
+        return lines
+
+
+class AccessLogStats(LogStats):
+    """Aggregate statistics about an access log file."""
+
+    def __init__(self, max_offenders=_MAX_OFFENDERS):
+        super(AccessLogStats, self).__init__(max_offenders)
+
+        # Number of lines in each of the _ACCESS_LOG_FORMATS.
+        self.formats = collections.Counter()
+
+        # Number of W3C directives (which aren't counted as lines).
+        self.directives = 0
+
+        # Whether the lines are a random sample of the file, rather than
+        # all of it.
+        self.sampled = False
+
+    def match_rates(self):
+        """Get the fraction of lines that are in each format.
+
+        Returns:
+            ([(basestring, float), ...]) The formats that lines were found
+            in, and the fraction of lines in them, most common first.
+        """
+        return [(name, float(count) / self.lines)
+                for name, count in sorted(self.formats.iteritems(),
+                                          key=lambda (n, c): (-c, n))]
+
+    def _summary_lines(self):
+        lines = super(AccessLogStats, self)._summary_lines()
+        if self.sampled:
+            lines[0] = '{0} of {1} sampled lines improperly formatted.'.format(
+                self.bad_lines, self.lines)
+        if self.formats:
+            lines.append('Formats: {0}'.format(', '.join(
+                '{0}={1:.1%}'.format(name, rate)
+                for name, rate in self.match_rates())))
+        if self.sampled and self.lines:
+            # The worst case (p = 0.5) margin of error, at 95% confidence.
+            lines.append('Rates are estimated from a random sample, to '
+                         'within {0:.1%}.'.format(
+                             1.96 * 0.5 / math.sqrt(self.lines)))
+        return lines
+
+
+def _check_json_line(line):
+    """Check one line of a json log.
+
+    Args:
+        line: (basestring) The line, without its line ending.
+
+    Returns:
+        (basestring, basestring) The entry's severity and None if the line
+        is correctly formatted. Otherwise None and the reason why not.
+    """
+    # Most malformed lines are missing a field altogether. Spotting those
+    # doesn't require parsing the line. Lines that have every field are
+    # parsed in full: whether they're valid json can't be told otherwise,
+    # and json's C decoder is faster than validating them with a regex.
+    for field in _DIAGNOSTIC_FIELDS:
+        if '"{0}"'.format(field) not in line:
+            return None, 'Log message missing "{0}" field'.format(field)
+
+    try:
+        logmsg = json.loads(line)
+    except ValueError:
+        return None, 'Improperly formatted line'
+    if not isinstance(logmsg, dict):
+        return None, 'Log message is not a json object'
+
+    for field in _DIAGNOSTIC_FIELDS:
+        if field not in logmsg:
+            return None, 'Log message missing "{0}" field'.format(field)
+
+    ts = logmsg['timestamp']
+    if not isinstance(ts, dict) or set(ts) != set(_TIMESTAMP_FIELDS):
+        return None, 'Timestamps must have fields: "{0}"'.format(
+            _TIMESTAMP_FIELDS)
+    severity = logmsg['severity']
+    if not isinstance(severity, basestring):
+        severity = repr(severity)
+    return severity, None
+
+
+class AccessLogMatcher(object):
+    """Sorts the lines of an access log into formats, many at a time.
+
+    Lines are matched in batches: the patterns are applied to a whole batch
+    at once, and only batches that contain bad lines or W3C lines are
+    matched line by line.
+    """
+
+    def __init__(self, stats):
+        """Initializer for AccessLogMatcher.
+
+        Args:
+            stats: (AccessLogStats) The statistics to add the lines to.
+        """
+        self.stats = stats
+
+        # The fields declared by the latest W3C "#Fields:" directive.
+        self.w3c_fields = None
+
+    def add_lines(self, lines):
+        """Match consecutive lines of the log.
+
+        Args:
+            lines: ([basestring, ...]) The lines, without line endings.
+        """
+        buf = '\n'.join(lines)
+        if (self.w3c_fields is None and
+            not buf.startswith('#') and '\n#' not in buf and
+            len(_CLF_PREFIX_RE.findall(buf)) == len(lines)):
+            self._count_clf_lines(buf, len(lines))
+            self.stats.lines += len(lines)
+        else:
+            for line in lines:
+                self.add_line(line)
+
+    def _count_clf_lines(self, buf, count):
+        """Count the formats of lines that all start like the CLF."""
+        for name, pattern in _ACCESS_LOG_FORMATS:
+            matches = len(pattern.findall(buf))
+            if matches:
+                self.stats.formats[name] += matches
+                count -= matches
+        if count:
+            self.stats.formats[_CLF_EXTRA_FORMAT] += count
+
+    def add_line(self, line):
+        """Match a single line of the log."""
+        if line.startswith('#'):
+            self.stats.directives += 1
+            if line.startswith(_W3C_FIELDS_DIRECTIVE):
+                self.w3c_fields = line[len(_W3C_FIELDS_DIRECTIVE):].split()
+            return
+
+        self.stats.lines += 1
+        if (self.w3c_fields and
+            len(_W3C_TOKEN_RE.findall(line)) == len(self.w3c_fields)):
+            self.stats.formats[_W3C_FORMAT] += 1
+        elif _CLF_PREFIX_RE.match(line):
+            self._count_clf_lines(line, 1)
+        else:
+            self.stats.add_bad_line(
+                line, 'Line is not in Common, Combined or Extended format')
+
+
 class LogFormatChecker(object):
     """Class to give clauses the ability to check the format of logs.
 
@@ -50,62 +283,80 @@ class LogFormatChecker(object):
           - thread
           - message
 
-    For access logs, it seems that they're supposed to be
-    in Common Log or Extended format. It's not immediately clear if or how
-    this is enforced.
+    Access logs must be in the Common Log Format (or the Combined Log
+    Format, or another format that adds fields to the end of it) or in the
+    W3C Extended Log File Format.
     """
 
     def check_json_log_format(self, logfile):
         """Check if a log file conforms to the proper json format.
 
+        The file is read in chunks, so its size doesn't matter. Every line
+        is checked, and the check fails with a summary of all the bad lines
+        (if there are any).
+
         Args:
             logfile: (file-like object) The log file to be checked.
+
+        Returns:
+            (JsonLogStats) Statistics about the log file.
         """
-        for line in logfile:
-            if line:
-                try:
-                    logmsg = json.loads(line)
-                except ValueError:
-                    self.fail('Improperly formatted line: "{0}"'.format(line))
-
-                for field in _DIAGNOSTIC_FIELDS:
-                    self.assertIn(
-                        field,
-                        logmsg,
-                        'Log message missing "{0}" field: {1}'.format(field,
-                                                                      line))
-
-                ts = logmsg['timestamp']
-                if not isinstance(ts, dict) or ts.keys() != _TIMESTAMP_FIELDS:
-                    self.fail('{0}\nTimestamps must have fields: '
-                              '"{1}"'.format(line, _TIMESTAMP_FIELDS))
-
-    def check_access_log_format(self, logfile):
+        stats = JsonLogStats()
+        for batch in log_access.iter_line_batches(logfile):
+            for line in batch:
+                stats.lines += 1
+                severity, reason = _check_json_line(line)
+                if reason:
+                    stats.add_bad_line(line, reason)
+                else:
+                    stats.severities[severity] += 1
+
+        if stats.bad_lines:
+            self.fail(stats.summary())
+        utils.get_logger().debug(stats.summary())
+        return stats
+
+    def check_access_log_format(self, logfile, sample_size=0):
         """Check if a log file conforms to the Common Log or Extended formats.
 
-        (Currently not implemented)
+        Lines may be in the Common Log Format (optionally followed by more
+        fields, as in the Combined Log Format), or in the W3C Extended Log
+        File Format. The check fails with a summary of the bad lines (if
+        there are any) and of how many lines are in each format.
 
         Args:
             logfile: (file-like object) The log file to be checked.
-        """
+            sample_size: (int) If nonzero, and the file is larger than
+                log_access.CHUNK_SIZE, only this many randomly chosen lines
+                are checked (see log_access.sample_lines). The file must
+                be seekable in that case.
 
-        # TODO(gouzenko): *ACTUALLY* figure out how to do this in the best way
-        common_log_format = re.compile(r'(\S*) '
-                                       r'(\S*) '
-                                       r'(\S*) '
-                                       r'\[([^]]*)\] '
-                                       r'"([^"]*)" '
-                                       r'(\S*) '
-                                       r'(\S*)')
-        full_line = False
-        for line in logfile:
-            if line:
-                full_line = True
-                match = common_log_format.match(line)
-                if not match:
-                    self.fail('Improperly formatted line:"{0}"'.format(line))
-        if not full_line:
+        Returns:
+            (AccessLogStats) Statistics about the log file.
+        """
+        stats = AccessLogStats()
+        matcher = AccessLogMatcher(stats)
+        if sample_size and log_access.file_size(logfile) > log_access.CHUNK_SIZE:
+            stats.sampled = True
+
+            # W3C directives at the top of the file apply to all of it.
+            header = []
+            line = logfile.readline()
+            while line.startswith('#'):
+                header.append(line.rstrip('\n'))
+                line = logfile.readline()
+            matcher.add_lines(header)
+            matcher.add_lines(log_access.sample_lines(logfile, sample_size))
+        else:
+            for batch in log_access.iter_line_batches(logfile):
+                matcher.add_lines(batch)
+
+        if not stats.lines:
             self.fail('No access logs found in log file.')
+        if stats.bad_lines:
+            self.fail(stats.summary())
+        utils.get_logger().debug(stats.summary())
+        return stats
 
 
 class HealthChecksEnabledClause(contract.ContractClause):
@@ -155,9 +406,8 @@ class AccessLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_ALOG_LOCATION)
-        except IOError:
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        if not logs.exists(_ALOG_LOCATION):
             self.fail('No log file found at {0}'.format(_ALOG_LOCATION))
 
 
@@ -178,9 +428,9 @@ class AccessLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        logfile_tar = app_container.extract_tar(_ALOG_LOCATION)
-        logfile = logfile_tar.get_file(os.path.basename(_ALOG_LOCATION))
-        self.check_access_log_format(logfile)
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        self.check_access_log_format(logs.get_file(_ALOG_LOCATION),
+                                     self.options.get('log_sample', 0))
 
 
 class CustomLogLocationClause(contract.ContractClause):
@@ -196,9 +446,8 @@ class CustomLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_CLOG_LOCATION)
-        except IOError:
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        if not logs.exists(_CLOG_LOCATION):
             self.fail('Custom logs directory not found at '
                       '{0}'.format(_CLOG_LOCATION))
 
@@ -216,14 +465,12 @@ class CustomLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        custom_logs_tar = app_container.extract_tar(_CLOG_LOCATION)
-        custom_logs_root = os.path.basename(_CLOG_LOCATION)
-        files, dirs = custom_logs_tar.list(custom_logs_root)
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        files, dirs = logs.list(_CLOG_LOCATION)
 
         for f in files:
             if f.endswith('.log.json'):
-                logfile = custom_logs_tar.get_file(
-                    os.path.join(custom_logs_root, f))
+                logfile = logs.get_file(os.path.join(_CLOG_LOCATION, f))
                 self.check_json_log_format(logfile)
 
             elif not f.endswith('.log'):
@@ -251,9 +498,8 @@ class DiagnosticLogLocationClause(contract.ContractClause):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        try:
-            _ = app_container.extract_tar(_DLOG_LOCATION)
-        except (ValueError, IOError):
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        if not logs.exists(_DLOG_LOCATION):
             self.fail('Could not find log file at {0}'.format(_DLOG_LOCATION))
 
 
@@ -268,9 +514,8 @@ class DiagnosticLogFormatClause(contract.ContractClause, LogFormatChecker):
     tags = {'logging'}
 
     def evaluate_clause(self, app_container):
-        logfile_tar = app_container.extract_tar(_DLOG_LOCATION)
-        logfile = logfile_tar.get_file(os.path.basename(_DLOG_LOCATION))
-        self.check_json_log_format(logfile)
+        logs = log_access.get_snapshot(app_container, self.lifecycle_point)
+        self.check_json_log_format(logs.get_file(_DLOG_LOCATION))
 
 
 class HostnameClause(contract.ContractClause):
@@ -19,8 +19,11 @@ This class is used for unit testing ContainerSandbox.
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation
 
+import io
 import requests
+import shutil
 import stubout
+import tempfile
 import unittest
 import uuid
 
@@ -28,6 +31,7 @@ import docker
 
 from appstart import constants
 from appstart import utils
+from appstart.sandbox import image_cache
 
 DEFAULT_IMAGES = [constants.DEVAPPSERVER_IMAGE,
                   constants.PINGER_IMAGE]
@@ -35,12 +39,28 @@ images = list(DEFAULT_IMAGES)
 containers = []
 removed_containers = []
 
+# Output and exit code of commands run through exec_start.
+exec_output = []
+exec_exit_code = 0
+
+# Tar archives (as strings) returned by copy, keyed by the copied path.
+archives = {}
+
+# Lines of output of each container, keyed by container id. Each line is a
+# (timestamp, line) tuple.
+container_logs = {}
+
 
 def reset():
-    global containers, images, removed_containers
+    global containers, images, removed_containers, exec_output, exec_exit_code
+    global archives, container_logs
     containers = []
     images = list(DEFAULT_IMAGES)
     removed_containers = []
+    exec_output = []
+    exec_exit_code = 0
+    archives = {}
+    container_logs = {}
 
 
 # Fake build results, mimicking those that appear from docker.Client.build
@@ -99,6 +119,11 @@ class FakeDockerClient(object):
         if 'nocache' not in kwargs:
             raise KeyError('appstart must specify nocache in builds.')
 
+        # Read streamed build contexts, like the docker daemon would.
+        if kwargs.get('custom_context') and not hasattr(kwargs['fileobj'],
+                                                        'read'):
+            ''.join(kwargs['fileobj'])
+
         # "Store" the newly "built" image
         images.append(kwargs['tag'])
         return BUILD_RES
@@ -107,7 +132,15 @@ class FakeDockerClient(object):
         cont = find_container(container_id)
         return {'Name': cont['Name'],
                 'Id': cont['Id'],
-                'State': {'Running': cont['Running']}}
+                'State': {'Running': cont['Running']},
+                'NetworkSettings': {'IPAddress': cont['IPAddress']},
+                'HostConfig': cont['Options'].get('host_config') or {},
+                # Older API versions set some limits in the Config.
+                'Config': {'Memory': cont['Options'].get('mem_limit', 0),
+                           'MemorySwap': cont['Options'].get(
+                               'memswap_limit', 0),
+                           'CpuShares': cont['Options'].get('cpu_shares', 0),
+                           'Cpuset': cont['Options'].get('cpuset', '')}}
 
     def create_container(self, **kwargs):
         """Imitiate docker.Client.create_container."""
@@ -126,7 +159,9 @@ class FakeDockerClient(object):
         new_container = {'Id': container_id,
                          'Running': False,
                          'Options': kwargs,
-                         'Name': kwargs['name']}
+                         'Name': kwargs['name'],
+                         'IPAddress': '172.17.0.{0}'.format(
+                             len(containers) + 2)}
         containers.append(new_container)
         return {'Id': container_id, 'Warnings': None}
 
@@ -135,10 +170,10 @@ class FakeDockerClient(object):
         cont_to_kill = find_container(cont_id)
         cont_to_kill['Running'] = False
 
-    def remove_container(self, cont_id):
+    def remove_container(self, cont_id, force=False):
         """Imitate docker.Client.remove_container."""
         cont_to_rm = find_container(cont_id)
-        if cont_to_rm['Running']:
+        if cont_to_rm['Running'] and not force:
             raise RuntimeError('tried to remove a running container.')
         removed_containers.append(cont_to_rm)
         containers.remove(cont_to_rm)
@@ -148,27 +183,100 @@ class FakeDockerClient(object):
         cont_to_start = find_container(cont_id)
         cont_to_start['Running'] = True
 
+    def inspect_image(self, image_name):
+        """Imitate docker.Client.inspect_image."""
+        # Like docker, resolve names without a tag to the 'latest' tag.
+        if image_name not in images and image_name + ':latest' in images:
+            image_name += ':latest'
+        if image_name not in images:
+            raise docker.errors.APIError('the specified image does not exist.',
+                                         requests.Response())
+        return {'Id': 'id_of_' + image_name}
+
+    def pull(self, repository, tag=None, **kwargs):
+        """Imitate docker.Client.pull."""
+        images.append('{0}:{1}'.format(repository, tag) if tag
+                      else repository)
+        return ''
+
+    def remove_image(self, image_name):
+        """Imitate docker.Client.remove_image."""
+        if image_name not in images:
+            raise docker.errors.APIError('the specified image does not exist.',
+                                         _response(404))
+        if any(cont['Options']['image'] == image_name
+               for cont in containers):
+            raise docker.errors.APIError('the image is used by a container.',
+                                         _response(409))
+        images.remove(image_name)
+
     def images(*args, **kwargs):
         return [{'RepoTags': [image_name]} for image_name in images]
 
+    def exec_create(self, container, cmd, **kwargs):
+        """Imitate docker.Client.exec_create."""
+        find_container(container)
+        return {'Id': str(uuid.uuid4())}
+
+    def exec_start(self, exec_id, stream=False, **kwargs):
+        """Imitate docker.Client.exec_start."""
+        if stream:
+            return iter(exec_output)
+        return ''.join(exec_output)
+
+    def exec_inspect(self, exec_id):
+        """Imitate docker.Client.exec_inspect."""
+        return {'ExitCode': exec_exit_code}
+
+    def logs(self, container, stream=False, timestamps=False, tail='all',
+             **kwargs):
+        """Imitate docker.Client.logs (without streaming)."""
+        find_container(container)
+        lines = container_logs.get(container, [])
+        if tail != 'all':
+            lines = lines[-tail:] if tail else []
+        return ''.join('{0} {1}\n'.format(ts, line) if timestamps
+                       else line + '\n' for ts, line in lines)
+
+    def copy(self, container, resource):
+        """Imitate docker.Client.copy."""
+        find_container(container)
+        if resource not in archives:
+            raise docker.errors.APIError('the resource does not exist.',
+                                         requests.Response())
+        return io.BytesIO(archives[resource])
 
 
 def find_container(cont_id):
-    """Helper function to find a container based on id."""
+    """Helper function to find a container based on id or name."""
     for cont in containers:
-        if cont['Id'] == cont_id:
+        if cont_id in (cont['Id'], cont['Name']):
             return cont
     raise docker.errors.APIError('container was not found.', requests.Response())
 
 
+def _response(status_code):
+    """Helper function to make a response with a status code for errors."""
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
 class FakeDockerTestBase(unittest.TestCase):
 
     def setUp(self):
         self.stubs = stubout.StubOutForTesting()
         self.stubs.Set(docker, 'Client', FakeDockerClient)
+
+        # Keep image cache indexes out of the user's home directory.
+        self.cache_dir = tempfile.mkdtemp()
+        self.stubs.Set(image_cache, 'CACHE_DIR', self.cache_dir)
+        utils.get_docker_client_pool().clear()
         reset()
 
     def tearDown(self):
         """Restore docker.Client and requests.get."""
         reset()
+        utils.get_docker_client_pool().clear()
         self.stubs.UnsetAll()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,86 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the load balancer in the pinger image."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import socket
+import threading
+import unittest
+
+from appstart.pinger import balancer
+
+
+class BalancerTest(unittest.TestCase):
+
+    def test_least_connections(self):
+        bal = balancer.Balancer(['a:1', 'b:1', 'c:1'])
+        a, b, c = bal.backends
+
+        # Tied backends take turns.
+        self.assertEqual([bal.acquire() for _ in range(3)], [a, b, c])
+        bal.release(a)
+        bal.release(c)
+        self.assertIs(bal.acquire(), a)
+        self.assertIs(bal.acquire(), c)
+        self.assertEqual([x.active for x in (a, b, c)], [1, 1, 1])
+
+    def test_down_backends_are_skipped(self):
+        bal = balancer.Balancer(['a:1', 'b:1'])
+        a, b = bal.backends
+        bal.release(bal.acquire(), failed=True)
+        self.assertIs(bal.acquire(), b)
+        self.assertIs(bal.acquire(), b)
+        self.assertIsNone(bal.acquire(exclude=[b]))
+        self.assertEqual(a.address, ('a', 1))
+
+    def test_forwarding(self):
+        # A backend that echoes what it receives.
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def echo():
+            conn, _ = server.accept()
+            conn.sendall(conn.recv(1024))
+            conn.close()
+
+        thread = threading.Thread(target=echo)
+        thread.start()
+
+        # The first backend refuses connections.
+        refused = socket.socket()
+        refused.bind(('127.0.0.1', 0))
+        bal = balancer.Balancer(
+            ['127.0.0.1:{0}'.format(refused.getsockname()[1]),
+             '127.0.0.1:{0}'.format(server.getsockname()[1])])
+        refused.close()
+
+        client, proxied = socket.socketpair()
+        handler = threading.Thread(target=balancer.handle,
+                                   args=(bal, proxied))
+        handler.start()
+        client.sendall('hello')
+        self.assertEqual(client.recv(1024), 'hello')
+        client.close()
+        handler.join()
+        thread.join()
+        server.close()
+        self.assertEqual([b.active for b in bal.backends], [0, 0])
+        self.assertGreater(bal.backends[0].down_until, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.bench."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import unittest
+
+from appstart import bench
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        status = 404 if self.path == '/missing' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *unused_args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class BenchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99.9), 100)
+        self.assertEqual(bench.percentile([7], 1), 7)
+        self.assertIsNone(bench.percentile([], 50))
+        self.assertEqual(bench.percentile_name(99.9), 'p999')
+
+    def test_run(self):
+        result = bench.LoadGenerator('127.0.0.1', self.port, concurrency=4,
+                                     requests=40, warmup=0).run()
+        self.assertEqual(result['requests'], 40)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(result['statuses'], {'200': 40})
+        self.assertGreater(result['throughput_rps'], 0)
+        latency = result['latency_ms']
+        self.assertLessEqual(latency['p50'], latency['p999'])
+        self.assertLessEqual(latency['p999'], latency['max'])
+        self.assertEqual(len(bench.format_report(result)), 3)
+
+    def test_statuses(self):
+        result = bench.LoadGenerator('127.0.0.1', self.port, path='/missing',
+                                     concurrency=1, requests=3,
+                                     warmup=0).run()
+        self.assertEqual(result['statuses'], {'404': 3})
+
+    def test_path_mix(self):
+        result = bench.LoadGenerator('127.0.0.1', self.port,
+                                     path=['/', '/missing'], concurrency=1,
+                                     requests=4, warmup=0).run()
+        self.assertEqual(result['statuses'], {'200': 2, '404': 2})
+
+    def test_compare_paths(self):
+        proxy = _Server(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=proxy.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(proxy.server_close)
+        self.addCleanup(proxy.shutdown)
+
+        result = bench.compare_paths('127.0.0.1', self.port,
+                                     proxy.server_address[1], concurrency=2,
+                                     requests=10, warmup=0)
+        for phase in ('concurrent', 'alone'):
+            self.assertEqual(result[phase]['direct']['requests'], 10)
+            self.assertEqual(result[phase]['proxy']['requests'], 10)
+        self.assertEqual(
+            result['proxy_overhead_ms']['p50'],
+            round(result['concurrent']['proxy']['latency_ms']['p50'] -
+                  result['concurrent']['direct']['latency_ms']['p50'], 3))
+        self.assertEqual(result['throughput_ceiling_rps']['direct'],
+                         result['alone']['direct']['throughput_rps'])
+        self.assertEqual(len(bench.format_comparison(result)), 14)
+
+    def test_errors(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        result = bench.LoadGenerator('127.0.0.1', port, concurrency=2,
+                                     requests=6, warmup=0).run()
+        self.assertEqual(result['errors'], 6)
+        self.assertIsNone(result['latency_ms']['p50'])
+
+        # Workers back off instead of spinning against a closed port, so
+        # only a few attempts fail per worker.
+        result = bench.LoadGenerator('127.0.0.1', port, concurrency=2,
+                                     duration=0.5, warmup=0).run()
+        self.assertGreater(result['errors'], 0)
+        self.assertLessEqual(result['errors'], 12)
+
+if __name__ == '__main__':
+    unittest.main()
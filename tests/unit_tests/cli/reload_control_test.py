@@ -0,0 +1,159 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.cli.reload_control."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import fcntl
+import json
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import stubout
+
+from appstart import utils
+from appstart.cli import reload_control
+
+
+class ReloadControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.run_dir = os.path.join(tempfile.mkdtemp(), 'run')
+        self.prev_run_dir = os.environ.get('APPSTART_RUN_DIR')
+        os.environ['APPSTART_RUN_DIR'] = self.run_dir
+        reload(reload_control)
+
+        # The signals that request_reload sends, as (pid, signal).
+        self.signals = []
+        self.stubs.Set(os, 'kill', self.fake_kill)
+
+        # The locked pidfiles of the fake running processes.
+        self.pidfiles = []
+
+    def tearDown(self):
+        for pidfile in self.pidfiles:
+            pidfile.close()
+        self.stubs.UnsetAll()
+        if self.prev_run_dir is None:
+            del os.environ['APPSTART_RUN_DIR']
+        else:
+            os.environ['APPSTART_RUN_DIR'] = self.prev_run_dir
+        reload(reload_control)
+        shutil.rmtree(os.path.dirname(self.run_dir))
+
+    def fake_kill(self, pid, signo):
+        self.signals.append((pid, signo))
+
+    def register(self, key, pid, running=True):
+        """Write a pidfile, as a running 'appstart run' would.
+
+        Unless running is False, the pidfile stays locked until the end of
+        the test.
+        """
+        if not os.path.isdir(self.run_dir):
+            os.makedirs(self.run_dir)
+        pidfile = open(reload_control._pidfile(key), 'w')
+        json.dump({'pid': pid, 'app': key}, pidfile)
+        pidfile.flush()
+        if running:
+            fcntl.flock(pidfile, fcntl.LOCK_EX)
+            self.pidfiles.append(pidfile)
+        else:
+            pidfile.close()
+
+    def test_run_dir_from_environment(self):
+        self.assertEqual(reload_control.RUN_DIR, self.run_dir)
+
+    def test_pidfile(self):
+        key = reload_control.app_key('app.yaml')
+        self.assertEqual(key, os.path.abspath('app.yaml'))
+        handler = signal.getsignal(signal.SIGUSR1)
+        with reload_control.reload_requests(key):
+            with open(reload_control._pidfile(key)) as f:
+                self.assertEqual(json.load(f),
+                                 {'pid': os.getpid(), 'app': key})
+            # The pidfile stays locked while the application runs.
+            self.assertEqual(reload_control._running(), {key: os.getpid()})
+        self.assertEqual(os.listdir(self.run_dir), [])
+        self.assertEqual(signal.getsignal(signal.SIGUSR1), handler)
+
+    def test_sigusr1_sets_event(self):
+        self.stubs.UnsetAll()
+        with reload_control.reload_requests('image:app') as requested:
+            self.assertFalse(requested.is_set())
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertTrue(requested.wait(5))
+
+    def test_no_sigusr1(self):
+        sigusr1 = signal.SIGUSR1
+        del signal.SIGUSR1
+        try:
+            with reload_control.reload_requests('image:app') as requested:
+                self.assertFalse(requested.is_set())
+                self.assertFalse(os.path.exists(self.run_dir))
+        finally:
+            signal.SIGUSR1 = sigusr1
+
+    def test_stale_pidfile(self):
+        # The pid of a process that crashed may have been reused, so it
+        # mustn't be signalled.
+        self.register('image:gone', 1234, running=False)
+        self.register('image:app', 5678)
+        reload_control.request_reload()
+        self.assertEqual(self.signals, [(5678, signal.SIGUSR1)])
+        self.assertFalse(
+            os.path.exists(reload_control._pidfile('image:gone')))
+        self.assertTrue(os.path.exists(reload_control._pidfile('image:app')))
+
+    def test_request_reload(self):
+        self.register(reload_control.app_key('app.yaml'), 1234)
+        self.register(reload_control.app_key(image_name='app'), 5678)
+        reload_control.request_reload(config_file='app.yaml')
+        reload_control.request_reload(image_name='app')
+        self.assertEqual(self.signals, [(1234, signal.SIGUSR1),
+                                        (5678, signal.SIGUSR1)])
+
+        with self.assertRaises(utils.AppstartAbort):
+            reload_control.request_reload(config_file='other.yaml')
+
+    def test_no_application_running(self):
+        with self.assertRaises(utils.AppstartAbort):
+            reload_control.request_reload()
+
+        # Unreadable pidfiles are skipped.
+        os.makedirs(self.run_dir)
+        with open(os.path.join(self.run_dir, 'broken.pid'), 'w') as f:
+            f.write('{')
+        with self.assertRaises(utils.AppstartAbort):
+            reload_control.request_reload()
+        self.assertEqual(self.signals, [])
+
+    def test_several_applications_running(self):
+        self.register('image:a', 1234)
+        self.register('image:b', 5678)
+        with self.assertRaises(utils.AppstartAbort) as ctx:
+            reload_control.request_reload()
+        self.assertIn('image:a', str(ctx.exception))
+        self.assertIn('image:b', str(ctx.exception))
+        self.assertEqual(self.signals, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
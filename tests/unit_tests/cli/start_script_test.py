@@ -0,0 +1,101 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.cli.start_script."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import docker
+import requests
+
+from appstart import utils
+from appstart.cli import start_script
+
+
+class _FakeSandbox(object):
+    """Records the reloads that reload_sandbox asks for."""
+
+    def __init__(self, mount_static=False, error=None, conf_path=None):
+        self.mount_static = mount_static
+        self.error = error
+        self.conf_path = conf_path
+        self.run_devappserver = True
+        self.reloads = []
+
+    def app_dirs(self):
+        return ['/app']
+
+    def config_files(self):
+        return ['/app/app.yaml']
+
+    def static_dirs(self):
+        if self.conf_path:
+            return utils.static_dirs(self.conf_path)
+        return ['/app/static']
+
+    def reload(self, **kwargs):
+        self.reloads.append(kwargs)
+        if self.error:
+            raise self.error
+
+
+class ReloadSandboxTest(unittest.TestCase):
+
+    def test_config_change(self):
+        sandbox = _FakeSandbox()
+        start_script.reload_sandbox(sandbox, set(['/app/app.yaml']))
+        # The config file is part of the application image too.
+        self.assertEqual(sandbox.reloads,
+                         [{'app': True, 'devappserver': True,
+                           'force': False}])
+
+    def test_static_change(self):
+        sandbox = _FakeSandbox()
+        start_script.reload_sandbox(sandbox, set(['/app/static/a.css']))
+        self.assertEqual(sandbox.reloads,
+                         [{'app': True, 'devappserver': True,
+                           'force': False}])
+
+        # Mounted static files are served without a reload.
+        sandbox = _FakeSandbox(mount_static=True)
+        start_script.reload_sandbox(sandbox, set(['/app/static/a.css']))
+        self.assertEqual(sandbox.reloads, [])
+
+    def test_docker_errors_are_reported(self):
+        for error in (docker.errors.APIError('gone', requests.Response()),
+                      requests.exceptions.ConnectionError('refused')):
+            sandbox = _FakeSandbox(error=error)
+            start_script.reload_sandbox(sandbox)
+            self.assertEqual(len(sandbox.reloads), 1)
+
+    def test_broken_config_file(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        conf_path = os.path.join(temp_dir, 'app.yaml')
+        with open(conf_path, 'w') as f:
+            f.write('vm: true\nhandlers: [')
+
+        # A half-saved config file is reported, and the next save reloads.
+        sandbox = _FakeSandbox(conf_path=conf_path)
+        start_script.reload_sandbox(sandbox, set([conf_path]))
+        self.assertEqual(sandbox.reloads, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -177,6 +177,20 @@ class ConfigurationTest(unittest.TestCase):
             with self.assertRaises(utils.AppstartAbort):
                 configuration.ApplicationConfiguration(conf_file_name)
 
+    def test_module_name(self):
+        conf = configuration.ApplicationConfiguration(
+            self._make_yaml_config('vm: true'))
+        self.assertEqual(conf.module_name, 'default')
+
+        conf = configuration.ApplicationConfiguration(
+            self._make_yaml_config('vm: true\nmodule: api'))
+        self.assertEqual(conf.module_name, 'api')
+
+        conf = configuration.ApplicationConfiguration(self._make_xml_configs(
+            '<appengine-web-app><vm>true</vm><module>api</module>'
+            '</appengine-web-app>'))
+        self.assertEqual(conf.module_name, 'api')
+
     def test_malformed_yaml(self):
         yaml_file = 'malformed yaml file'
         conf_file_name = self._make_yaml_config(yaml_file)
@@ -3,10 +3,12 @@
 # This file conforms to the external style guide
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import json
 import logging
 import os
 import stubout
 import tempfile
+import threading
 import unittest
 
 import docker
@@ -14,6 +16,7 @@ import mox
 
 from appstart.sandbox import container_sandbox
 from appstart.sandbox import container
+from appstart.sandbox import devappserver_pool
 from appstart import utils
 
 from fakes import fake_docker
@@ -50,11 +53,17 @@ class CreateAndRemoveContainersTest(TestBase):
         self.stubs.Set(container.PingerContainer,
                        'ping_application_container',
                        lambda self: True)
+        self.stubs.Set(container.PingerContainer,
+                       'probe_application_container',
+                       lambda self, window, host=None: True)
 
         # Fake out stream_logs, as this will try to start another thread.
         self.stubs.Set(container.Container,
                        'stream_logs',
                        lambda unused_self, unused_stream=True: None)
+        self.stubs.Set(container_sandbox.ContainerSandbox,
+                       'follow_logs',
+                       lambda unused_self: None)
 
     def test_start_from_conf(self):
         """Test ContainerSandbox.start."""
@@ -87,6 +96,319 @@ class CreateAndRemoveContainersTest(TestBase):
                          len(fake_docker.DEFAULT_IMAGES) + 2,
                          'Too many images created')
 
+    def test_devappserver_image_reuse(self):
+        def devappserver_images():
+            return [i for i in fake_docker.images if i.startswith(
+                container_sandbox.DEVAPPSERVER_IMAGE_REPO)]
+
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(devappserver_images()), 1)
+
+        # Nothing changed, so the devappserver image should be reused.
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(devappserver_images()), 1)
+
+        # Changing the config file changes the image.
+        with open(self.conf_file.name, 'a') as f:
+            f.write('\nruntime: custom')
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(devappserver_images()), 2)
+
+    def test_app_image_reuse(self):
+        def app_images():
+            return [i for i in fake_docker.images if i.startswith(
+                container_sandbox.APP_IMAGE_REPO)]
+
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        sb.stop()
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(app_images()), 1)
+
+        # Building without the cache always makes a fresh image.
+        with open(self.conf_file.name, 'a') as f:
+            f.write('\nruntime: custom')
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                nocache=True)
+        sb.start()
+        sb.stop()
+        self.assertEqual(len(app_images()), 2)
+
+    def test_reuse_devappserver(self):
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                reuse=True)
+        sb.start()
+        devappserver_id = sb.devappserver_container.get_id()
+
+        # Only one sandbox can use a warm container at a time.
+        with self.assertRaises(utils.AppstartAbort):
+            container_sandbox.ContainerSandbox(self.conf_file.name,
+                                               reuse=True).start()
+        sb.stop()
+        self.assertTrue(fake_docker.find_container(devappserver_id)['Running'])
+
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                reuse=True)
+        sb.start()
+        self.assertEqual(sb.devappserver_container.get_id(), devappserver_id)
+        sb.stop()
+
+        # A different configuration needs the same ports, so the idle warm
+        # container makes way for a new one.
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                reuse=True,
+                                                application_id='other')
+        sb.start()
+        self.assertNotEqual(sb.devappserver_container.get_id(),
+                            devappserver_id)
+        sb.stop()
+        self.assertEqual(
+            [c['Name'] for c in fake_docker.containers],
+            [sb.devappserver_container.name])
+
+    def test_reuse_pool_concurrent_updates(self):
+        pool = devappserver_pool.DevappserverPool(
+            fake_docker.FakeDockerClient(), max_warm=20)
+        keys = ['{0:x}'.format(i) * 40 for i in range(16)]
+
+        def use(index):
+            lease = pool.acquire(keys[index], [9000 + index])
+            pool.release(lease)
+
+        threads = [threading.Thread(target=use, args=(i,))
+                   for i in range(len(keys))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(pool._load_index()), len(keys))
+
+    def test_instances(self):
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                instances=3)
+        sb.start()
+        api_host = sb.devappserver_container.ip_address()
+
+        apps = sb.app_containers()
+        self.assertEqual(len(apps), 3)
+        backends = []
+        for index, cont in enumerate(apps):
+            options = fake_docker.find_container(cont.get_id())['Options']
+            self.assertEqual(options['environment']['GAE_MODULE_INSTANCE'],
+                             str(index))
+            self.assertEqual(options['environment']['API_HOST'], api_host)
+            backends.append('{0}:8080'.format(cont.ip_address()))
+
+        options = fake_docker.find_container(
+            sb.balancer_container.get_id())['Options']
+        self.assertEqual(options['entrypoint'][-3:], backends)
+        self.assertEqual(len(fake_docker.containers), 6)
+        sb.stop()
+        self.assertEqual(fake_docker.containers, [])
+
+    def make_module(self, name):
+        module_dir = os.path.join(os.path.dirname(self.conf_file.name), name)
+        os.mkdir(module_dir)
+        conf = os.path.join(module_dir, 'app.yaml')
+        with open(conf, 'w') as f:
+            f.write('vm: true\nmodule: {0}\n'.format(name))
+        return conf
+
+    def test_modules(self):
+        modules = [self.make_module('api'), self.make_module('worker')]
+        dispatch = os.path.join(os.path.dirname(self.conf_file.name),
+                                'dispatch.yaml')
+        with open(dispatch, 'w') as f:
+            f.write('dispatch:\n- url: "*/api/*"\n  module: api\n')
+
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                modules=modules,
+                                                dispatch_file=dispatch)
+        self.assertEqual(sb.dispatch_rules, [('*/api/*', 'api')])
+        sb.start()
+        api_host = sb.devappserver_container.ip_address()
+        self.assertEqual([(m.name, m.port) for m in sb.modules],
+                         [('api', 8081), ('worker', 8082)])
+        for module in sb.modules:
+            env = fake_docker.find_container(
+                module.container.get_id())['Options']['environment']
+            self.assertEqual(env['GAE_MODULE_NAME'], module.name)
+            self.assertEqual(env['API_HOST'], api_host)
+        self.assertEqual(len(fake_docker.containers), 5)
+        sb.stop()
+        self.assertEqual(fake_docker.containers, [])
+
+    def test_bad_modules(self):
+        with self.assertRaises(utils.AppstartAbort):
+            container_sandbox.ContainerSandbox(
+                self.conf_file.name, modules=[self.conf_file.name])
+
+        dispatch = os.path.join(os.path.dirname(self.conf_file.name),
+                                'dispatch.yaml')
+        with open(dispatch, 'w') as f:
+            f.write('dispatch:\n- url: "*/api/*"\n  module: api\n')
+        with self.assertRaises(utils.AppstartAbort):
+            container_sandbox.ContainerSandbox(self.conf_file.name,
+                                               dispatch_file=dispatch)
+
+    def test_mount_static(self):
+        app_dir = os.path.dirname(self.conf_file.name)
+        os.mkdir(os.path.join(app_dir, 'css'))
+        with open(os.path.join(app_dir, 'css', 'main.css'), 'w') as f:
+            f.write('body {}')
+        with open(self.conf_file.name, 'w') as f:
+            f.write('vm: true\nhandlers:\n- url: /css\n  static_dir: css\n')
+
+        built = []
+        self.stubs.Set(utils, 'add_files_from_static_dirs',
+                       lambda files, conf: built.append(conf))
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                mount_static=True)
+        sb.start()
+        self.assertEqual(built, [])
+        self.assertEqual(sb.static_mounts(),
+                         {os.path.join(app_dir, 'css'): '/app/css'})
+        options = fake_docker.find_container(
+            sb.devappserver_container.get_id())['Options']
+        self.assertIn('{0}:/app/css:ro'.format(os.path.join(app_dir, 'css')),
+                      options['host_config']['Binds'])
+        sb.stop()
+
+    def test_app_image_tracks_base_image(self):
+        with open(os.path.join(os.path.dirname(self.conf_file.name),
+                               'Dockerfile'), 'w') as f:
+            f.write('FROM base:1\n')
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        name = sb.build_app_image()
+        self.assertIn('base:1', fake_docker.images)
+        self.assertEqual(sb.build_app_image(), name)
+
+        # A rebuilt or newly pulled base image has a new ID.
+        self.stubs.Set(sb, 'image_id', lambda image_name: 'new_id')
+        self.assertNotEqual(sb.build_app_image(), name)
+
+    def test_base_image_pulls(self):
+        dockerfile = os.path.join(os.path.dirname(self.conf_file.name),
+                                  'Dockerfile')
+        with open(dockerfile, 'w') as f:
+            f.write('FROM debian\n')
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        self.assertEqual(sb.base_image_ids(sb.app_dir),
+                         ['id_of_debian:latest'])
+
+        # scratch is never pulled, and doesn't stop the image's reuse.
+        with open(dockerfile, 'w') as f:
+            f.write('FROM scratch\n')
+        self.assertEqual(sb.base_image_ids(sb.app_dir), [])
+        name = sb.build_app_image()
+        self.assertEqual(sb.build_app_image(), name)
+        self.assertNotIn('scratch', fake_docker.images)
+
+    def test_limits(self):
+        sb = container_sandbox.ContainerSandbox(
+            self.conf_file.name,
+            app_limits=['memory=512m', 'cpu_shares=512'],
+            devappserver_limits=['cpuset=0'])
+        sb.start()
+        limits = sb.applied_limits()
+        self.assertEqual(limits['app']['memory'], 512 * 1024 * 1024)
+        self.assertEqual(limits['app']['cpu_shares'], 512)
+        self.assertEqual(limits['app']['cpuset'], '')
+        self.assertEqual(limits['devappserver']['cpuset'], '0')
+        self.assertEqual(limits['devappserver']['memory'], 0)
+        sb.stop()
+
+        with self.assertRaises(utils.AppstartAbort):
+            container_sandbox.ContainerSandbox(self.conf_file.name,
+                                               app_limits=['memory=lots'])
+
+    def test_limits_newer_api(self):
+        sb = container_sandbox.ContainerSandbox(
+            self.conf_file.name,
+            app_limits=['memory=512m', 'cpus=1.5', 'ulimit=nofile=1024'])
+        sb.start()
+        limits = sb.applied_limits()
+        self.assertEqual(limits['app']['memory'], 512 * 1024 * 1024)
+        self.assertEqual(limits['app']['cpu_quota'], 150000)
+        self.assertEqual(limits['app']['ulimits'],
+                         [{'Name': 'nofile', 'Soft': 1024, 'Hard': 1024}])
+
+        # Only the application container needs the newer API.
+        self.assertEqual(sb.app_dclient.kwargs['version'], '1.19')
+        self.assertEqual(sb.devappserver_dclient.kwargs['version'],
+                         utils.DOCKER_API_VERSION)
+        sb.stop()
+
+    def test_reload(self):
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name)
+        sb.start()
+        devappserver_id = sb.devappserver_container.get_id()
+        old_ids = [sb.app_container.get_id(), sb.pinger_container.get_id()]
+
+        with open(os.path.join(os.path.dirname(self.conf_file.name),
+                               'main.py'), 'w') as f:
+            f.write('changed')
+        sb.reload()
+        self.assertEqual(sb.devappserver_container.get_id(), devappserver_id)
+        running = set(c['Id'] for c in fake_docker.containers)
+        self.assertEqual(len(running), 3)
+        self.assertFalse(running & set(old_ids))
+        self.assertEqual(
+            len([i for i in fake_docker.images
+                 if i.startswith(container_sandbox.APP_IMAGE_REPO)]), 2)
+
+        # Nothing changed, so nothing is replaced.
+        app_id = sb.app_container.get_id()
+        sb.reload(force=False)
+        self.assertEqual(sb.app_container.get_id(), app_id)
+
+        # A new devappserver image means new containers all around, but the
+        # application image is reused.
+        app_image = sb.app_image
+        with open(self.conf_file.name, 'a') as f:
+            f.write('\n# changed\n')
+        sb.reload(app=False, devappserver=True, force=False)
+        self.assertNotEqual(sb.devappserver_container.get_id(),
+                            devappserver_id)
+        self.assertEqual(sb.app_image, app_image)
+        self.assertEqual(len(fake_docker.containers), 3)
+
+        # If the new application can't be built, the old one keeps running.
+        old_ids = [sb.app_container.get_id(), sb.pinger_container.get_id()]
+        self.stubs.Set(sb, 'build_app_image', self.fail_build)
+        with self.assertRaises(utils.AppstartAbort):
+            sb.reload()
+        self.assertEqual(
+            [sb.app_container.get_id(), sb.pinger_container.get_id()], old_ids)
+        self.assertEqual(len(fake_docker.containers), 3)
+        sb.stop()
+
+    @staticmethod
+    def fail_build():
+        raise utils.AppstartAbort('build failed')
+
+    def test_profile_startup(self):
+        trace_file = os.path.join(self.cache_dir, 'trace.json')
+        sb = container_sandbox.ContainerSandbox(self.conf_file.name,
+                                                profile_startup=True,
+                                                trace_file=trace_file)
+        sb.start()
+        sb.stop()
+
+        with open(trace_file) as f:
+            names = set(e['name'] for e in json.load(f)['traceEvents'])
+        for name in ('startup', 'devappserver_image', 'app_start',
+                     'wait_for_start', 'docker.create_container'):
+            self.assertIn(name, names)
+
     def test_start_no_image_no_conf(self):
         with self.assertRaises(utils.AppstartAbort):
             container_sandbox.ContainerSandbox()
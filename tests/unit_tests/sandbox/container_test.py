@@ -17,6 +17,8 @@
 # This file conforms to the external style guide.
 # pylint: disable=bad-indentation, g-bad-import-order
 
+import io
+import tarfile
 import unittest
 
 from appstart.sandbox import container
@@ -111,5 +113,71 @@ class TestContainer(fake_docker.FakeDockerTestBase):
                          fake_docker.containers[0]['Id'],
                          'Container IDs do not match')
 
+
+class TestExtractTar(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(TestExtractTar, self).setUp()
+        fake_docker.images.append('temp')
+        self.cont = container.Container(fake_docker.FakeDockerClient())
+        self.cont.create(name='temp', image='temp')
+
+        buf = io.BytesIO()
+        tar = tarfile.open(mode='w', fileobj=buf)
+        tinfo = tarfile.TarInfo('logs')
+        tinfo.type = tarfile.DIRTYPE
+        tar.addfile(tinfo)
+        for name in ('a.log', 'b.log'):
+            tinfo = tarfile.TarInfo('logs/' + name)
+            tinfo.size = 1000
+            tar.addfile(tinfo, io.BytesIO(name[0] * 1000))
+        tar.close()
+        fake_docker.archives['/var/logs'] = buf.getvalue()
+
+    def test_extract_tar(self):
+        # Small enough that the archive is spilled to disk.
+        tar = self.cont.extract_tar('/var/logs', spool_max_size=100)
+        self.assertEqual(tar.list('logs'), (['a.log', 'b.log'], []))
+        self.assertEqual(tar.get_file('logs/b.log').read(), 'b' * 1000)
+
+        with self.assertRaises(IOError):
+            self.cont.extract_tar('/nonexistent')
+
+    def test_iter_tar(self):
+        members = [(tinfo.name, f.read() if f else None)
+                   for tinfo, f in self.cont.iter_tar('/var/logs')]
+        self.assertEqual(members, [('logs', None),
+                                   ('logs/a.log', 'a' * 1000),
+                                   ('logs/b.log', 'b' * 1000)])
+
+        with self.assertRaises(IOError):
+            list(self.cont.iter_tar('/nonexistent'))
+
+
+class TestPingerContainer(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(TestPingerContainer, self).setUp()
+        self.pinger = container.PingerContainer(
+            fake_docker.FakeDockerClient())
+        self.pinger.create(name='pinger', image='appstart_pinger')
+
+    def test_probe_ready(self):
+        fake_docker.exec_output = ['re', 'ady\n']
+        self.assertTrue(self.pinger.probe_application_container(1))
+        self.assertTrue(self.pinger.supports_probe)
+
+    def test_probe_timeout(self):
+        fake_docker.exec_output = ['timeout\n']
+        fake_docker.exec_exit_code = 1
+        self.assertFalse(self.pinger.probe_application_container(1))
+        self.assertTrue(self.pinger.supports_probe)
+
+    def test_probe_legacy_pinger(self):
+        # Old pingers only report success through their exit code.
+        fake_docker.exec_output = ['INFO:root:success\n']
+        self.assertTrue(self.pinger.probe_application_container(1))
+        self.assertFalse(self.pinger.supports_probe)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.file_watcher."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from appstart.sandbox import file_watcher
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_classify(self):
+        def classify(*paths):
+            return file_watcher.classify(paths, ['/app/app.yaml'],
+                                         ['/app/static'])
+
+        self.assertEqual(classify('/app/app.yaml'),
+                         set([file_watcher.CONFIG]))
+        self.assertEqual(classify('/app/static/a.css', '/app/static'),
+                         set([file_watcher.STATIC]))
+        self.assertEqual(classify('/app/main.py', '/app/static.py'),
+                         set([file_watcher.CODE]))
+        self.assertEqual(len(classify('/app/app.yaml', '/app/main.py')), 2)
+
+    def test_any_inside(self):
+        self.assertTrue(file_watcher.any_inside(['/app/static/a.css'],
+                                                ['/app']))
+        self.assertFalse(file_watcher.any_inside(['/app/static/a.css'],
+                                                 ['/app'],
+                                                 exclude=['/app/static']))
+        self.assertFalse(file_watcher.any_inside(['/application/main.py'],
+                                                 ['/app']))
+
+
+class FileWatcherTest(unittest.TestCase):
+
+    use_inotify = False
+
+    def setUp(self):
+        self.app_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app_dir)
+        self.write('main.py')
+        self.watcher = file_watcher.FileWatcher(
+            [self.app_dir], on_change=None, debounce=0.05,
+            use_inotify=self.use_inotify)
+        if not self.use_inotify:
+            self.watcher._backend._interval = 0.05
+        self.addCleanup(self.watcher.stop)
+
+    def write(self, *path):
+        path = os.path.join(self.app_dir, *path)
+        with open(path, 'a') as f:
+            f.write('changed')
+        return path
+
+    def test_changes(self):
+        self.assertEqual(self.watcher.wait_for_changes(0.1), set())
+        main = self.write('main.py')
+        self.write('main.py~')
+        self.assertIn(main, self.watcher.wait_for_changes(1))
+
+    def test_new_directory(self):
+        os.mkdir(os.path.join(self.app_dir, 'lib'))
+        self.watcher.wait_for_changes(1)
+        lib = self.write('lib', 'lib.py')
+        self.assertIn(lib, self.watcher.wait_for_changes(1))
+
+    def test_ignored_directory(self):
+        os.mkdir(os.path.join(self.app_dir, '.git'))
+        self.watcher.wait_for_changes(0.1)
+        self.write('.git', 'index')
+        self.assertEqual(self.watcher.wait_for_changes(0.2), set())
+
+    def test_dockerignore(self):
+        dockerignore = self.write('.dockerignore')
+        self.assertIn(dockerignore, self.watcher.wait_for_changes(1))
+
+
+class InotifyTest(FileWatcherTest):
+
+    use_inotify = True
+
+    def setUp(self):
+        super(InotifyTest, self).setUp()
+        # pylint: disable=protected-access
+        if not isinstance(self.watcher._backend, file_watcher._Inotify):
+            self.skipTest('inotify is unavailable')
+
+    def test_falls_back_to_polling(self):
+        def add_tree(top):
+            raise OSError(errno.ENOSPC, 'Could not watch {0}'.format(top))
+
+        # pylint: disable=protected-access
+        self.watcher._backend._add_tree = add_tree
+        os.mkdir(os.path.join(self.app_dir, 'node_modules'))
+        self.assertIn(self.app_dir, self.watcher.wait_for_changes(1))
+        self.assertIsInstance(self.watcher._backend, file_watcher._Poller)
+
+        self.watcher._backend._interval = 0.05
+        lib = self.write('node_modules', 'lib.js')
+        self.assertIn(lib, self.watcher.wait_for_changes(1))
+
+if __name__ == '__main__':
+    unittest.main()
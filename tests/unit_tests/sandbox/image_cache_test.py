@@ -0,0 +1,203 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.image_cache."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from appstart.sandbox import image_cache
+from fakes import fake_docker
+
+
+class DigestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'app.yaml')
+        with open(self.path, 'w') as f:
+            f.write('vm: true')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_digest_build_context(self):
+        digest = image_cache.digest_build_context('FROM x', {self.path: None},
+                                                  'base')
+        self.assertEqual(
+            digest,
+            image_cache.digest_build_context('FROM x', {self.path: None},
+                                             'base'))
+
+        # Every input contributes to the digest.
+        self.assertNotEqual(
+            digest,
+            image_cache.digest_build_context('FROM y', {self.path: None},
+                                             'base'))
+        self.assertNotEqual(
+            digest,
+            image_cache.digest_build_context('FROM x', {self.path: None},
+                                             'other_base'))
+        with open(self.path, 'w') as f:
+            f.write('vm: false')
+        self.assertNotEqual(
+            digest,
+            image_cache.digest_build_context('FROM x', {self.path: None},
+                                             'base'))
+
+
+class DirectoryDigestTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(DirectoryDigestTest, self).setUp()
+        self.app_dir = tempfile.mkdtemp()
+        for name, contents in (('Dockerfile', 'FROM x'),
+                               ('app.yaml', 'vm: true'),
+                               ('.dockerignore', 'scratch')):
+            with open(os.path.join(self.app_dir, name), 'w') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        super(DirectoryDigestTest, self).tearDown()
+        shutil.rmtree(self.app_dir)
+
+    def test_dockerignore_respected(self):
+        digest = image_cache.digest_directory(self.app_dir)
+
+        # Ignored files aren't part of the build context.
+        with open(os.path.join(self.app_dir, 'scratch'), 'w') as f:
+            f.write('notes')
+        self.assertEqual(digest, image_cache.digest_directory(self.app_dir))
+
+        with open(os.path.join(self.app_dir, 'main.py'), 'w') as f:
+            f.write('print 1')
+        self.assertNotEqual(digest,
+                            image_cache.digest_directory(self.app_dir))
+
+    def test_base_images(self):
+        self.assertEqual(image_cache.dockerfile_bases(self.app_dir), ['x'])
+        digest = image_cache.digest_directory(self.app_dir, ['id1'])
+        self.assertEqual(digest,
+                         image_cache.digest_directory(self.app_dir, ['id1']))
+        self.assertNotEqual(digest,
+                            image_cache.digest_directory(self.app_dir,
+                                                         ['id2']))
+
+    def test_unchanged_files_not_read(self):
+        digest = image_cache.digest_directory(self.app_dir)
+
+        hashed = []
+        real_hash_file = image_cache.hash_file
+        def counting_hash_file(path, hasher):
+            hashed.append(path)
+            real_hash_file(path, hasher)
+        self.stubs.Set(image_cache, 'hash_file', counting_hash_file)
+
+        self.assertEqual(digest, image_cache.digest_directory(self.app_dir))
+        self.assertEqual(hashed, [])
+
+        # Modified files are hashed again.
+        app_yaml = os.path.join(self.app_dir, 'app.yaml')
+        with open(app_yaml, 'w') as f:
+            f.write('vm: true\n')
+        self.assertNotEqual(digest,
+                            image_cache.digest_directory(self.app_dir))
+        self.assertEqual(hashed, [app_yaml])
+
+
+class ImageCacheTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(ImageCacheTest, self).setUp()
+        self.cache = image_cache.ImageCache(fake_docker.FakeDockerClient(),
+                                            'repo',
+                                            max_images=2)
+
+    def test_lookup(self):
+        name = self.cache.image_name('0123456789abcdef0123')
+        self.assertEqual(name, 'repo:0123456789abcdef')
+        self.assertFalse(self.cache.lookup(name))
+
+        fake_docker.images.append(name)
+        self.assertTrue(self.cache.lookup(name))
+
+    def test_lru_eviction(self):
+        for name in ('repo:a', 'repo:b', 'repo:c'):
+            fake_docker.images.append(name)
+
+        self.cache.record('repo:a')
+        self.cache.record('repo:b')
+
+        # Using 'a' again makes 'b' the least recently used image.
+        self.assertTrue(self.cache.lookup('repo:a'))
+        self.cache.record('repo:c')
+
+        self.assertIn('repo:a', fake_docker.images)
+        self.assertNotIn('repo:b', fake_docker.images)
+        self.assertIn('repo:c', fake_docker.images)
+
+    def test_images_in_use_are_kept(self):
+        for name in ('repo:a', 'repo:b', 'repo:c'):
+            fake_docker.images.append(name)
+        dclient = fake_docker.FakeDockerClient()
+        dclient.create_container(name='cont', image='repo:a')
+
+        # 'a' can't be removed while the container uses it, so it's removed
+        # once it's no longer used instead.
+        self.cache.record('repo:a')
+        self.cache.record('repo:b')
+        self.cache.record('repo:c')
+        self.assertIn('repo:a', fake_docker.images)
+
+        dclient.remove_container('cont')
+        self.cache.record('repo:c')
+        self.assertNotIn('repo:a', fake_docker.images)
+
+    def test_recorded_image_is_kept(self):
+        cache = image_cache.ImageCache(fake_docker.FakeDockerClient(),
+                                       'repo',
+                                       max_images=0)
+        for name in ('repo:a', 'repo:b'):
+            fake_docker.images.append(name)
+            cache.record(name)
+        self.assertNotIn('repo:a', fake_docker.images)
+        self.assertIn('repo:b', fake_docker.images)
+
+    def test_missing_images_are_forgotten(self):
+        self.cache.record('repo:a')
+        self.cache.record('repo:b')
+        self.cache.record('repo:c')
+        self.assertNotIn('repo:a', self.cache._load_index())
+
+    def test_concurrent_records(self):
+        cache = image_cache.ImageCache(fake_docker.FakeDockerClient(),
+                                       'repo',
+                                       max_images=20)
+        names = ['repo:{0}'.format(i) for i in range(20)]
+        threads = [threading.Thread(target=cache.record, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(cache._load_index()), sorted(names))
+
+if __name__ == '__main__':
+    unittest.main()
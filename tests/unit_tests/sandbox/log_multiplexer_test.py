@@ -0,0 +1,199 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.log_multiplexer."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import logging
+import unittest
+
+from appstart import utils
+from appstart.sandbox import container
+from appstart.sandbox import log_multiplexer
+from fakes import fake_docker
+
+
+class LogMultiplexerTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(LogMultiplexerTest, self).setUp()
+        fake_docker.images.append('temp')
+        self.dclient = fake_docker.FakeDockerClient()
+        self.lines = []
+        self.multiplexer = log_multiplexer.LogMultiplexer(
+            self.dclient, sink=lambda *line: self.lines.append(line), tail=2)
+
+        self.conts = []
+        for name in ('app', 'devappserver'):
+            cont = container.Container(self.dclient)
+            cont.create(name=name, image='temp')
+            fake_docker.container_logs[cont.get_id()] = []
+            self.multiplexer.add(cont)
+            self.conts.append(cont)
+
+    def write(self, cont, *lines):
+        logs = fake_docker.container_logs[cont.get_id()]
+        for line in lines:
+            logs.append(('2015-10-10T13:55:{0:02d}.5Z'.format(len(logs)),
+                         line))
+
+    def test_poll(self):
+        app, devappserver = self.conts
+        self.write(app, 'a1')
+        self.write(devappserver, 'd1')
+        self.assertEqual(self.multiplexer.poll(), 2)
+        self.assertEqual(self.multiplexer.poll(), 0)
+
+        self.write(app, 'a2')
+        self.multiplexer.poll()
+        self.assertEqual(self.lines, [('app', 'a1'), ('devappserver', 'd1'),
+                                      ('app', 'a2')])
+
+    def test_window_grows_when_behind(self):
+        app, _ = self.conts
+        self.write(app, 'a1')
+        self.multiplexer.poll()
+
+        # More lines than the window holds: it's widened and read again
+        # before anything is emitted, so none are missed.
+        self.write(app, 'a2', 'a3', 'a4')
+        self.multiplexer.poll()
+        self.assertEqual(self.lines, [('app', 'a1'), ('app', 'a2'),
+                                      ('app', 'a3'), ('app', 'a4')])
+
+        self.write(app, 'a5', 'a6', 'a7', 'a8', 'a9')
+        self.multiplexer.poll()
+        self.assertEqual(self.lines[4:], [('app', 'a5'), ('app', 'a6'),
+                                          ('app', 'a7'), ('app', 'a8'),
+                                          ('app', 'a9')])
+
+    def test_window_shrinks_when_idle(self):
+        app, _ = self.conts
+        self.write(app, 'a1')
+        self.multiplexer.poll()
+        self.write(app, 'a2', 'a3', 'a4', 'a5', 'a6')
+        self.multiplexer.poll()
+        state = self.multiplexer._followed[0]
+        self.assertEqual(state.tail, 8)
+
+        for _ in range(3):
+            self.multiplexer.poll()
+        self.assertEqual(state.tail, 2)
+
+        self.write(app, 'a7')
+        self.multiplexer.poll()
+        self.assertEqual(len(self.lines), 7)
+
+    def test_warns_when_lines_are_skipped(self):
+        app, _ = self.conts
+        self.write(app, 'a1')
+        self.multiplexer.poll()
+        self.write(app, *['a{0}'.format(i) for i in range(2, 10)])
+
+        warnings = []
+        handler = logging.Handler(logging.WARNING)
+        handler.emit = warnings.append
+        logger = utils.get_logger()
+        logger.addHandler(handler)
+        max_tail = log_multiplexer.MAX_TAIL
+        log_multiplexer.MAX_TAIL = 4
+        try:
+            self.multiplexer.poll()
+        finally:
+            log_multiplexer.MAX_TAIL = max_tail
+            logger.removeHandler(handler)
+
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(self.lines[1:], [('app', 'a6'), ('app', 'a7'),
+                                          ('app', 'a8'), ('app', 'a9')])
+
+    def test_same_timestamps(self):
+        app, _ = self.conts
+        logs = fake_docker.container_logs[app.get_id()]
+        logs.append(('2015-10-10T13:55:36Z', 'a1'))
+        self.multiplexer.poll()
+
+        # Lines within the same second are told apart by their position.
+        logs.append(('2015-10-10T13:55:36Z', 'a2'))
+        self.multiplexer.poll()
+        self.multiplexer.poll()
+        self.assertEqual(self.lines, [('app', 'a1'), ('app', 'a2')])
+
+    def test_same_timestamps_beyond_window(self):
+        app, _ = self.conts
+        logs = fake_docker.container_logs[app.get_id()]
+        logs.append(('2015-10-10T13:55:36Z', 'a1'))
+        self.multiplexer.poll()
+
+        # The window only holds a2 and a3, which can't be told from a1 by
+        # their timestamp. A wider window shows where the run starts.
+        logs.append(('2015-10-10T13:55:36Z', 'a2'))
+        logs.append(('2015-10-10T13:55:36Z', 'a3'))
+        self.multiplexer.poll()
+        self.assertEqual(self.lines, [('app', 'a1'), ('app', 'a2'),
+                                      ('app', 'a3')])
+
+    def test_carriage_returns(self):
+        app, _ = self.conts
+        self.write(app, 'progress 10%\rdone')
+        self.multiplexer.poll()
+        self.write(app, 'a2', 'a3')
+        self.multiplexer.poll()
+        self.assertEqual(self.lines, [('app', 'progress 10%\rdone'),
+                                      ('app', 'a2'), ('app', 'a3')])
+
+    def test_split_logs(self):
+        lines = log_multiplexer.split_logs(
+            '2015-10-10T13:55:36.5Z a\rb\nnot a line\n'
+            '2015-10-10T13:55:37Z c\n')
+        self.assertEqual([message for _, message in lines], ['a\rb', 'c'])
+
+    def test_stats(self):
+        app, devappserver = self.conts
+        self.write(app, 'a1', 'a2')
+        self.write(devappserver, 'ddd')
+        self.multiplexer.poll()
+        self.multiplexer.poll()
+
+        stats = self.multiplexer.stats()
+        self.assertEqual(stats['polls'], 4)
+        self.assertEqual(stats['lines'], 3)
+        self.assertEqual(stats['bytes'], 10)
+        self.assertEqual(stats['app_lines'], 2)
+        self.assertEqual(stats['devappserver_bytes'], 4)
+
+    def test_removed_containers_are_dropped(self):
+        app, devappserver = self.conts
+        self.write(app, 'a1')
+        self.multiplexer.poll()
+        app.remove()
+        self.write(devappserver, 'd1')
+        self.assertEqual(self.multiplexer.poll(), 1)
+        self.assertEqual(self.multiplexer.stats()['lines'], 2)
+
+    def test_stop_flushes(self):
+        self.multiplexer.start()
+        self.write(self.conts[0], 'a1')
+        self.multiplexer.stop()
+        self.assertIn(('app', 'a1'), self.lines)
+
+    def test_parse_timestamp(self):
+        self.assertLess(
+            log_multiplexer.parse_timestamp('2015-10-10T13:55:36Z'),
+            log_multiplexer.parse_timestamp('2015-10-10T13:55:36.05Z'))
+
+if __name__ == '__main__':
+    unittest.main()
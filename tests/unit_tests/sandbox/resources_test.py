@@ -0,0 +1,126 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.resources."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import unittest
+
+from appstart import utils
+from appstart.sandbox import resources
+
+
+class ResourcesTest(unittest.TestCase):
+
+    def test_parse_limits(self):
+        self.assertEqual(resources.parse_limits(None, 'app'), {})
+        self.assertEqual(
+            resources.parse_limits(['memory=1k', 'memory_swap=-1',
+                                    'cpu_shares=512', 'cpu_period=50000',
+                                    'cpus=2', 'cpuset=0-1,3',
+                                    'ulimit=nofile=1024:2048',
+                                    'ulimit=nproc=64'], 'app'),
+            {'memory': 1024,
+             'memory_swap': -1,
+             'cpu_shares': 512,
+             'cpu_period': 50000,
+             'cpu_quota': 100000,
+             'cpuset': '0-1,3',
+             'ulimits': [{'Name': 'nofile', 'Soft': 1024, 'Hard': 2048},
+                         {'Name': 'nproc', 'Soft': 64, 'Hard': 64}]})
+
+    def test_cpus_with_period(self):
+        for specs in (['cpus=1.5', 'cpu_period=50000'],
+                      ['cpu_period=50000', 'cpus=1.5']):
+            limits = resources.parse_limits(specs, 'app')
+            self.assertEqual(limits['cpu_period'], 50000)
+            self.assertEqual(limits['cpu_quota'], 75000)
+        for specs in (['cpus=1', 'cpu_quota=50000'],
+                      ['cpu_quota=50000', 'cpus=1']):
+            with self.assertRaises(utils.AppstartAbort):
+                resources.parse_limits(specs, 'app')
+
+    def test_bad_limits(self):
+        for spec in ['memory', 'memory=', 'disk=1g', 'cpu_shares=half',
+                     'cpus=0', 'cpuset=first', 'ulimit=nofile']:
+            with self.assertRaises(utils.AppstartAbort):
+                resources.parse_limits([spec], 'app')
+
+    def test_container_limits(self):
+        limits = resources.ContainerLimits(
+            ['memory=1k', 'cpu_shares=512', 'cpuset=0'], 'app',
+            api_version='1.17')
+        self.assertTrue(limits)
+        self.assertEqual(limits.create_kwargs, {'mem_limit': 1024,
+                                                'cpu_shares': 512,
+                                                'cpuset': '0'})
+        self.assertEqual(limits.host_config, {})
+
+        self.assertEqual(limits.api_version, '1.17')
+
+        # Quotas, periods and ulimits need a newer API.
+        self.assertEqual(resources.ContainerLimits(
+            ['ulimit=nofile=1024'], 'app', api_version='1.17').api_version,
+                         '1.18')
+        for spec in ('cpus=1', 'cpu_quota=50000', 'cpu_period=50000'):
+            limits = resources.ContainerLimits([spec], 'app',
+                                               api_version='1.17')
+            self.assertEqual(limits.api_version, '1.19')
+
+        limits = resources.ContainerLimits(
+            ['memory=1k', 'cpus=1.5', 'cpu_shares=512',
+             'ulimit=nofile=1024'], 'app', api_version='1.17')
+        self.assertEqual(limits.api_version, '1.19')
+        self.assertEqual(limits.create_kwargs, {'cpu_shares': 512})
+        self.assertEqual(
+            limits.host_config,
+            {'Memory': 1024,
+             'CpuPeriod': 100000,
+             'CpuQuota': 150000,
+             'Ulimits': [{'Name': 'nofile', 'Soft': 1024, 'Hard': 1024}]})
+
+        self.assertFalse(resources.ContainerLimits(None, 'app'))
+
+    def test_mismatches(self):
+        limits = resources.ContainerLimits(['memory=1k', 'cpuset=0'], 'app',
+                                           api_version='1.17')
+        self.assertEqual(limits.mismatches({'memory': 1024, 'cpuset': '0'}),
+                         [])
+        self.assertEqual(limits.mismatches({'memory': 0, 'cpuset': '0'}),
+                         ['memory: requested 1024, applied 0'])
+
+    def test_applied(self):
+        limits = resources.applied({'HostConfig': {'Memory': 1024,
+                                                   'CpusetCpus': '0',
+                                                   'Ulimits': None}})
+        self.assertEqual(limits['memory'], 1024)
+        self.assertEqual(limits['cpu_shares'], 0)
+        self.assertEqual(limits['ulimits'], [])
+        self.assertEqual(resources.describe(limits), 'memory=1024, cpuset=0')
+        self.assertEqual(resources.describe(resources.applied({})),
+                         'unlimited')
+
+        # Older dockers report some limits in the container's Config.
+        limits = resources.applied({'HostConfig': {'Memory': 0},
+                                    'Config': {'Memory': 2048,
+                                               'CpuShares': 512,
+                                               'Cpuset': '1'}})
+        self.assertEqual(limits['memory'], 2048)
+        self.assertEqual(limits['cpu_shares'], 512)
+        self.assertEqual(limits['cpuset'], '1')
+
+if __name__ == '__main__':
+    unittest.main()
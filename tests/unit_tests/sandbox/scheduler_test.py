@@ -0,0 +1,101 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.sandbox.scheduler."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import threading
+import unittest
+
+from appstart.sandbox import scheduler
+
+
+class StartupSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sched = scheduler.StartupScheduler()
+        self.finished = []
+
+    def step(self, name, result=None, wait_for=None):
+        def func():
+            if wait_for:
+                # Fail rather than hang if the steps don't run concurrently.
+                if not wait_for.wait(5):
+                    raise AssertionError('{0} ran alone'.format(name))
+            self.finished.append(name)
+            return result
+        return func
+
+    def test_dependency_order(self):
+        self.sched.add('c', self.step('c'), deps=['a', 'b'])
+        self.sched.add('a', self.step('a', result=1))
+        self.sched.add('b', self.step('b'), deps=['a'])
+        self.sched.run()
+
+        self.assertEqual(self.finished, ['a', 'b', 'c'])
+        self.assertEqual(self.sched.results['a'], 1)
+        self.assertItemsEqual(self.sched.timings, ['a', 'b', 'c'])
+
+    def test_independent_steps_overlap(self):
+        a_running = threading.Event()
+        b_running = threading.Event()
+
+        def a():
+            a_running.set()
+            self.step('a', wait_for=b_running)()
+
+        def b():
+            b_running.set()
+            self.step('b', wait_for=a_running)()
+
+        self.sched.add('a', a)
+        self.sched.add('b', b)
+        self.sched.run()
+        self.assertItemsEqual(self.finished, ['a', 'b'])
+
+    def test_failure(self):
+        fail_now = threading.Event()
+
+        def fail():
+            fail_now.wait(5)
+            raise ValueError('failed')
+
+        def slow():
+            fail_now.set()
+            self.step('slow')()
+
+        self.sched.add('fail', fail)
+        self.sched.add('slow', slow)
+        self.sched.add('dependent', self.step('dependent'), deps=['fail'])
+        with self.assertRaises(ValueError):
+            self.sched.run()
+
+        # Steps that were running are allowed to finish, but nothing new is
+        # started.
+        self.assertEqual(self.finished, ['slow'])
+
+    def test_bad_dependencies(self):
+        self.sched.add('a', self.step('a'), deps=['b'])
+        with self.assertRaises(ValueError):
+            self.sched.run()
+
+        self.sched.add('b', self.step('b'), deps=['a'])
+        with self.assertRaises(ValueError):
+            self.sched.run()
+        self.assertEqual(self.finished, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for appstart.tracing."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import unittest
+
+from appstart import tracing
+from fakes import fake_docker
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+
+    def test_nested_spans(self):
+        with self.tracer.span('outer'):
+            with self.tracer.span('inner', args={'detail': 'x'}):
+                pass
+
+        outer, inner = self.tracer.spans()
+        self.assertEqual((outer.name, outer.depth), ('outer', 0))
+        self.assertEqual((inner.name, inner.depth), ('inner', 1))
+        self.assertEqual(inner.args, {'detail': 'x'})
+        self.assertLessEqual(outer.start, inner.start)
+        self.assertGreaterEqual(outer.end, inner.end)
+
+        # One line per span, plus a header and the total.
+        self.assertEqual(len(self.tracer.waterfall()), 4)
+
+    def test_chrome_trace(self):
+        with self.tracer.span('step', 'phase'):
+            pass
+        event, = self.tracer.chrome_trace()['traceEvents']
+        self.assertEqual(event['name'], 'step')
+        self.assertEqual(event['cat'], 'phase')
+        self.assertEqual(event['ph'], 'X')
+        self.assertGreaterEqual(event['dur'], 0)
+
+    def test_null_tracer(self):
+        tracer = tracing.NullTracer()
+        with tracer.span('step'):
+            pass
+        self.assertEqual(tracer.spans(), [])
+        self.assertEqual(tracer.waterfall(), [])
+
+
+class TracedClientTest(fake_docker.FakeDockerTestBase):
+
+    def setUp(self):
+        super(TracedClientTest, self).setUp()
+        self.tracer = tracing.Tracer()
+        self.dclient = tracing.TracedClient(fake_docker.FakeDockerClient(),
+                                            self.tracer)
+
+    def test_calls_are_traced(self):
+        fake_docker.images.append('temp_image')
+        self.dclient.create_container(name='temp', image='temp_image')
+        span, = self.tracer.spans()
+        self.assertEqual(span.name, 'docker.create_container')
+        self.assertEqual(span.args, {'name': 'temp', 'image': 'temp_image'})
+
+        # Attributes are passed through untouched.
+        self.assertEqual(self.dclient.base_url,
+                         fake_docker.FakeDockerClient().base_url)
+
+    def test_streams_are_traced(self):
+        fake_docker.exec_output = ['a', 'b']
+        stream = self.dclient.exec_start('exec_id', stream=True)
+        self.assertEqual(len(self.tracer.spans()), 1)
+        self.assertEqual(''.join(stream), 'ab')
+        self.assertEqual([s.name for s in self.tracer.spans()],
+                         ['docker.exec_start', 'docker.exec_start:stream'])
+
+    def test_file_replies_are_not_wrapped(self):
+        fake_docker.images.append('temp_image')
+        cont = self.dclient.create_container(name='temp', image='temp_image')
+        fake_docker.archives['/app'] = 'archive'
+        reply = self.dclient.copy(cont['Id'], '/app')
+        self.assertEqual(reply.read(), 'archive')
+        reply.close()
+        self.assertEqual([s.name for s in self.tracer.spans()],
+                         ['docker.create_container', 'docker.copy'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,7 @@ import textwrap
 import unittest
 
 import docker
+import requests
 
 from fakes import fake_docker
 from appstart import utils
@@ -49,6 +50,31 @@ class DockerTest(fake_docker.FakeDockerTestBase):
         self.assertIn('tls', dclient.kwargs)
         self.assertIn('base_url', dclient.kwargs)
 
+    def test_docker_client_is_pooled(self):
+        os.environ['DOCKER_HOST'] = 'tcp://192.168.59.103:2376'
+        os.environ['DOCKER_TLS_VERIFY'] = '1'
+        os.environ['DOCKER_CERT_PATH'] = CERT_PATH
+
+        dclient = utils.get_docker_client()
+        self.assertIs(utils.get_docker_client(), dclient)
+
+        stats = utils.get_docker_client_pool().stats()
+        self.assertEqual(stats['clients_created'], 1)
+        self.assertEqual(stats['clients_reused'], 1)
+
+        # A different docker host gets a different client.
+        os.environ['DOCKER_HOST'] = 'tcp://192.168.59.104:2376'
+        self.assertIsNot(utils.get_docker_client(), dclient)
+
+    def test_failed_client_is_discarded(self):
+        def fail_ping(unused_self):
+            raise requests.exceptions.ConnectionError('no daemon')
+
+        self.stubs.Set(fake_docker.FakeDockerClient, 'ping', fail_ping)
+        with self.assertRaises(utils.AppstartAbort):
+            utils.get_docker_client()
+        self.assertEqual(utils.get_docker_client_pool()._clients, {})
+
     def test_build_from_directory(self):
         utils.build_from_directory(APP_DIR, 'test')
         self.assertEqual(len(fake_docker.images),
@@ -103,6 +129,30 @@ class TarTest(unittest.TestCase):
         self.assertEqual(tar.extractfile('foo.txt').read(), 'foo')
         self.assertEqual(tar.extractfile('baz/bar.txt').read(), 'bar')
 
+    def test_stream_build_context(self):
+        dockerfile = io.BytesIO('FROM debian'.encode('utf-8'))
+        context_files = {self.tempfile1.name: 'foo.txt',
+                         self.tempfile2.name: '/baz/bar.txt'}
+
+        # Use a tiny chunk size to exercise reading files in pieces.
+        chunks = list(utils.stream_tar_build_context(dockerfile,
+                                                     context_files,
+                                                     chunk_size=2))
+        self.assertGreater(len(chunks), len(context_files) + 1)
+        tar = tarfile.open(fileobj=io.BytesIO(''.join(chunks)))
+        self.assertEqual(tar.extractfile('Dockerfile').read(), 'FROM debian')
+        self.assertEqual(tar.extractfile('foo.txt').read(), 'foo')
+        self.assertEqual(tar.extractfile('baz/bar.txt').read(), 'bar')
+
+    def test_stream_gzipped_build_context(self):
+        dockerfile = io.BytesIO('FROM debian'.encode('utf-8'))
+        context_files = {self.tempfile1.name: 'foo.txt'}
+
+        context = ''.join(utils.stream_tar_build_context(
+            dockerfile, context_files, compresslevel=6))
+        tar = tarfile.open(fileobj=io.BytesIO(context), mode='r:gz')
+        self.assertEqual(tar.extractfile('foo.txt').read(), 'foo')
+
     def test_tar_wrapper(self):
         temp = tempfile.NamedTemporaryFile()
         tar = tarfile.open(mode='w', fileobj=temp)
@@ -137,6 +187,12 @@ class TarTest(unittest.TestCase):
         self.assertEqual(dirs, ['baz'])
         with self.assertRaises(ValueError):
             wrapped_tar.list('root/bar.txt')
+        with self.assertRaises(KeyError):
+            wrapped_tar.list('root/qux')
+
+        self.assertEqual(list(wrapped_tar.walk('/root/')),
+                         [('root', ['baz'], ['bar.txt']),
+                          ('root/baz', [], ['foo.txt'])])
 
 
 class FileCollectionTest(unittest.TestCase):
@@ -174,6 +230,13 @@ class FileCollectionTest(unittest.TestCase):
             data,
             dict((name, None) for name in self.files))
 
+    def test_bad_config_file(self):
+        for contents in ('handlers: [', '', 'handlers:\n- 1\n'):
+            with open(self.config_file, 'w') as f:
+                f.write(contents)
+            with self.assertRaises(utils.AppstartAbort):
+                utils.static_dirs(self.config_file)
+
 
 class LoggerTest(unittest.TestCase):
 
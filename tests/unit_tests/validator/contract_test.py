@@ -22,6 +22,7 @@ import os
 import stat
 import tempfile
 import textwrap
+import threading
 
 from appstart import utils
 from appstart.sandbox import container_sandbox
@@ -410,6 +411,59 @@ class HookClauseTest(ClauseTestBase):
         types = [type(obj) for obj in ordering]
         self.assertEqual(types, [Test0, Test1, Test2, Test3])
 
+    def test_parallel_evaluation(self):
+        """Test that independent clauses are evaluated concurrently."""
+        a_running = threading.Event()
+        b_running = threading.Event()
+        reported = []
+
+        class TestA(contract.ContractClause):
+            title = 'test a'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+
+            def evaluate_clause(self, app_container):
+                a_running.set()
+                self.assertTrue(b_running.wait(5), 'B never ran alongside A')
+
+        class TestB(contract.ContractClause):
+            title = 'test b'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+
+            def evaluate_clause(self, app_container):
+                b_running.set()
+                self.assertTrue(a_running.wait(5), 'A never ran alongside B')
+
+        class TestC(contract.ContractClause):
+            title = 'test c'
+            description = 'test'
+            lifecycle_point = contract.POST_START
+            dependencies = {TestA, TestB}
+
+            def evaluate_clause(self, app_container):
+                self.assertTrue(a_running.is_set() and b_running.is_set())
+
+        class GoodModule(object):
+            test_a = TestA
+            test_b = TestB
+            test_c = TestC
+
+        real_add_success = contract.ContractTestResult.addSuccess
+        def add_success(result, test):
+            reported.append(type(test))
+            real_add_success(result, test)
+        self.stubs.Set(contract.ContractTestResult, 'addSuccess', add_success)
+
+        validator = contract.ContractValidator(GoodModule,
+                                               config_file=self.conf_file)
+        expected_order = [type(c) for c in validator.contract[
+            contract.POST_START]]
+        self.assertTrue(validator.validate(threshold='UNUSED', jobs=4))
+
+        # Results are reported in contract order.
+        self.assertEqual(reported, expected_order)
+
     def tearDown(self):
         super(HookClauseTest, self).tearDown()
         logging.getLogger('appstart.validator').disabled = False
@@ -0,0 +1,171 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.log_access."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from appstart.validator import contract
+from appstart.validator import log_access
+
+
+def make_log_tar(files):
+    """Make an archive like docker's copy of /var/log/app_engine."""
+    buf = io.BytesIO()
+    tar = tarfile.open(mode='w', fileobj=buf)
+    dirs = {'app_engine'}
+    for name in files:
+        parts = name.split('/')[:-1]
+        for i in range(len(parts)):
+            dirs.add('/'.join(['app_engine'] + parts[:i + 1]))
+    for name in sorted(dirs):
+        tinfo = tarfile.TarInfo(name)
+        tinfo.type = tarfile.DIRTYPE
+        tar.addfile(tinfo)
+    for name, contents in files.iteritems():
+        tinfo = tarfile.TarInfo('app_engine/' + name)
+        tinfo.size = len(contents)
+        tar.addfile(tinfo, io.BytesIO(contents))
+    tar.close()
+    buf.seek(0)
+    return buf
+
+
+class FakeContainer(object):
+
+    def __init__(self, files, host='0.0.0.0', log_path=None):
+        self.files = files
+        self.copies = 0
+        self.host = host
+        self.log_path = log_path
+
+    def get_id(self):
+        return 'container_id'
+
+    def iter_tar(self, path):
+        self.copies += 1
+        if self.files is None:
+            raise IOError('File could not be found at {0}.'.format(path))
+        tar = tarfile.open(fileobj=make_log_tar(self.files), mode='r|')
+        for tinfo in tar:
+            yield tinfo, tar.extractfile(tinfo) if tinfo.isfile() else None
+
+
+class LogSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = log_access.LogSnapshotCache()
+        self.container = FakeContainer({'request.log': 'a\nb\n',
+                                        'custom_logs/x.log': 'x',
+                                        'custom_logs/sub/y.log': 'y'})
+
+    def test_snapshot_contents(self):
+        logs = self.cache.get(self.container, contract.POST_START)
+        self.assertTrue(logs.exists('/var/log/app_engine/request.log'))
+        self.assertFalse(logs.exists('/var/log/app_engine/app.log.json'))
+        self.assertFalse(logs.exists('/etc/passwd'))
+        self.assertEqual(
+            logs.get_file('/var/log/app_engine/request.log').read(), 'a\nb\n')
+        self.assertEqual(logs.list('/var/log/app_engine/custom_logs'),
+                         (['x.log'], ['sub']))
+        with self.assertRaises(IOError):
+            logs.get_file('/var/log/app_engine/app.log.json')
+        with self.assertRaises(ValueError):
+            logs.get_file('/var/log/app_engine/custom_logs')
+        with self.assertRaises(ValueError):
+            logs.list('/var/log/app_engine/request.log')
+
+        # Every call gets its own reader of the file.
+        first = logs.get_file('/var/log/app_engine/request.log')
+        self.assertEqual(first.readline(), 'a\n')
+        second = logs.get_file('/var/log/app_engine/request.log')
+        self.assertEqual(second.read(), 'a\nb\n')
+        self.assertEqual(first.tell(), 2)
+        self.assertEqual(first.read(), 'b\n')
+        second.seek(-2, os.SEEK_END)
+        self.assertEqual(list(second), ['b\n'])
+
+    def test_snapshot_is_shared(self):
+        logs = self.cache.get(self.container, contract.POST_START)
+        self.assertIs(self.cache.get(self.container, contract.POST_START),
+                      logs)
+        self.assertEqual(self.container.copies, 1)
+
+        # A new lifecycle point means a new snapshot.
+        self.cache.get(self.container, contract.POST_STOP)
+        self.assertEqual(self.container.copies, 2)
+
+        self.cache.invalidate()
+        self.cache.get(self.container, contract.POST_STOP)
+        self.assertEqual(self.container.copies, 3)
+
+    def test_missing_log_directory(self):
+        logs = self.cache.get(FakeContainer(None), contract.POST_START)
+        self.assertFalse(logs.exists('/var/log/app_engine/request.log'))
+        with self.assertRaises(IOError):
+            logs.list('/var/log/app_engine/custom_logs')
+
+class HostLogSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.log_path, 'custom_logs', 'sub'))
+        for name, contents in (('request.log', 'a\nb\n'),
+                               ('custom_logs/x.log', 'x'),
+                               ('custom_logs/empty.log', '')):
+            with open(os.path.join(self.log_path, name), 'w') as f:
+                f.write(contents)
+        self.cache = log_access.LogSnapshotCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_path)
+
+    def test_local_daemon_reads_bind_mount(self):
+        cont = FakeContainer(None, host='localhost', log_path=self.log_path)
+        logs = self.cache.get(cont, contract.POST_START)
+        self.assertTrue(logs.exists('/var/log/app_engine/request.log'))
+        self.assertFalse(logs.exists('/var/log/app_engine/app.log.json'))
+        self.assertEqual(
+            list(logs.get_file('/var/log/app_engine/request.log')),
+            ['a\n', 'b\n'])
+        self.assertEqual(
+            logs.get_file('/var/log/app_engine/custom_logs/empty.log').read(),
+            '')
+        files, dirs = logs.list('/var/log/app_engine/custom_logs')
+        self.assertItemsEqual(files, ['x.log', 'empty.log'])
+        self.assertEqual(dirs, ['sub'])
+        with self.assertRaises(IOError):
+            logs.get_file('/var/log/app_engine/app.log.json')
+
+        # Nothing was copied out of the container.
+        self.assertEqual(cont.copies, 0)
+
+    def test_remote_daemon_copies(self):
+        cont = FakeContainer({'request.log': 'a\n'}, host='192.168.99.100',
+                             log_path=self.log_path)
+        logs = self.cache.get(cont, contract.POST_START)
+        self.assertEqual(
+            logs.get_file('/var/log/app_engine/request.log').read(), 'a\n')
+        self.assertEqual(cont.copies, 1)
+
+if __name__ == '__main__':
+    unittest.main()
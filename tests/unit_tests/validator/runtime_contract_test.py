@@ -0,0 +1,157 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for validator.runtime_contract."""
+
+# This file conforms to the external style guide.
+# pylint: disable=bad-indentation, g-bad-import-order
+
+import json
+import StringIO
+import stubout
+import unittest
+
+from appstart.validator import log_access
+from appstart.validator import runtime_contract
+
+
+def json_line(**overrides):
+    entry = {'timestamp': {'seconds': 1, 'nanos': 2},
+             'severity': 'INFO',
+             'thread': 'main',
+             'message': 'hello'}
+    entry.update(overrides)
+    return json.dumps(entry)
+
+
+class Checker(unittest.TestCase, runtime_contract.LogFormatChecker):
+
+    def runTest(self):
+        pass
+
+
+class JsonLogFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = Checker()
+
+        # Small chunks, so that lines straddle chunk boundaries.
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(log_access, 'CHUNK_SIZE', 7)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def test_good_log(self):
+        log = '\n'.join([json_line(), json_line(severity='ERROR'),
+                         json_line()])
+        stats = self.checker.check_json_log_format(StringIO.StringIO(log))
+        self.assertEqual(stats.lines, 3)
+        self.assertEqual(stats.bad_lines, 0)
+        self.assertEqual(dict(stats.severities), {'INFO': 2, 'ERROR': 1})
+
+    def test_bad_lines_are_all_reported(self):
+        lines = [json_line(),
+                 'not json',
+                 json.dumps({'severity': 'INFO'}),
+                 json_line(timestamp={'seconds': 1}),
+                 json_line()]
+        with self.assertRaises(AssertionError) as ctx:
+            self.checker.check_json_log_format(
+                StringIO.StringIO('\n'.join(lines)))
+        message = str(ctx.exception)
+        self.assertIn('3 of 5 lines improperly formatted', message)
+        self.assertIn('line 2', message)
+        self.assertIn('line 3: Log message missing "timestamp"', message)
+        self.assertIn('line 4: Timestamps must have fields', message)
+        self.assertIn('Severities: INFO=2', message)
+
+
+COMMON_LINE = ('127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] '
+               '"GET /apache_pb.gif HTTP/1.0" 200 2326')
+COMBINED_LINE = COMMON_LINE + ' "http://www.example.com/" "Mozilla/4.08"'
+
+
+class AccessLogFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = Checker()
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(log_access, 'CHUNK_SIZE', 100)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def check(self, lines, sample_size=0):
+        return self.checker.check_access_log_format(
+            StringIO.StringIO(''.join(line + '\n' for line in lines)),
+            sample_size)
+
+    def test_match_rates(self):
+        stats = self.check([COMBINED_LINE, COMMON_LINE, COMBINED_LINE,
+                            COMMON_LINE + ' 0.012'])
+        self.assertEqual(stats.lines, 4)
+        self.assertEqual(stats.match_rates(),
+                         [('Combined', 0.5), ('Common', 0.25),
+                          ('Common with extra fields', 0.25)])
+        self.assertIn('Formats: Combined=50.0%', stats.summary())
+
+    def test_extended_format(self):
+        stats = self.check(['#Version: 1.0',
+                            '#Fields: date time cs-method cs-uri',
+                            '2015-10-10 13:55:36 GET "/a b"',
+                            '2015-10-10 13:55:37 GET /c',
+                            COMMON_LINE])
+        self.assertEqual(stats.directives, 2)
+        self.assertEqual(dict(stats.formats), {'Extended': 2, 'Common': 1})
+
+    def test_bad_lines_are_all_reported(self):
+        with self.assertRaises(AssertionError) as ctx:
+            self.check([COMMON_LINE, 'garbage', COMMON_LINE, 'more garbage'])
+        message = str(ctx.exception)
+        self.assertIn('2 of 4 lines improperly formatted', message)
+        self.assertIn('line 2: Line is not in Common', message)
+        self.assertIn('line 4', message)
+        self.assertIn('Formats: Common=50.0%', message)
+
+    def test_empty_log(self):
+        with self.assertRaises(AssertionError) as ctx:
+            self.check([])
+        self.assertIn('No access logs found', str(ctx.exception))
+
+    def test_sampling(self):
+        lines = ['#Fields: date cs-uri'] + ['2015-10-10 /{0}'.format(i)
+                                            for i in range(1000)]
+        stats = self.check(lines, sample_size=50)
+        self.assertTrue(stats.sampled)
+        self.assertGreater(stats.lines, 40)
+        self.assertLessEqual(stats.lines, 50)
+        self.assertEqual(stats.formats['Extended'], stats.lines)
+        self.assertIn('sampled lines', stats.summary())
+
+        # Small files are checked in full.
+        stats = self.check([COMMON_LINE], sample_size=50)
+        self.assertFalse(stats.sampled)
+
+
+class LineBatchTest(unittest.TestCase):
+
+    def test_iter_line_batches(self):
+        logfile = StringIO.StringIO('ab\ncdefgh\n\nij')
+        batches = list(log_access.iter_line_batches(logfile, chunk_size=4))
+        self.assertEqual(sum(batches, []), ['ab', 'cdefgh', '', 'ij'])
+        self.assertGreater(len(batches), 1)
+
+if __name__ == '__main__':
+    unittest.main()